@@ -1,21 +1,40 @@
 #!/usr/bin/env python
 
 import binascii
+import contextlib
 import functools
 import io
 import logging
-import multiprocessing
 import os
 import pprint
+import queue
 import shlex
 import struct
+import threading
+import time
 import uuid
 
 import pygatt
 import pygatt.exceptions
 
+import _uwatch2capture
+import _uwatch2caps
+import _uwatch2connparams
+import _uwatch2events
+import _uwatch2handlerpool
+import _uwatch2iothread
+import _uwatch2journal
+import _uwatch2metrics
+import _uwatch2notifybuf
+import _uwatch2profile
+import _uwatch2singleflight
+import _uwatch2snapshot
+import _uwatch2trace
+
 log = logging.getLogger(__name__)
 
+HEADER_BYTES = bytes([0xFE, 0xEA, 0x10])
+
 
 class Uwatch2Ble(object):
     COMMAND_UUID = uuid.UUID("0000fee2-0000-1000-8000-00805f9b34fb")
@@ -26,6 +45,19 @@ class Uwatch2Ble(object):
     DEFAULT_WATCH_NAME = "Uwatch2"
     DEFAULT_AUTO_RECONNECT = True
     DEFAULT_CONNECT_TIMEOUT_SEC = 60
+    DEFAULT_COMMAND_TIMEOUT_SEC = 10
+    # Notification buffering per characteristic: (policy, max_depth, priority). See
+    # _uwatch2notifybuf. Command responses are never dropped and are always read
+    # before sensor data.
+    DEFAULT_NOTIFICATION_POLICY_DICT = {
+        ASYNC_RESPONSE_UUID: (_uwatch2notifybuf.NEVER_DROP, None, 1),
+        ACCELEROMETER_UUID: (_uwatch2notifybuf.DROP_OLDEST, 16, 10),
+    }
+    # Max time to block on the notification queue before checking for cancellation.
+    CANCEL_POLL_INTERVAL_SEC = 0.1
+    # Time after a query timed out or was cancelled during which a response with the
+    # same cmd_key is taken to be the late response to that query, and dropped.
+    LATE_RESPONSE_WINDOW_SEC = 5.0
 
     def __init__(
         self,
@@ -35,6 +67,16 @@ class Uwatch2Ble(object):
         squelch_pygatt=True,
         scan_as_root=False,
         scan_for_name="Uwatch2",
+        command_timeout_sec=None,
+        journal_path=None,
+        adapter=None,
+        io_thread=False,
+        notification_policy_dict=None,
+        profile_startup=False,
+        handler_pool=None,
+        connection_profile=None,
+        caps_path=None,
+        snapshot_cache_path=None,
     ):
         """
         :param mac_addr: The Bluetooth MAC address of the watch If provided, it is
@@ -43,6 +85,54 @@ class Uwatch2Ble(object):
         is attempted.
 
         squelch_pygatt (bool): Set log level for pygatt to WARNING.
+
+        command_timeout_sec (float): Default max time to wait for the response to a
+        command. Can be overridden per call. WatchTimeoutError is raised if the watch
+        does not respond in time.
+
+        journal_path (str): If provided, settings and messages that are written while
+        the watch is disconnected are queued in a journal file at this path instead of
+        failing. Queued commands are sent when the watch reconnects, including after a
+        restart of the process. Other write commands still fail while the watch is
+        disconnected. See _uwatch2journal.
+
+        adapter: pygatt backend or compatible object to use for connecting to the
+        watch. If not provided, a pygatt.GATTToolBackend is created.
+
+        io_thread (bool): Perform all I/O with the watch on a dedicated thread owned by
+        this object. Commands may then be issued from any number of threads. The I/O
+        thread also handles notifications that arrive while no command is waiting for
+        a response. Without the I/O thread, commands are still serialized by a lock,
+        so the object can be used from several threads either way.
+
+        notification_policy_dict (dict): Buffering of notifications, keyed by
+        characteristic UUID. Each value is a (policy, max_depth, priority) tuple.
+        Overrides entries in DEFAULT_NOTIFICATION_POLICY_DICT. Characteristics that are
+        not listed use the drop_oldest policy with a max depth of
+        _uwatch2notifybuf.DEFAULT_MAX_DEPTH.
+
+        profile_startup (bool): Capture a cProfile profile of connecting to the watch,
+        in addition to the timeline of startup phases that is always recorded. See
+        get_startup_profile().
+
+        handler_pool (_uwatch2handlerpool.HandlerPool): Pool on which event and
+        notification handlers run. If not provided, a pool of
+        _uwatch2handlerpool.DEFAULT_WORKER_COUNT threads is created.
+
+        connection_profile (str): Connection parameter profile to request after
+        connecting: "bulk", "interactive" or "idle". See _uwatch2connparams. Bulk
+        operations then switch to the "bulk" profile while they run. If not provided,
+        the connection parameters are left as negotiated by the backend, until a
+        profile is selected with set_connection_profile().
+
+        caps_path (str): If provided, probe which queries the watch supports, and
+        cache the results in a JSON file at this path, per watch and firmware version.
+        Queries that the watch does not support then raise WatchUnsupportedError
+        without being sent. See _uwatch2caps.
+
+        snapshot_cache_path (str): If provided, persist the static characteristic
+        values and the unreadable characteristics found by read_snapshot() in a JSON
+        file at this path. Otherwise they are cached for the lifetime of this object.
         """
         # We take the liberty of tweaking chatty log output from pygatt even though
         # libraries generally shouldn't touch the logging config.
@@ -57,8 +147,34 @@ class Uwatch2Ble(object):
         self._connect_timeout_sec = (
             connect_timeout_sec or self.DEFAULT_CONNECT_TIMEOUT_SEC
         )
+        self._command_timeout_sec = (
+            command_timeout_sec or self.DEFAULT_COMMAND_TIMEOUT_SEC
+        )
+        self._cancel_event = threading.Event()
+        # cmd_key -> (time until which a late response to a query that timed out or
+        # was cancelled is expected, disconnect count when the query was sent).
+        # Commands sent before a disconnect are never answered after it. Guarded by
+        # _cmd_lock.
+        self._late_response_dict = {}
+        self._disconnect_count = 0
+
+        self._journal = (
+            _uwatch2journal.CommandJournal(journal_path) if journal_path else None
+        )
+        self._is_flushing_journal = False
+
+        # Concurrent identical queries share a single command and response.
+        self._single_flight = _uwatch2singleflight.SingleFlightGroup()
+        # Serializes commands, so that only one command at a time writes packets and
+        # reassembles a response.
+        self._cmd_lock = threading.RLock()
+        self._io_thread = (
+            _uwatch2iothread.IoThread(self._drain_notifications) if io_thread else None
+        )
+        # Write commands held back by coalesce_writes(), per calling thread.
+        self._coalesce_local = threading.local()
 
-        self._adapter = pygatt.GATTToolBackend()
+        self._adapter = adapter or pygatt.GATTToolBackend()
         self._device = None
 
         self._input_str = ""
@@ -68,8 +184,55 @@ class Uwatch2Ble(object):
 
         self._async_response_handle = None
 
-        self._manager = multiprocessing.Manager()
-        self._queue = self._manager.Queue()
+        self._notification_policy_dict = dict(self.DEFAULT_NOTIFICATION_POLICY_DICT)
+        self._notification_policy_dict.update(notification_policy_dict or {})
+        self._queue = _uwatch2notifybuf.NotificationBuffer()
+
+        self._metrics = _uwatch2metrics.Metrics()
+        self._metrics.add_collector(self._collect_notification_metrics)
+
+        # Handlers run on a pool, so that they never block notification handling.
+        self._handler_pool = handler_pool or _uwatch2handlerpool.HandlerPool()
+        # handle -> list of handlers for raw notifications
+        self._notification_handler_dict = {}
+        # Handlers called when the watch disconnects
+        self._disconnect_handler_list = []
+        # Frames that the watch sends on its own are dispatched to handlers by
+        # cmd_key. The event loop handles them while no command is running.
+        self._event_dispatcher = _uwatch2events.EventDispatcher(
+            self._metrics, self._handler_pool
+        )
+        self._event_loop = _uwatch2events.EventLoop(
+            self._queue, self._drain_notifications
+        )
+
+        # Attached tracers. The list object is shared with the notification callbacks,
+        # so it must be modified in place.
+        self._tracer_list = []
+        self._capture_tracer = None
+
+        self._startup_profiler = _uwatch2profile.StartupProfiler(profile_startup)
+
+        # Connection parameters. The base profile is in effect outside of
+        # connection_profile() blocks. None while profiles are not in use.
+        self._base_profile_name = connection_profile
+        if connection_profile is not None:
+            _uwatch2connparams.get_profile(connection_profile)
+        self._profile_lock = threading.Lock()
+        # Serializes parameter updates, which may run hcitool, without holding
+        # _profile_lock.
+        self._profile_apply_lock = threading.Lock()
+        # (token, profile_name) for each active connection_profile() block
+        self._profile_override_list = []
+        self._applied_profile_name = None
+        self._effective_profile = None
+
+        self._caps_cache = (
+            _uwatch2caps.CapabilityCache(caps_path) if caps_path else None
+        )
+        self._caps = None
+
+        self._snapshot_cache = _uwatch2snapshot.SnapshotCache(snapshot_cache_path)
 
         # # Some async command responses are returned by callbacks in multiple chunks.
         # # It looks like the only way to tie these together is to assume that they're
@@ -77,14 +240,32 @@ class Uwatch2Ble(object):
         # self._last_async_response_cmd_key = None
         # self._response_buf = {}
         self._acc_payload_bytes = bytearray()
+        self._acc_cmd_key = None
+        self._acc_chunk_count = 0
+        self._acc_receive_time = None
         self._expected_payload_byte_count = None
+        self._pending_header_bytes = bytearray()
 
     def __enter__(self):
-        self._adapter.start()
-        self._start()
+        self._startup_profiler.start()
+        try:
+            with self._startup_profiler.phase("adapter_start"):
+                self._adapter.start()
+            self._start()
+        finally:
+            self._startup_profiler.stop()
+        if self._io_thread is not None:
+            self._io_thread.start()
+        self._handler_pool.start(self._metrics)
+        self._event_loop.start()
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self._event_loop.stop()
+        self._handler_pool.stop()
+        if self._io_thread is not None:
+            self._io_thread.stop()
+        self.stop_capture()
         if exc_val is not None:
             log.error(f"Uwatch2 context manager exception: {repr(exc_val)}")
             self.recover()
@@ -96,16 +277,52 @@ class Uwatch2Ble(object):
 
     def _start(self):
         log.info("Starting...")
-        self._set_mac_addr()
-        self._connect()
-        self._device.register_disconnect_callback(
-            functools.partial(disconnect_callback, self._queue)
-        )
-        self._device.bond(permanent=True)
-        self._subscribe(self.ASYNC_RESPONSE_UUID)
-        self._subscribe(self.ACCELEROMETER_UUID)
-        self._async_response_handle = self._device.get_handle(self.ASYNC_RESPONSE_UUID)
-        self._accelerometer_handle = self._device.get_handle(self.ACCELEROMETER_UUID)
+        phase = self._startup_profiler.phase
+        with phase("set_mac_addr"):
+            self._set_mac_addr()
+        with phase("connect"):
+            self._connect()
+            self._device.register_disconnect_callback(
+                functools.partial(disconnect_callback, self._queue)
+            )
+        with phase("bond"):
+            self._device.bond(permanent=True)
+        with phase("get_handle"):
+            self._async_response_handle = self._device.get_handle(
+                self.ASYNC_RESPONSE_UUID
+            )
+            self._accelerometer_handle = self._device.get_handle(
+                self.ACCELEROMETER_UUID
+            )
+        with phase("subscribe_async_response"):
+            self._subscribe(self.ASYNC_RESPONSE_UUID)
+        with phase("subscribe_accelerometer"):
+            self._subscribe(self.ACCELEROMETER_UUID)
+        with phase("connection_profile"):
+            self._apply_connection_profile()
+        with phase("capabilities"):
+            self._load_capabilities()
+        with phase("flush_journal"):
+            self._flush_journal()
+
+    def get_startup_profile(self):
+        """Get the timeline of the phases of connecting to the watch.
+
+        The set_mac_addr phase includes the BLE scan, if one was required.
+
+        Returns:
+            dict: See _uwatch2profile.StartupProfiler.get_dict().
+        """
+        return self._startup_profiler.get_dict()
+
+    def format_startup_profile(self):
+        """Get the timeline of the phases of connecting to the watch, formatted for
+        display.
+
+        Returns:
+            list of str
+        """
+        return self._startup_profiler.format_lines()
 
     def recover(self):
         """Attempt to get Bluez into a usable state again after errors."""
@@ -183,8 +400,11 @@ class Uwatch2Ble(object):
         self._is_connected = True
 
     def _reconnect(self):
+        self._metrics.inc("reconnects_total")
         if self._auto_reconnect:
             self._is_connected = True
+            self._apply_connection_profile()
+            self._flush_journal()
             return
 
         log.info("Reconnecting...")
@@ -192,13 +412,60 @@ class Uwatch2Ble(object):
         # log.debug(f"_connected_device = {self._adapter._connected_device}")
         self._adapter.reconnect(self._device, timeout=self._connect_timeout_sec)
         self._is_connected = True
+        self._apply_connection_profile()
+        self._flush_journal()
         # reconnect() includes resubscribe_all()
         # log.info("Resubscribing...")
         # self._device.resubscribe_all()
         # log.info("Resubscribed")
 
     def _send_raw_cmd(self, cmd_key, pack_str, *arg_tup):
-        """Send a query."""
+        """Send a command that does not return a response."""
+        self._send_write_packet(self._pack_cmd(cmd_key, pack_str, *arg_tup))
+
+    def _is_io_thread_call(self):
+        """Return True if I/O must be handed to the I/O thread.
+
+        While connecting, before the I/O thread is started, I/O runs on the calling
+        thread, serialized by _cmd_lock as usual.
+        """
+        return (
+            self._io_thread is not None
+            and self._io_thread.is_running()
+            and not self._io_thread.is_current()
+        )
+
+    def _send_immediate_cmd(self, cmd_key, pack_str, *arg_tup):
+        """Send a command that does not return a response, right away.
+
+        Unlike _send_raw_cmd(), the command is not held back by coalesce_writes(), and
+        is never queued in the journal. For commands that start something on the
+        watch, and must not take effect later or as part of a batch.
+        """
+        self.send_raw_packet(self._pack_cmd(cmd_key, pack_str, *arg_tup))
+
+    def send_raw_packet(self, payload_bytes):
+        """Send a packet right away, for commands that uwatch2lib does not implement,
+        such as in protocol discovery.
+
+        The packet is not held back by coalesce_writes(), and is never queued in the
+        journal. If the watch is not available, the error is raised.
+
+        Args:
+            payload_bytes (bytes): cmd_key, followed by the argument bytes.
+        """
+        # Write commands issued before this one must reach the watch first.
+        self._flush_coalesced_writes()
+        if self._is_io_thread_call():
+            return self._io_thread.call(self._send_packet_serialized, payload_bytes)
+        self._send_packet_serialized(payload_bytes)
+
+    def _send_packet_serialized(self, payload_bytes):
+        with self._cmd_lock:
+            self._send_packet(payload_bytes)
+
+    def _pack_cmd(self, cmd_key, pack_str, *arg_tup):
+        """Pack a cmd_key and its arguments to payload bytes."""
         try:
             int_tup = list(map(int, arg_tup))
         except TypeError:
@@ -215,42 +482,662 @@ class Uwatch2Ble(object):
         else:
             arg_bytes = bytes()
 
-        self._send_packet(bytes([cmd_key]) + arg_bytes)
+        return bytes([cmd_key]) + arg_bytes
+
+    def _get_raw_cmd(
+        self,
+        cmd_key,
+        pack_str,
+        unpack_str,
+        *arg_tup,
+        timeout_sec=None,
+        cancel_event=None,
+    ):
+        """Query with response
 
-    def _get_raw_cmd(self, cmd_key, pack_str, unpack_str, *arg_tup):
-        """Query with response"""
-        self._send_raw_cmd(cmd_key, pack_str, *arg_tup)
-        return self._get_response(cmd_key, unpack_str)
+        timeout_sec (float): Max time to wait for the response. If not provided, the
+        default set at instantiation is used.
 
-    def _send_packet(self, payload_bytes):
-        header_bytes = self._gen_header(payload_bytes)
-        pkg_bytes = header_bytes + payload_bytes
+        cancel_event (threading.Event): If provided, the wait is abandoned with
+        WatchCancelledError when the event is set.
+
+        If an identical query is already in flight, no new command is sent. Instead,
+        the result of the query in flight is returned. The deadline and cancel_event
+        of the query in flight then apply.
+        """
+        caps = self._caps
+        if caps is not None and not caps.is_supported(cmd_key):
+            self._metrics.inc("command_unsupported_total", cmd_key=self._hex(cmd_key))
+            raise WatchUnsupportedError(
+                f"Command {self._hex(cmd_key)} is not supported by {caps.mac_addr} "
+                f"with firmware {caps.firmware_version}"
+            )
+        # Write commands issued before the query must reach the watch first.
+        self._flush_coalesced_writes()
+        return self._single_flight.do(
+            (cmd_key, pack_str, unpack_str, arg_tup),
+            self._query,
+            cmd_key,
+            pack_str,
+            unpack_str,
+            arg_tup,
+            timeout_sec,
+            cancel_event,
+        )
+
+    def _query(self, cmd_key, pack_str, unpack_str, arg_tup, timeout_sec, cancel_event):
+        if self._is_io_thread_call():
+            return self._io_thread.call(
+                self._query,
+                cmd_key,
+                pack_str,
+                unpack_str,
+                arg_tup,
+                timeout_sec,
+                cancel_event,
+            )
+        with self._cmd_lock:
+            # cancel() applies only to the command that is waiting when it is called.
+            self._cancel_event.clear()
+            is_late_response_expected = self._is_late_response_expected(cmd_key)
+            disconnect_count = self._disconnect_count
+            start_time = time.monotonic()
+            self._send_packet(self._pack_cmd(cmd_key, pack_str, *arg_tup))
+            try:
+                response = self._get_response(
+                    cmd_key, unpack_str, timeout_sec, cancel_event
+                )
+            except (WatchTimeoutError, WatchCancelledError) as e:
+                if isinstance(e, WatchTimeoutError):
+                    self._metrics.inc(
+                        "command_timeouts_total", cmd_key=self._hex(cmd_key)
+                    )
+                # If a response was dropped as late while this query waited, it may
+                # have been the response to this query, so no further late response
+                # is expected.
+                if not is_late_response_expected or self._is_late_response_expected(
+                    cmd_key
+                ):
+                    self._late_response_dict[cmd_key] = (
+                        time.monotonic() + self.LATE_RESPONSE_WINDOW_SEC,
+                        disconnect_count,
+                    )
+                raise
+            self._metrics.observe(
+                "command_latency_seconds",
+                time.monotonic() - start_time,
+                cmd_key=self._hex(cmd_key),
+            )
+            return response
+
+    def _is_late_response_expected(self, cmd_key):
+        late_tup = self._late_response_dict.get(cmd_key)
+        if late_tup is None:
+            return False
+        expire_time, disconnect_count = late_tup
+        if (
+            time.monotonic() >= expire_time
+            or disconnect_count != self._disconnect_count
+        ):
+            del self._late_response_dict[cmd_key]
+            return False
+        return True
+
+    def get_capabilities(self):
+        """Get the probed capabilities of the watch.
+
+        Returns:
+            _uwatch2caps.Capabilities: None if caps_path was not provided.
+        """
+        return self._caps
+
+    def probe_capabilities(self, timeout_sec=_uwatch2caps.DEFAULT_PROBE_TIMEOUT_SEC):
+        """Probe which queries the watch supports, and update the cache.
+
+        Each query in _uwatch2caps.PROBE_LIST is sent, and recorded as unsupported if
+        none of _uwatch2caps.PROBE_ATTEMPT_COUNT attempts is answered within
+        {timeout_sec}. The probe runs automatically on
+        connect if caps_path was provided and the watch has not been probed with its
+        current firmware.
+
+        Returns:
+            _uwatch2caps.Capabilities
+        """
+        log.info(f"Probing capabilities of {self._mac_addr}...")
+        start_time = time.monotonic()
+        # Probe everything, also queries that an earlier probe found unsupported.
+        self._caps = None
+        supported_list = []
+        unsupported_list = []
+        response_dict = {}
+        for cmd_key, pack_str, arg_tup in _uwatch2caps.PROBE_LIST:
+            for attempt_idx in range(_uwatch2caps.PROBE_ATTEMPT_COUNT):
+                try:
+                    response_dict[cmd_key] = self._get_raw_cmd(
+                        cmd_key, pack_str, None, *arg_tup, timeout_sec=timeout_sec
+                    )
+                except WatchTimeoutError:
+                    log.debug(
+                        f"No response to {self._hex(cmd_key)} in probe attempt "
+                        f"{attempt_idx + 1}"
+                    )
+                    # A late response to this attempt shows that the query is
+                    # supported just as well as a response to the next one, so it
+                    # must not be discarded.
+                    with self._cmd_lock:
+                        self._late_response_dict.pop(cmd_key, None)
+                else:
+                    supported_list.append(cmd_key)
+                    break
+            else:
+                unsupported_list.append(cmd_key)
+        caps = _uwatch2caps.new_capabilities(
+            self._mac_addr, supported_list, unsupported_list, response_dict
+        )
+        log.info(
+            f"Probed {len(_uwatch2caps.PROBE_LIST)} queries in "
+            f"{time.monotonic() - start_time:.1f} sec. "
+            f"Firmware: {caps.firmware_version}. Unsupported: "
+            f"{', '.join(self._hex(k) for k in unsupported_list) or 'none'}"
+        )
+        if self._caps_cache is not None:
+            self._caps_cache.put(caps)
+        self._caps = caps
+        return caps
+
+    def _load_capabilities(self):
+        """Look up the capabilities of the watch by its current firmware version,
+        probing them if they are not cached."""
+        if self._caps_cache is None:
+            return
+        self._caps = None
+        try:
+            version_bytes = self._get_raw_cmd(
+                _uwatch2caps.DEVICE_VERSION,
+                None,
+                None,
+                timeout_sec=_uwatch2caps.DEFAULT_PROBE_TIMEOUT_SEC,
+            )
+        except WatchTimeoutError:
+            firmware_version = _uwatch2caps.UNKNOWN_FIRMWARE
+        else:
+            firmware_version = _uwatch2caps.decode_version(version_bytes)
+        caps = self._caps_cache.get(self._mac_addr, firmware_version)
+        if caps is None:
+            caps = self.probe_capabilities()
+        else:
+            log.debug(f"Using cached capabilities for firmware {firmware_version}")
+        self._caps = caps
+
+    def get_single_flight_saved_count(self):
+        """Get the number of queries that were served by an identical query that was
+        already in flight, and so did not cause any radio traffic.
+        """
+        return self._single_flight.saved_call_count
+
+    def cancel(self):
+        """Cancel the command that is currently waiting for a response, if any.
+
+        May be called from any thread. The waiting call raises WatchCancelledError.
+        Has no effect on commands that are issued later.
+        """
+        self._cancel_event.set()
+
+    def get_metrics(self):
+        """Get a snapshot of the performance metrics.
+
+        Includes per cmd_key round-trip latency histograms, packets and chunks
+        written per cmd_key, notification counts, rates and queue depths per
+        characteristic handle, reassembled response sizes, and reconnect counts.
+
+        Returns:
+            dict: See _uwatch2metrics.Metrics.snapshot().
+        """
+        return self._metrics.snapshot()
+
+    def get_metrics_prometheus(self):
+        """Get the performance metrics in Prometheus text exposition format."""
+        return self._metrics.to_prometheus()
+
+    def _collect_notification_metrics(self, metrics):
+        uptime_sec = metrics.uptime_sec
+        for handle, stats_dict in self._queue.get_stats().items():
+            handle_str = handle if isinstance(handle, str) else self._hex(handle)
+            metrics.set_gauge(
+                "notifications_total", stats_dict["received_count"], handle=handle_str
+            )
+            metrics.set_gauge(
+                "notifications_dropped_total",
+                stats_dict["dropped_count"],
+                handle=handle_str,
+            )
+            metrics.set_gauge(
+                "notification_rate_per_second",
+                round(stats_dict["received_count"] / uptime_sec, 3),
+                handle=handle_str,
+            )
+            metrics.set_gauge(
+                "notification_queue_depth", stats_dict["depth"], handle=handle_str
+            )
+
+    def get_notification_stats(self):
+        """Get depth and drop counters for the notification buffers.
+
+        Returns:
+            dict: Keyed by characteristic handle, or "control" for disconnect events.
+            Each value is a dict with keys policy, priority, depth, max_depth,
+            high_water_depth, received_count, dropped_count.
+        """
+        return self._queue.get_stats()
+
+    def add_event_handler(
+        self, cmd_key, handler, max_age_sec=None, with_receive_time=False
+    ):
+        """Register a handler for frames that the watch sends on its own.
+
+        The handler is called with (cmd_key, payload_bytes) as soon as the frame has
+        been received, also while no command is running. It runs on the handler pool,
+        after the handlers for earlier events.
+
+        Args:
+            cmd_key (int): cmd_key of the frame, e.g.
+              _uwatch2events.SWITCH_CAMERA_VIEW.
+            handler (callable): Called with (cmd_key, payload_bytes).
+            max_age_sec (float): Skip the handler if it cannot be started within this
+              time from when the frame was received, instead of calling it late.
+            with_receive_time (bool): Call the handler with (cmd_key, payload_bytes,
+              receive_time), where receive_time is the time.monotonic() at which the
+              frame was received.
+        """
+        self._event_dispatcher.add_handler(
+            cmd_key, handler, max_age_sec, with_receive_time
+        )
+
+    def remove_event_handler(self, cmd_key, handler):
+        self._event_dispatcher.remove_handler(cmd_key, handler)
+
+    def add_disconnect_handler(self, handler):
+        """Register a handler that is called with no arguments when the watch
+        disconnects.
+
+        The handler runs on the handler pool, after the handlers for notifications
+        that arrived before the disconnect.
+        """
+        self._disconnect_handler_list.append(handler)
+
+    def remove_disconnect_handler(self, handler):
+        if handler in self._disconnect_handler_list:
+            self._disconnect_handler_list.remove(handler)
+
+    def add_notification_handler(self, charcs_uuid, handler):
+        """Register a handler for raw notifications from a characteristic.
+
+        The handler is called with (handle, value_bytes) for each notification. It
+        runs on the handler pool, so it may do slow processing without holding up
+        reception. Handlers for the same characteristic are called one at a time, in
+        the order the notifications arrived.
+
+        Must be called while connected. Subscribes to the characteristic if needed.
+        """
+        handle = self._device.get_handle(charcs_uuid)
+        if handle not in (self._async_response_handle, self._accelerometer_handle):
+            self._subscribe(charcs_uuid)
+        self._notification_handler_dict.setdefault(handle, []).append(handler)
+
+    def remove_notification_handler(self, charcs_uuid, handler):
+        handle = self._device.get_handle(charcs_uuid)
+        handler_list = self._notification_handler_dict.get(handle, [])
+        if handler in handler_list:
+            handler_list.remove(handler)
+
+    def get_journal_status(self):
+        """Get the status of write commands that were queued while the watch was
+        disconnected.
+
+        Returns:
+            list of dict: dict_keys are entry_id, cmd_key, time, status. status is
+            one of "pending", "sent" or "superseded".
+        """
+        if self._journal is None:
+            return []
+        return self._journal.get_entry_list()
+
+    def set_connection_profile(self, profile_name):
+        """Set the connection parameter profile that is in effect outside of
+        connection_profile() blocks.
+
+        Also enables connection profiles, if no profile was selected at
+        instantiation.
+
+        Args:
+            profile_name (str): "bulk", "interactive" or "idle".
+        """
+        _uwatch2connparams.get_profile(profile_name)
+        self._base_profile_name = profile_name
+        self._apply_connection_profile()
+
+    def get_connection_profile(self):
+        """Get the connection parameter profile in effect.
+
+        Returns:
+            2-tup: Profile name, and the effective _uwatch2connparams.ConnectionProfile.
+            Both are None if profiles are not in use, or the profile could not be
+            applied.
+        """
+        with self._profile_lock:
+            return self._applied_profile_name, self._effective_profile
+
+    @contextlib.contextmanager
+    def connection_profile(self, profile_name):
+        """Switch to a connection parameter profile for the duration of the block.
+
+        The previous profile is restored when the block exits. If blocks for
+        different profiles are active at the same time, e.g., on different threads,
+        the profile with the shortest connection interval is in effect. Has no effect
+        while profiles are not in use. See the connection_profile argument.
+
+        Example:
+            with uwatch2.connection_profile("bulk"):
+                ...
+        """
+        _uwatch2connparams.get_profile(profile_name)
+        token = object()
+        with self._profile_lock:
+            self._profile_override_list.append((token, profile_name))
+        self._apply_connection_profile()
+        try:
+            yield
+        finally:
+            with self._profile_lock:
+                self._profile_override_list = [
+                    v for v in self._profile_override_list if v[0] is not token
+                ]
+            self._apply_connection_profile()
+
+    def _apply_connection_profile(self):
+        """Request the connection parameters of the profile that should be in
+        effect, if they have not already been requested on this connection.
+
+        Failures are logged and counted, but not raised, since the link works with
+        any parameters.
+        """
+        with self._profile_apply_lock:
+            with self._profile_lock:
+                if self._base_profile_name is None or not self._is_connected:
+                    return
+                profile_name = min(
+                    [v[1] for v in self._profile_override_list],
+                    key=lambda n: _uwatch2connparams.get_profile(n).max_interval_ms,
+                    default=self._base_profile_name,
+                )
+                if profile_name == self._applied_profile_name:
+                    return
+            try:
+                effective_profile = _uwatch2connparams.apply_profile(
+                    self._adapter,
+                    self._device,
+                    self._mac_addr,
+                    _uwatch2connparams.get_profile(profile_name),
+                )
+            except (
+                _uwatch2connparams.ConnectionParamsError,
+                pygatt.exceptions.BLEError,
+            ) as e:
+                log.warning(
+                    f"Unable to switch to connection profile {profile_name}: {repr(e)}"
+                )
+                self._metrics.inc("connection_profile_errors_total")
+                return
+            with self._profile_lock:
+                self._applied_profile_name = profile_name
+                self._effective_profile = effective_profile
+        log.debug(f"Connection profile: {profile_name} {effective_profile}")
+        self._metrics.inc("connection_profile_switches_total", profile=profile_name)
+        for name in _uwatch2connparams.PROFILE_DICT:
+            self._metrics.set_gauge(
+                "connection_profile", int(name == profile_name), profile=name
+            )
+        self._metrics.set_gauge(
+            "connection_interval_ms", effective_profile.max_interval_ms
+        )
+        self._metrics.set_gauge("connection_latency", effective_profile.latency)
+        self._metrics.set_gauge(
+            "connection_supervision_timeout_ms",
+            effective_profile.supervision_timeout_ms,
+        )
+
+    @contextlib.contextmanager
+    def coalesce_writes(self):
+        """Coalesce write commands into a shared stream of ATT writes.
+
+        Write commands issued by the calling thread within the block are held back and
+        sent together when the block exits, or before the next query. The packets are
+        sent back to back, so each 20 byte write carries as many packets as fit,
+        instead of one write per packet. Settings updates that send many small
+        packets then need only a fraction of the radio transactions.
+
+        Nested blocks are sent when the outermost block exits. If the block raises,
+        the write commands that are still held back are discarded, so that the watch
+        does not receive a partial batch.
+
+        Example:
+            with uwatch2.coalesce_writes():
+                uwatch2.set_quick_view(True)
+                uwatch2.set_time_format(True)
+                uwatch2.set_metric_system(False)
+        """
+        if getattr(self._coalesce_local, "payload_list", None) is not None:
+            yield
+            return
+        self._coalesce_local.payload_list = []
+        try:
+            yield
+        except BaseException:
+            payload_list = self._coalesce_local.payload_list
+            if payload_list:
+                log.warning(
+                    f"Discarding {len(payload_list)} coalesced write command(s) "
+                    f"after an exception"
+                )
+            raise
+        else:
+            self._flush_coalesced_writes()
+        finally:
+            self._coalesce_local.payload_list = None
+
+    def _flush_coalesced_writes(self):
+        payload_list = getattr(self._coalesce_local, "payload_list", None)
+        if payload_list:
+            self._coalesce_local.payload_list = []
+            self._send_write_packet_list(payload_list)
+
+    def _send_write_packet(self, payload_bytes):
+        """Send a packet for a command that does not return a response.
+
+        If a journal is in use, the watch is disconnected and the command may be
+        queued, the packet is queued in the journal and sent after the watch
+        reconnects.
+        """
+        payload_list = getattr(self._coalesce_local, "payload_list", None)
+        if payload_list is not None:
+            payload_list.append(payload_bytes)
+            return
+        self._send_write_packet_list([payload_bytes])
+
+    def _send_write_packet_list(self, payload_list):
+        if self._is_io_thread_call():
+            return self._io_thread.call(self._send_write_packet_list, payload_list)
+        with self._cmd_lock:
+            return self._send_write_packet_list_locked(payload_list)
+
+    def _send_write_packet_list_locked(self, payload_list):
+        """
+        Returns:
+            list of bytes: The payloads that were queued in the journal instead of
+            sent, because the watch was not available.
+        """
+        if self._journal is None:
+            self._send_packet_list(payload_list)
+            return []
+        try:
+            self._send_packet_list(payload_list)
+            return []
+        except pygatt.exceptions.BLEError as e:
+            self._is_connected = False
+            journaled_list = [
+                v for v in payload_list if _uwatch2journal.is_journaled(v)
+            ]
+            if journaled_list:
+                log.info(
+                    f"Watch is not available. Queuing {len(journaled_list)} "
+                    f"command(s). Error: {repr(e)}"
+                )
+            for payload_bytes in journaled_list:
+                self._journal.add(payload_bytes)
+            # Commands that cannot be queued fail as they would without a journal.
+            if len(journaled_list) < len(payload_list):
+                raise
+            return journaled_list
+
+    def _flush_journal(self):
+        """Send all write commands that were queued while the watch was disconnected.
+
+        The queued packets are written back to back, as one stream of chunks. If the
+        watch disconnects again during the flush, all the commands stay queued, and
+        are sent again after the next reconnect. Settings are harmless to send twice,
+        while a message may then be displayed twice.
+        """
+        if self._journal is None or self._is_flushing_journal:
+            return
+        pending_list = self._journal.get_pending_list()
+        if not pending_list:
+            return
+        log.info(f"Sending {len(pending_list)} queued command(s)...")
+        self._is_flushing_journal = True
+        try:
+            self._send_packet_list([v[1] for v in pending_list])
+            for entry_id, _ in pending_list:
+                self._journal.mark_sent(entry_id)
+        except pygatt.exceptions.BLEError as e:
+            log.info(f"Watch disconnected while sending queued commands: {repr(e)}")
+            self._is_connected = False
+            return
+        finally:
+            self._is_flushing_journal = False
+        self._journal.compact()
 
-        log.debug(f"Sending packet: {self._get_hex_str(pkg_bytes)}")
-        log.debug(f"  Header:  {self._get_hex_str(header_bytes)}")
-        log.debug(f"  Payload: {self._get_hex_str(payload_bytes)}")
+    def _send_packet(self, payload_bytes):
+        self._send_packet_list([payload_bytes])
+
+    def _send_packet_list(self, payload_list):
+        """Send packets back to back, as a single stream of chunks."""
+        # Queued writes are sent first so that they are not overwritten by older
+        # values, and so that the watch sees them in the order they were issued.
+        if self._journal is not None and self._journal.has_pending():
+            self._flush_journal()
+
+        pkg_list = []
+        for payload_bytes in payload_list:
+            header_bytes = self._gen_header(payload_bytes)
+            pkg_list.append(header_bytes + payload_bytes)
+            if self._tracer_list:
+                self._trace(
+                    _uwatch2trace.TX_PACKET,
+                    header_bytes=header_bytes,
+                    payload_bytes=payload_bytes,
+                )
+        pkg_bytes = b"".join(pkg_list)
 
         if not self._is_connected:
             self._reconnect()
 
         # self._write_command(self.COMMAND_UUID, pkg_bytes)
         buf = io.BytesIO(pkg_bytes)
+        chunk_count = 0
         while True:
             # ATT write requests and notifications contain max 20 data bytes
             chunk = buf.read(20)
             if not chunk:
-                return
-            log.debug(f"  Writing chunk: {self._get_hex_str(chunk)}")
+                break
             self._write_to_characteristic(self.COMMAND_UUID, chunk)
+            chunk_count += 1
+
+        for payload_bytes, pkg_bytes in zip(payload_list, pkg_list):
+            cmd_key_str = self._hex(payload_bytes[0])
+            self._metrics.inc("command_packets_total", cmd_key=cmd_key_str)
+            self._metrics.inc("command_bytes_total", len(pkg_bytes), cmd_key=cmd_key_str)
+        if len(payload_list) == 1:
+            self._metrics.inc("command_chunks_total", chunk_count, cmd_key=cmd_key_str)
+            return
+        self._metrics.inc("command_chunks_total", chunk_count, cmd_key="coalesced")
+        self._metrics.inc("coalesced_packets_total", len(payload_list))
+        self._metrics.inc(
+            "coalesced_chunks_saved_total",
+            sum((len(b) + 19) // 20 for b in pkg_list) - chunk_count,
+        )
+
+    def _send_data(self, data_bytes):
+        """Write raw bytes to the data characteristic, in 20 byte chunks.
+
+        Used for bulk transfers, such as watch faces. Unlike packets written to the
+        command characteristic, the bytes have no header.
+        """
+        if self._is_io_thread_call():
+            return self._io_thread.call(self._send_data, data_bytes)
+        with self._cmd_lock:
+            if not self._is_connected:
+                self._reconnect()
+            for i in range(0, len(data_bytes), 20):
+                try:
+                    self._write_to_characteristic(
+                        self.DATA_UUID, data_bytes[i : i + 20]
+                    )
+                except pygatt.exceptions.BLEError:
+                    self._is_connected = False
+                    raise
+                self._metrics.inc("data_chunks_total")
+            self._metrics.inc("data_bytes_total", len(data_bytes))
+
+    def read_snapshot(
+        self,
+        timeout_sec=_uwatch2snapshot.DEFAULT_READ_TIMEOUT_SEC,
+        recheck_unreadable=False,
+    ):
+        """Read the values of all readable characteristics.
+
+        The reads run in parallel, each with a deadline of {timeout_sec}.
+        Characteristics that failed to read in an earlier snapshot are skipped, and
+        static values such as the Device Information strings are read only once per
+        watch. With the gatttool backend, which cannot run concurrent reads, the reads
+        are issued one at a time.
+
+        Args:
+            timeout_sec (float): Max time for each read.
+            recheck_unreadable (bool): Also read the characteristics that failed in
+              earlier snapshots.
+
+        Returns:
+            dict: See _uwatch2snapshot.read_snapshot().
+        """
+        return _uwatch2snapshot.read_snapshot(
+            self._device,
+            self._mac_addr,
+            self._snapshot_cache,
+            timeout_sec,
+            max_parallel=(
+                1
+                if isinstance(self._adapter, pygatt.GATTToolBackend)
+                else _uwatch2snapshot.DEFAULT_MAX_PARALLEL
+            ),
+            recheck_unreadable=recheck_unreadable,
+        )
 
     def _read_all(self):
-        for charcs_uuid in self._device.discover_characteristics().keys():
-            log.debug(f"Read {charcs_uuid}:")
-            try:
-                b = self._device.char_read(charcs_uuid)
-                log.debug(f"  {self._get_hex_str(b)}")
-            except pygatt.exceptions.NotificationTimeout:
-                log.debug("   timeout")
+        snapshot_dict = self.read_snapshot(recheck_unreadable=True)
+        for uuid_str, value_bytes in sorted(snapshot_dict["value_dict"].items()):
+            log.debug(f"Read {uuid_str}: {self._get_hex_str(value_bytes)}")
+        for uuid_str in snapshot_dict["failed_list"]:
+            log.debug(f"Read {uuid_str}: failed")
 
     def _subscribe_all(self):
         """Subscribe to all characteristics (for reverse engineering / discovery)"""
@@ -260,10 +1147,13 @@ class Uwatch2Ble(object):
     def _subscribe(self, charcs_uuid):
         """Subscribe and register a unique callback."""
         log.debug(f"Subscribe {charcs_uuid}:")
+        policy_tup = self._notification_policy_dict.get(uuid.UUID(str(charcs_uuid)))
+        if policy_tup is not None:
+            self._queue.configure(self._device.get_handle(charcs_uuid), *policy_tup)
         result = self._device.subscribe(
             charcs_uuid,
             # callback=functools.partial(data_callback, self, self.ASYNC_RESPONSE_UUID),
-            callback=functools.partial(data_callback, self._queue),
+            callback=functools.partial(data_callback, self._queue, self._tracer_list),
             indication=False,
             wait_for_response=False,
         )
@@ -286,43 +1176,96 @@ class Uwatch2Ble(object):
 
     def _gen_header(self, payload_bytes):
         """Generate packet header."""
-        return self._get_bytes("fe ea 10") + struct.pack("B", len(payload_bytes) + 4)
+        return HEADER_BYTES + bytes([len(payload_bytes) + 4])
 
-    def _get_response(self, cmd_key, unpack_str):
+    def _get_response(self, cmd_key, unpack_str, timeout_sec=None, cancel_event=None):
         """Get the response from a previously issued command of type {cmd_key}, and
         return it unpacked as according to the {unpack_str} struct format string.
 
         Callback methods outside of the class are called by pygatt to deliver
         notifications from characteristics for which we have subscribed. The callbacks
         add the notifications to a queue that we keep reading from until we either get
-        the notification for which we are waiting or the watch is disconnected.
+        the notification for which we are waiting, the deadline passes or the wait is
+        cancelled.
+
+        On timeout or cancellation, any partially reassembled response is dropped so
+        that it does not corrupt the response to the next command.
         """
+        if timeout_sec is None:
+            timeout_sec = self._command_timeout_sec
+        deadline = time.monotonic() + timeout_sec
         while True:
-            msg_type, *msg_tup = self._queue.get()
-            # log.debug(f"Read from queue: msg_type={msg_type} msg_tup={msg_tup}")
-            if msg_type == "notification":
-                recv_charcs_handle, recv_pkg_bytes = msg_tup
-                if recv_charcs_handle == self._async_response_handle:
-                    acc_payload_bytes = self._handle_async_response(
-                        cmd_key, recv_pkg_bytes
-                    )
-                    if acc_payload_bytes:
-                        return self.unpack_payload_bytes(acc_payload_bytes, unpack_str)
-
-                    # return self._handle_async_response(cmd_key, unpack_str,
-                    #                                    recv_pkg_bytes)
-                elif recv_charcs_handle == self._accelerometer_handle:
-                    self._handle_accelerometer(recv_pkg_bytes)
-                else:
-                    raise WatchError(
-                        "Received unknown notification. Missing handler for a subscribed "
-                        "characteristic?"
+            if self._cancel_event.is_set() or (
+                cancel_event is not None and cancel_event.is_set()
+            ):
+                self._reset_response_state()
+                raise WatchCancelledError(
+                    f"Cancelled while waiting for response to command "
+                    f"{self._hex(cmd_key)}"
+                )
+            remaining_sec = deadline - time.monotonic()
+            if remaining_sec <= 0:
+                self._reset_response_state()
+                raise WatchTimeoutError(
+                    f"No response to command {self._hex(cmd_key)} "
+                    f"within {timeout_sec} sec"
+                )
+            try:
+                msg_type, *msg_tup = self._queue.get(
+                    timeout=min(remaining_sec, self.CANCEL_POLL_INTERVAL_SEC)
+                )
+            except queue.Empty:
+                continue
+            acc_payload_bytes = self._handle_msg(cmd_key, msg_type, msg_tup)
+            if acc_payload_bytes:
+                return self.unpack_payload_bytes(acc_payload_bytes, unpack_str)
+
+    def _handle_msg(self, cmd_key, msg_type, msg_tup):
+        """Handle a message from the notification queue.
+
+        Returns:
+            bytearray: The payload bytes of the response to {cmd_key} if this message
+            completed it, else None.
+        """
+        # log.debug(f"Read from queue: msg_type={msg_type} msg_tup={msg_tup}")
+        if msg_type == "notification":
+            recv_charcs_handle, recv_pkg_bytes, receive_time = msg_tup
+            handler_list = self._notification_handler_dict.get(recv_charcs_handle)
+            if handler_list:
+                for handler in handler_list:
+                    self._handler_pool.submit(
+                        recv_charcs_handle,
+                        handler,
+                        (recv_charcs_handle, bytes(recv_pkg_bytes)),
+                        start_time=receive_time,
                     )
+            if recv_charcs_handle == self._async_response_handle:
+                return self._handle_async_response(
+                    cmd_key, recv_pkg_bytes, receive_time
+                )
+            elif recv_charcs_handle == self._accelerometer_handle:
+                self._handle_accelerometer(recv_pkg_bytes)
+            elif not handler_list:
+                raise WatchError(
+                    "Received unknown notification. Missing handler for a subscribed "
+                    "characteristic?"
+                )
+        elif msg_type == "disconnected":
+            self._handle_disconnect(*msg_tup)
+        else:
+            raise WatchError("Unknown callback message type")
 
-            elif msg_type == "disconnected":
-                self._handle_disconnect(*msg_tup)
-            else:
-                raise WatchError("Unknown callback message type")
+    def _drain_notifications(self):
+        """Handle any notifications that arrived while no command was waiting for a
+        response.
+        """
+        with self._cmd_lock:
+            while True:
+                try:
+                    msg_type, *msg_tup = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                self._handle_msg(None, msg_type, msg_tup)
 
     #     # payload_bytes = self._get_payload(recv_pkg_bytes)
     #     payload_bytes = recv_pkg_bytes
@@ -347,40 +1290,58 @@ class Uwatch2Ble(object):
     #         response_tup = self.unpack_payload_bytes(recv_payload_bytes, unpack_str)
     #
 
-    def _handle_async_response(self, expected_cmd_key, recv_pkg_bytes):
+    def _handle_async_response(
+        self, expected_cmd_key, recv_pkg_bytes, receive_time=None
+    ):
         # If there's no existing buffer for capturing response, this must be the start
         # of a new response and it must have a valid header.
         if self._expected_payload_byte_count is None:
+            recv_pkg_bytes = self._find_response_start(recv_pkg_bytes)
+            if recv_pkg_bytes is None:
+                return None
             (
-                cmd_key,
+                self._acc_cmd_key,
                 self._expected_payload_byte_count,
                 self._acc_payload_bytes,
             ) = self._parse_initial_async_response(recv_pkg_bytes)
-            assert cmd_key == expected_cmd_key
+            self._acc_chunk_count = 1
+            self._acc_receive_time = receive_time
         # If there's an existing buffer for {cmd_key}, we assume that this is additional
         # bytes for an existing response. We can't safely check that it's not a new
         # header since the 3 fixed header bytes could occur in regular data.
         else:
             self._acc_payload_bytes.extend(recv_pkg_bytes)
+            self._acc_chunk_count += 1
+
+        if self._tracer_list:
+            self._trace(
+                _uwatch2trace.REASSEMBLY_PROGRESS,
+                byte_count=len(recv_pkg_bytes),
+                acc_byte_count=len(self._acc_payload_bytes),
+                expected_byte_count=self._expected_payload_byte_count,
+            )
 
-        log.debug(
-            f"Received {len(recv_pkg_bytes)} bytes. "
-            f"Now have {len(self._acc_payload_bytes)} bytes. "
-            f"Expecting {self._expected_payload_byte_count} bytes"
-        )
+        # A notification can hold the end of one response and the start of the next
+        # if the link merges notifications. The excess bytes are handled as a new
+        # notification after this response is complete.
+        excess_bytes = None
+        if len(self._acc_payload_bytes) > self._expected_payload_byte_count:
+            excess_bytes = self._acc_payload_bytes[self._expected_payload_byte_count :]
+            del self._acc_payload_bytes[self._expected_payload_byte_count :]
 
         # If we have all the expected bytes, return them, which also signals completed
         # processing for the response for the given cmd_key.
         if len(self._acc_payload_bytes) == self._expected_payload_byte_count:
-            acc_payload_bytes = self._acc_payload_bytes
-            log.debug(
-                f"Received all {self._expected_payload_byte_count} expected bytes. "
-                f"Returning: {self._get_hex_str(acc_payload_bytes)}"
-            )
-            self._expected_payload_byte_count = None
+            acc_payload_bytes = self._complete_async_response(expected_cmd_key)
+            if excess_bytes:
+                excess_payload_bytes = self._handle_async_response(
+                    None if acc_payload_bytes is not None else expected_cmd_key,
+                    excess_bytes,
+                    receive_time,
+                )
+                if acc_payload_bytes is None:
+                    acc_payload_bytes = excess_payload_bytes
             return acc_payload_bytes
-        elif len(self._acc_payload_bytes) > self._expected_payload_byte_count:
-            raise WatchError("Received more bytes than expected")
         # # If there's no existing buffer for capturing responses for {cmd_key}, this
         # # must be the start of a new response and it must have a valid header.
         # if cmd_key not in self._response_buf:
@@ -403,6 +1364,118 @@ class Uwatch2Ble(object):
         # if len(buf_dict['acc_payload_bytes']) == buf_dict['payload_byte_count']:
         #     return self._response_buf.pop(cmd_key)['acc_payload_bytes']
 
+    def _complete_async_response(self, expected_cmd_key):
+        """Finish the fully reassembled async response.
+
+        Returns:
+            bytearray: The payload bytes, or None if the response was not for
+            {expected_cmd_key}.
+        """
+        acc_payload_bytes = self._acc_payload_bytes
+        acc_cmd_key = self._acc_cmd_key
+        acc_receive_time = self._acc_receive_time
+        if self._tracer_list:
+            self._trace(
+                _uwatch2trace.REASSEMBLY_COMPLETE,
+                cmd_key=acc_cmd_key,
+                payload_bytes=acc_payload_bytes,
+            )
+        self._metrics.observe(
+            "reassembly_bytes",
+            len(acc_payload_bytes),
+            cmd_key=self._hex(acc_cmd_key),
+        )
+        self._metrics.observe(
+            "reassembly_chunks",
+            self._acc_chunk_count,
+            cmd_key=self._hex(acc_cmd_key),
+        )
+        self._reset_response_state()
+        # The first response with the cmd_key of a query that timed out or was
+        # cancelled is taken to be the late response to that query, also if a retry
+        # of the query is now waiting.
+        if self._is_late_response_expected(acc_cmd_key):
+            del self._late_response_dict[acc_cmd_key]
+            log.warning(
+                f"Discarding late response to timed out or cancelled command "
+                f"{self._hex(acc_cmd_key)}"
+            )
+            self._metrics.inc(
+                "late_responses_dropped_total", cmd_key=self._hex(acc_cmd_key)
+            )
+            return None
+        if acc_cmd_key != expected_cmd_key and self._event_dispatcher.dispatch(
+            acc_cmd_key,
+            acc_payload_bytes,
+            acc_receive_time,
+            self._async_response_handle,
+        ):
+            return None
+        if expected_cmd_key is None:
+            log.warning(
+                f"Discarding response received while no command was waiting. "
+                f"cmd_key: {self._hex(acc_cmd_key)}"
+            )
+            return None
+        if acc_cmd_key != expected_cmd_key:
+            log.warning(
+                f"Discarding stale response. "
+                f"cmd_key expected/received: "
+                f"{self._hex(expected_cmd_key)}/{self._hex(acc_cmd_key)}"
+            )
+            return None
+        return acc_payload_bytes
+
+    def _find_response_start(self, recv_pkg_bytes):
+        """Find the header that starts a new async response.
+
+        Bytes before the header are the remains of a response that was not fully
+        received, and are discarded. A header that was split over notifications is
+        put back together.
+
+        Returns:
+            bytearray: Notification bytes starting with the header and cmd_key, or None
+            if they have not been received yet.
+        """
+        pkg_bytes = self._pending_header_bytes + recv_pkg_bytes
+        self._pending_header_bytes = bytearray()
+        discard_byte_count = pkg_bytes.find(HEADER_BYTES)
+        if discard_byte_count == -1:
+            discard_byte_count = len(pkg_bytes)
+            # Keep the start of a header that may continue in the next notification.
+            for n in (2, 1):
+                if pkg_bytes.endswith(HEADER_BYTES[:n]):
+                    discard_byte_count -= n
+                    break
+        if discard_byte_count:
+            log.warning(
+                f"Discarding bytes received outside of a response: "
+                f"{self._get_hex_str(pkg_bytes[:discard_byte_count])}"
+            )
+            self._metrics.inc("reassembly_discarded_bytes_total", discard_byte_count)
+            del pkg_bytes[:discard_byte_count]
+        # Header and cmd_key
+        if len(pkg_bytes) < 5:
+            self._pending_header_bytes = pkg_bytes
+            return None
+        if pkg_bytes[3] < 5:
+            log.warning(
+                f"Discarding header with invalid length: "
+                f"{self._get_hex_str(pkg_bytes[:4])}"
+            )
+            self._metrics.inc("reassembly_discarded_bytes_total", 3)
+            return self._find_response_start(pkg_bytes[3:])
+        return pkg_bytes
+
+    def _reset_response_state(self):
+        """Drop any partially reassembled async response."""
+        self._acc_payload_bytes = bytearray()
+        self._acc_cmd_key = None
+        self._acc_chunk_count = 0
+        self._acc_receive_time = None
+        self._expected_payload_byte_count = None
+        self._pending_header_bytes = bytearray()
+
     # def _handle_notification(self, cmd_key, unpack_str, recv_charcs_handle, recv_pkg_bytes):
     #
     # def _handle_async_response(self, cmd_key, recv_pkg_bytes):
@@ -428,6 +1501,8 @@ class Uwatch2Ble(object):
     #     return response_tup
 
     def unpack_payload_bytes(self, recv_payload_bytes, unpack_str):
+        if unpack_str is None:
+            return bytes(recv_payload_bytes)
         try:
             response_tup = struct.unpack(unpack_str, recv_payload_bytes)
         except struct.error as e:
@@ -455,12 +1530,15 @@ class Uwatch2Ble(object):
         return cmd_key, payload_byte_count - 1, payload_bytes[1:]
 
     def _check_and_parse_header(self, pkg_bytes):
-        if pkg_bytes[:3] != self._get_bytes("fe ea 10"):
+        if pkg_bytes[:3] != HEADER_BYTES:
             raise WatchError(
                 f"Expected bytes to start with new header (fe ea 10). Received: {self._get_hex_str(pkg_bytes)}"
             )
-        payload_byte_count = struct.unpack("B", pkg_bytes[3:4])[0] - 4
-        log.debug(f"Received valid header for {payload_byte_count} payload bytes")
+        payload_byte_count = pkg_bytes[3] - 4
+        if self._tracer_list:
+            self._trace(
+                _uwatch2trace.RX_HEADER, payload_byte_count=payload_byte_count
+            )
         return payload_byte_count
 
     def _handle_accelerometer(self, recv_pkg_bytes):
@@ -470,14 +1548,70 @@ class Uwatch2Ble(object):
 
     def _handle_disconnect(self):
         log.info("Disconnected")
+        self._metrics.inc("disconnects_total")
+        self._disconnect_count += 1
+        if self._tracer_list:
+            self._trace(_uwatch2trace.DISCONNECTED)
         self._is_connected = False
+        # The parameters of the new connection are negotiated from scratch.
+        self._applied_profile_name = None
+        for handler in list(self._disconnect_handler_list):
+            self._handler_pool.submit(_uwatch2notifybuf.CONTROL_KEY, handler, ())
 
     def _write_to_characteristic(self, charcs_uuid, pkg_bytes):
         """Write bytes to a characteristic."""
-        log.debug(f"-> {self._get_hex_str(pkg_bytes)}")
         result = self._device.char_write(charcs_uuid, pkg_bytes)
-        if result is not None:
-            log.debug(f"-> result: {result}")
+        if self._tracer_list:
+            self._trace(
+                _uwatch2trace.TX_CHUNK,
+                uuid=charcs_uuid,
+                chunk_bytes=pkg_bytes,
+                result=result,
+            )
+
+    def add_tracer(self, tracer):
+        """Attach a tracer that receives protocol events.
+
+        Args:
+            tracer (callable): Called with (event_str, timestamp, field_dict). See
+              _uwatch2trace for the events and their fields. Notification events are
+              delivered on the backend's receive thread.
+        """
+        self._tracer_list.append(tracer)
+
+    def remove_tracer(self, tracer):
+        self._tracer_list.remove(tracer)
+
+    def start_capture(self, capture_path):
+        """Start writing all chunks written to and notifications received from the
+        watch to a trace file.
+
+        The trace can be replayed with _uwatch2capture.ReplayAdapter.
+        """
+        self.stop_capture()
+        handle_dict = {}
+        for charcs_uuid in (
+            self.COMMAND_UUID,
+            self.DATA_UUID,
+            self.ASYNC_RESPONSE_UUID,
+            self.ACCELEROMETER_UUID,
+        ):
+            try:
+                handle_dict[charcs_uuid] = self._device.get_handle(charcs_uuid)
+            except pygatt.exceptions.BLEError:
+                pass
+        self._capture_tracer = _uwatch2capture.CaptureTracer(capture_path, handle_dict)
+        self.add_tracer(self._capture_tracer)
+
+    def stop_capture(self):
+        if self._capture_tracer is None:
+            return
+        self.remove_tracer(self._capture_tracer)
+        self._capture_tracer.close()
+        self._capture_tracer = None
+
+    def _trace(self, event_str, **field_dict):
+        _trace(self._tracer_list, event_str, field_dict)
 
     def _strip_header(self, b):
         """Strip the header from a packet.
@@ -493,14 +1627,19 @@ class Uwatch2Ble(object):
         return " ".join(shlex.quote(str(s)) for s in arg_tup)
 
 
-def data_callback(queue, handle, value):
+def data_callback(queue, tracer_list, handle, value):
     """Called when a notification is received from one of the subscribed interfaces.
 
     handle -- integer, characteristic read handle the data was received on
     value -- bytearray, the data returned in the notification
     """
-    # Values are logged when they are pulled from the queue.
-    queue.put(("notification", handle, value))
+    if tracer_list:
+        _trace(
+            tracer_list,
+            _uwatch2trace.RX_NOTIFICATION,
+            {"handle": handle, "value_bytes": value},
+        )
+    queue.put(("notification", handle, value, time.monotonic()))
 
 
 def disconnect_callback(queue, event_dict):
@@ -510,6 +1649,15 @@ def disconnect_callback(queue, event_dict):
     queue.put(("disconnected",))
 
 
+def _trace(tracer_list, event_str, field_dict):
+    timestamp = time.monotonic()
+    for tracer in tracer_list:
+        try:
+            tracer(event_str, timestamp, field_dict)
+        except Exception as e:
+            log.error(f"Tracer failed on {event_str} event: {repr(e)}")
+
+
 def debug_pprint(o):
     for line in pprint.pformat(o).splitlines():
         log.debug(line)
@@ -521,3 +1669,15 @@ class WatchError(Exception):
 
 class WatchBleScanError(WatchError):
     pass
+
+
+class WatchTimeoutError(WatchError):
+    pass
+
+
+class WatchCancelledError(WatchError):
+    pass
+
+
+class WatchUnsupportedError(WatchError):
+    pass
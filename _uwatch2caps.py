@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+
+"""Probe of the commands and features that a watch supports, cached per firmware.
+
+Watches and firmware versions differ in which commands they answer. A query that the
+watch does not support gets no response, so without knowing, each such command waits
+for the full command timeout.
+
+The probe sends each known query with a short timeout, and records which ones were
+answered. A query that times out is sent again, up to PROBE_ATTEMPT_COUNT times, before
+it is recorded as unsupported, so that a single lost notification does not disable a
+command until the next firmware upgrade. It also records the raw responses of the
+feature queries:
+
+    0x2E: Device (firmware) version string
+    0x84: Supported watch face
+
+The results are stored in a JSON file, keyed by MAC address and firmware version, so
+the probe runs only once per watch and firmware. The probe itself is run by
+Uwatch2Ble, see its caps_path argument. On later connects, only the firmware
+version is queried, to find the cached results. Queries that are known to be
+unsupported then fail immediately with WatchUnsupportedError, without any radio
+traffic.
+
+Write commands are not probed, since they change settings on the watch. 0x25 takes
+an argument and is named as a setter (set_display_device_function_support) in
+uwatch2lib, so it is not probed either.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEVICE_VERSION = 0x2E
+SUPPORTED_WATCH_FACE = 0x84
+
+# Version recorded for watches that do not answer the device version query.
+UNKNOWN_FIRMWARE = "unknown"
+
+DEFAULT_PROBE_TIMEOUT_SEC = 2.0
+# Times a query is sent before it is recorded as unsupported.
+PROBE_ATTEMPT_COUNT = 2
+
+# Queries to probe: (cmd_key, pack_str, arg_tup). The known queries of uwatch2lib,
+# after the feature queries.
+PROBE_LIST = [
+    (DEVICE_VERSION, None, ()),
+    (SUPPORTED_WATCH_FACE, None, ()),
+    (0x21, None, ()),
+    (0x22, None, ()),
+    (0x26, None, ()),
+    (0x27, None, ()),
+    (0x28, None, ()),
+    (0x29, None, ()),
+    (0x2A, None, ()),
+    (0x2C, None, ()),
+    (0x2D, None, ()),
+    (0x2F, None, ()),
+    (0x35, None, ()),
+    (0x81, None, ()),
+    (0x82, None, ()),
+    (0x88, None, ()),
+]
+
+
+class Capabilities(object):
+    """Probe results for one watch and firmware version."""
+
+    def __init__(self, record_dict):
+        """
+        Args:
+            record_dict (dict): See new_capabilities().
+        """
+        self._record_dict = record_dict
+        self._supported_set = {int(k, 16) for k in record_dict["supported"]}
+        self._unsupported_set = {int(k, 16) for k in record_dict["unsupported"]}
+
+    @property
+    def mac_addr(self):
+        return self._record_dict["mac_addr"]
+
+    @property
+    def firmware_version(self):
+        return self._record_dict["firmware_version"]
+
+    @property
+    def probe_time(self):
+        return self._record_dict["probe_time"]
+
+    def is_supported(self, cmd_key):
+        """Returns:
+        bool: False if the watch did not answer {cmd_key} when probed. Commands that
+        were not probed are assumed to be supported.
+        """
+        return cmd_key not in self._unsupported_set
+
+    def get_supported_list(self):
+        return sorted(self._supported_set)
+
+    def get_unsupported_list(self):
+        return sorted(self._unsupported_set)
+
+    def get_response(self, cmd_key):
+        """Get the raw response payload recorded for a feature query.
+
+        Returns:
+            bytes: Payload, not including the cmd_key. None if the query was not
+            answered.
+        """
+        hex_str = self._record_dict["response_dict"].get(f"0x{cmd_key:02x}")
+        return None if hex_str is None else bytes.fromhex(hex_str)
+
+    def get_dict(self):
+        return dict(self._record_dict)
+
+
+class CapabilityCache(object):
+    """Probe results, persisted in a JSON file."""
+
+    def __init__(self, caps_path):
+        """
+        Args:
+            caps_path (str): Path to the JSON file. Created if it does not exist.
+        """
+        self._caps_path = caps_path
+        self._lock = threading.Lock()
+        self._record_dict = self._load()
+
+    def get(self, mac_addr, firmware_version):
+        """Returns:
+        Capabilities: Cached results, or None if the watch has not been probed with
+        this firmware version.
+        """
+        with self._lock:
+            record_dict = self._record_dict.get(_get_key(mac_addr, firmware_version))
+        return None if record_dict is None else Capabilities(record_dict)
+
+    def put(self, caps):
+        with self._lock:
+            self._record_dict[_get_key(caps.mac_addr, caps.firmware_version)] = (
+                caps.get_dict()
+            )
+            self._save()
+
+    def _load(self):
+        try:
+            with open(self._caps_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            log.warning(f"Ignoring invalid capability cache {self._caps_path}: {e}")
+            return {}
+
+    def _save(self):
+        dir_path = os.path.dirname(self._caps_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        tmp_path = self._caps_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._record_dict, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._caps_path)
+
+
+def decode_version(payload_bytes):
+    return payload_bytes.split(b"\0", 1)[0].decode("ascii", "replace").strip()
+
+
+def new_capabilities(mac_addr, supported_list, unsupported_list, response_dict):
+    """Create Capabilities from probe results.
+
+    Args:
+        mac_addr (str)
+        supported_list (list of int): Queries that were answered.
+        unsupported_list (list of int): Queries that were not answered.
+        response_dict (dict): cmd_key -> payload bytes of the answered queries.
+    """
+    version_bytes = response_dict.get(DEVICE_VERSION)
+    return Capabilities(
+        {
+            "mac_addr": mac_addr,
+            "firmware_version": (
+                UNKNOWN_FIRMWARE
+                if version_bytes is None
+                else decode_version(version_bytes)
+            ),
+            "probe_time": time.time(),
+            "supported": [f"0x{k:02x}" for k in supported_list],
+            "unsupported": [f"0x{k:02x}" for k in unsupported_list],
+            "response_dict": {
+                f"0x{k:02x}": bytes(v).hex() for k, v in response_dict.items()
+            },
+        }
+    )
+
+
+def _get_key(mac_addr, firmware_version):
+    return f"{mac_addr.upper()}/{firmware_version}"
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+
+"""Capture of BLE traffic to a compact trace file, and replay of captured traces.
+
+Trace file format:
+
+    Magic line: b"UWATCH2-CAPTURE 1\\n"
+    Metadata: uint32 length (little-endian), followed by a UTF-8 JSON object with
+      keys time (wall clock at start of capture) and handle_dict (characteristic
+      UUID string to handle)
+    Records until end of file. Each record is a 13 byte header packed with
+      RECORD_HEADER_STRUCT, followed by the data bytes:
+        direction (uint8): TX (written to the watch) or RX (notification)
+        handle (uint16): Characteristic handle
+        timestamp (float64): Seconds since start of capture (monotonic clock)
+        byte_count (uint16): Number of data bytes that follow
+
+Capture is implemented as a tracer (see _uwatch2trace), so it records the chunks
+exactly as written by _write_to_characteristic() and the notifications exactly as
+delivered to data_callback(), with the time at which they were seen.
+
+ReplayAdapter serves a captured trace back to Uwatch2Ble in place of a pygatt backend,
+for benchmarking and regression testing the parser and reassembly without a watch.
+"""
+import collections
+import json
+import logging
+import struct
+import threading
+import time
+import uuid
+
+import pygatt.exceptions
+
+import _uwatch2sim
+import _uwatch2trace
+
+log = logging.getLogger(__name__)
+
+MAGIC_BYTES = b"UWATCH2-CAPTURE 1\n"
+RECORD_HEADER_STRUCT = struct.Struct("<BHdH")
+
+TX = 0
+RX = 1
+
+Record = collections.namedtuple(
+    "Record", ["direction", "handle", "timestamp", "data_bytes"]
+)
+
+
+class CaptureTracer(object):
+    """Tracer that writes tx chunks and rx notifications to a trace file."""
+
+    def __init__(self, capture_path, handle_dict):
+        """
+        Args:
+            capture_path (str): Path of the trace file to create.
+            handle_dict (dict): Characteristic UUID to handle, used for resolving the
+              handle of tx chunks, which are written by UUID.
+        """
+        self._lock = threading.Lock()
+        self._handle_dict = {uuid.UUID(str(k)): v for k, v in handle_dict.items()}
+        self._start_time = time.monotonic()
+        self._file = open(capture_path, "wb")
+        metadata_bytes = json.dumps(
+            {
+                "time": time.time(),
+                "handle_dict": {str(k): v for k, v in self._handle_dict.items()},
+            }
+        ).encode("utf-8")
+        self._file.write(MAGIC_BYTES)
+        self._file.write(struct.pack("<I", len(metadata_bytes)))
+        self._file.write(metadata_bytes)
+        self.record_count = 0
+
+    def __call__(self, event_str, timestamp, field_dict):
+        if event_str == _uwatch2trace.TX_CHUNK:
+            handle = self._handle_dict.get(uuid.UUID(str(field_dict["uuid"])), 0)
+            self._write(TX, handle, timestamp, field_dict["chunk_bytes"])
+        elif event_str == _uwatch2trace.RX_NOTIFICATION:
+            self._write(RX, field_dict["handle"], timestamp, field_dict["value_bytes"])
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def _write(self, direction, handle, timestamp, data_bytes):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(
+                RECORD_HEADER_STRUCT.pack(
+                    direction, handle, timestamp - self._start_time, len(data_bytes)
+                )
+            )
+            self._file.write(data_bytes)
+            self.record_count += 1
+
+
+def read_capture(capture_path):
+    """Read a trace file.
+
+    Returns:
+        2-tup: (metadata_dict, list of Record)
+    """
+    with open(capture_path, "rb") as f:
+        buf = f.read()
+    metadata_dict, pos = parse_capture_preamble(buf)
+    record_list = []
+    header_size = RECORD_HEADER_STRUCT.size
+    while pos + header_size <= len(buf):
+        direction, handle, timestamp, byte_count = RECORD_HEADER_STRUCT.unpack_from(
+            buf, pos
+        )
+        pos += header_size
+        record_list.append(
+            Record(direction, handle, timestamp, bytes(buf[pos : pos + byte_count]))
+        )
+        pos += byte_count
+    return metadata_dict, record_list
+
+
+def parse_capture_preamble(buf):
+    """Parse the magic line and metadata at the start of a trace file.
+
+    Args:
+        buf: bytes, mmap or other buffer holding at least the start of the file.
+
+    Returns:
+        2-tup: (metadata_dict, offset of the first record)
+    """
+    if bytes(buf[: len(MAGIC_BYTES)]) != MAGIC_BYTES:
+        raise ValueError("Not a Uwatch2 capture file")
+    pos = len(MAGIC_BYTES)
+    (metadata_len,) = struct.unpack_from("<I", buf, pos)
+    pos += 4
+    metadata_dict = json.loads(bytes(buf[pos : pos + metadata_len]).decode("utf-8"))
+    return metadata_dict, pos + metadata_len
+
+
+class ReplayAdapter(object):
+    """Stand-in for pygatt.GATTToolBackend that serves a captured trace.
+
+    Each chunk written by Uwatch2Ble is matched against the next tx record in the
+    trace. The rx records that follow it in the trace, up to the next tx record, are
+    then delivered as notifications with their original delays relative to the tx
+    record, divided by {speed}.
+    """
+
+    def __init__(self, capture_path, speed=1.0):
+        """
+        Args:
+            capture_path (str): Trace file to replay.
+            speed (float): Timing compression. 1.0 replays with the original timing,
+              2.0 at twice the speed. 0 or None delivers notifications without delay.
+        """
+        self.metadata_dict, self.record_list = read_capture(capture_path)
+        self._speed = speed
+        self._link = _uwatch2sim.SimLink()
+        self._device = None
+
+    def start(self, *arg_tup, **kwarg_dict):
+        self._link.start()
+
+    def stop(self):
+        self._link.stop()
+
+    def reset(self):
+        pass
+
+    def kill(self):
+        self._link.stop()
+
+    def scan(self, timeout=10, run_as_root=False):
+        return [{"name": "Uwatch2 (replay)", "address": _uwatch2sim.SIM_MAC_ADDR}]
+
+    def connect(self, address, timeout=None, auto_reconnect=False, **kwarg_dict):
+        self._device = ReplayDevice(self, self._link, self._speed)
+        return self._device
+
+    def disconnect(self, device=None):
+        pass
+
+    def reconnect(self, device, timeout=None):
+        pass
+
+
+class ReplayDevice(object):
+    """Stand-in for pygatt.GATTToolBLEDevice that serves a captured trace."""
+
+    def __init__(self, adapter, link, speed):
+        self._record_list = adapter.record_list
+        self._handle_dict = {
+            uuid.UUID(k): v
+            for k, v in adapter.metadata_dict.get("handle_dict", {}).items()
+        }
+        self._link = link
+        self._speed = speed
+        self._lock = threading.Lock()
+        self._pos = 0
+        self._callback_dict = {}
+        # Number of written chunks that did not match the trace.
+        self.mismatch_count = 0
+
+    def bond(self, permanent=False):
+        pass
+
+    def get_handle(self, char_uuid):
+        char_uuid = uuid.UUID(str(char_uuid))
+        return self._handle_dict.get(char_uuid, _uwatch2sim.HANDLE_DICT.get(char_uuid))
+
+    def discover_characteristics(self):
+        return dict(self._handle_dict)
+
+    def subscribe(
+        self, char_uuid, callback=None, indication=False, wait_for_response=True
+    ):
+        self._callback_dict.setdefault(self.get_handle(char_uuid), []).append(callback)
+
+    def resubscribe_all(self):
+        pass
+
+    def register_disconnect_callback(self, callback):
+        pass
+
+    def char_write(self, char_uuid, value, wait_for_response=True):
+        value_bytes = bytes(value)
+        with self._lock:
+            # Skip to the next tx record. rx records before it were not preceded by a
+            # write, so they are delivered now.
+            rx_list = []
+            while (
+                self._pos < len(self._record_list)
+                and self._record_list[self._pos].direction != TX
+            ):
+                rx_list.append(self._record_list[self._pos])
+                self._pos += 1
+            if self._pos >= len(self._record_list):
+                log.warning("Write after end of replayed trace")
+                return
+            tx_record = self._record_list[self._pos]
+            self._pos += 1
+            if tx_record.data_bytes != value_bytes:
+                self.mismatch_count += 1
+                log.warning(
+                    f"Write does not match trace. "
+                    f"Expected {tx_record.data_bytes.hex()}, got {value_bytes.hex()}"
+                )
+            for record in rx_list:
+                self._link.send_after(
+                    0, self._deliver, record.handle, record.data_bytes
+                )
+            while (
+                self._pos < len(self._record_list)
+                and self._record_list[self._pos].direction == RX
+            ):
+                record = self._record_list[self._pos]
+                self._pos += 1
+                if self._speed:
+                    delay_sec = (record.timestamp - tx_record.timestamp) / self._speed
+                else:
+                    delay_sec = 0
+                self._link.send_after(
+                    delay_sec, self._deliver, record.handle, record.data_bytes
+                )
+
+    def char_read(self, char_uuid, timeout=1):
+        raise pygatt.exceptions.NotificationTimeout(
+            f"Reads are not captured: {char_uuid}"
+        )
+
+    def _deliver(self, handle, data_bytes):
+        for callback in self._callback_dict.get(handle, []):
+            callback(handle, bytearray(data_bytes))
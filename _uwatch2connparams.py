@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""LE connection parameter profiles.
+
+The connection interval sets how often the central and the watch exchange packets.
+A short interval gives the most throughput, for bulk transfers such as watch face
+uploads. A long interval, with slave latency to let the watch skip connection
+events, saves watch battery and adapter airtime while the link is mostly idle.
+
+Profiles:
+
+    bulk: Shortest interval the watch is likely to accept
+    interactive: Responsive commands at moderate cost
+    idle: Long interval and slave latency, for long running monitoring
+
+Adapters may implement set_connection_parameters(device, profile), which requests
+the parameters and returns the effective ones, as _uwatch2sim.SimAdapter does.
+Neither gatttool nor the BlueZ D-Bus API can update the parameters of an open
+connection, so for other adapters the update is requested with "hcitool lecup" on
+the connection handle. That requires CAP_NET_RAW and CAP_NET_ADMIN, and the effective
+parameters are then not known, so the requested ones are reported.
+
+Profiles are opt-in. Unless a profile is selected, the parameters negotiated by the
+backend are left alone, and hcitool is never run.
+"""
+import collections
+import re
+import subprocess
+
+ConnectionProfile = collections.namedtuple(
+    "ConnectionProfile",
+    ["min_interval_ms", "max_interval_ms", "latency", "supervision_timeout_ms"],
+)
+
+BULK = "bulk"
+INTERACTIVE = "interactive"
+IDLE = "idle"
+
+PROFILE_DICT = {
+    BULK: ConnectionProfile(7.5, 15.0, 0, 2000),
+    INTERACTIVE: ConnectionProfile(15.0, 30.0, 0, 4000),
+    IDLE: ConnectionProfile(100.0, 200.0, 4, 6000),
+}
+
+# Units of the HCI LE Connection Update command
+INTERVAL_UNIT_MS = 1.25
+TIMEOUT_UNIT_MS = 10
+
+DEFAULT_HCI_NAME = "hci0"
+HCITOOL_TIMEOUT_SEC = 5
+# Line in "hcitool con" output, e.g.:
+#   < LE 11:22:33:44:55:66 handle 64 state 1 lm MASTER
+CON_LINE_RX = re.compile(
+    r"LE\s+(?P<addr>[0-9A-Fa-f:]{17})\s+handle\s+(?P<handle>\d+)"
+)
+
+
+class ConnectionParamsError(Exception):
+    pass
+
+
+def get_profile(profile_name):
+    try:
+        return PROFILE_DICT[profile_name]
+    except KeyError:
+        raise ConnectionParamsError(
+            f"Unknown connection profile: {profile_name}. "
+            f"Must be one of: {', '.join(PROFILE_DICT)}"
+        )
+
+
+def check_profile(profile):
+    """Check that a profile is within the limits of the Bluetooth Core
+    specification.
+    """
+    if not 7.5 <= profile.min_interval_ms <= profile.max_interval_ms <= 4000:
+        raise ConnectionParamsError(f"Invalid connection interval: {profile}")
+    if not 0 <= profile.latency <= 499:
+        raise ConnectionParamsError(f"Invalid slave latency: {profile}")
+    if not 100 <= profile.supervision_timeout_ms <= 32000:
+        raise ConnectionParamsError(f"Invalid supervision timeout: {profile}")
+    # The link must survive the longest gap between connection events.
+    if profile.supervision_timeout_ms <= (
+        (1 + profile.latency) * profile.max_interval_ms * 2
+    ):
+        raise ConnectionParamsError(f"Supervision timeout too short: {profile}")
+
+
+def apply_profile(adapter, device, mac_addr, profile):
+    """Request connection parameters for the connection to the watch.
+
+    Returns:
+        ConnectionProfile: The effective parameters.
+    """
+    check_profile(profile)
+    set_func = getattr(adapter, "set_connection_parameters", None)
+    if set_func is not None:
+        return set_func(device, profile)
+    # pygatt.GATTToolBackend keeps the name of its HCI device here.
+    hci_name = getattr(adapter, "_hci_device", None) or DEFAULT_HCI_NAME
+    set_with_hcitool(mac_addr, profile, hci_name)
+    return profile
+
+
+def set_with_hcitool(mac_addr, profile, hci_name=DEFAULT_HCI_NAME):
+    handle = _find_connection_handle(mac_addr, hci_name)
+    _run_hcitool(
+        hci_name,
+        "lecup",
+        "--handle",
+        str(handle),
+        "--min",
+        str(round(profile.min_interval_ms / INTERVAL_UNIT_MS)),
+        "--max",
+        str(round(profile.max_interval_ms / INTERVAL_UNIT_MS)),
+        "--latency",
+        str(profile.latency),
+        "--timeout",
+        str(round(profile.supervision_timeout_ms / TIMEOUT_UNIT_MS)),
+    )
+
+
+def _find_connection_handle(mac_addr, hci_name):
+    for line in _run_hcitool(hci_name, "con").splitlines():
+        m = CON_LINE_RX.search(line)
+        if m and m.group("addr").upper() == mac_addr.upper():
+            return int(m.group("handle"))
+    raise ConnectionParamsError(f"No LE connection to {mac_addr} on {hci_name}")
+
+
+def _run_hcitool(hci_name, *arg_tup):
+    try:
+        result = subprocess.run(
+            ["hcitool", "-i", hci_name, *arg_tup],
+            capture_output=True,
+            text=True,
+            timeout=HCITOOL_TIMEOUT_SEC,
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise ConnectionParamsError(f"Unable to run hcitool: {repr(e)}")
+    if result.returncode:
+        raise ConnectionParamsError(
+            f"hcitool {' '.join(arg_tup)} failed: {result.stderr.strip()}"
+        )
+    return result.stdout
@@ -0,0 +1,654 @@
+#!/usr/bin/env python
+
+"""BlueZ backend that talks to bluetoothd over D-Bus.
+
+DbusAdapter is a replacement for pygatt.GATTToolBackend. It implements the subset of
+the pygatt backend interface that Uwatch2Ble uses, but instead of driving gatttool
+through pexpect and parsing its text output, it calls the BlueZ GATT API directly.
+Writes are single WriteValue calls, and notifications arrive as PropertiesChanged
+signals with the value as a byte array.
+
+Handles are taken from the BlueZ object paths of the characteristics, which hold the
+handle of the characteristic declaration. The value handle follows the declaration,
+so the handles match the ones reported by gatttool.
+
+D-Bus access goes through a small bus interface:
+
+    call(path, interface, method, signature=None, arg_tup=()) -> tuple
+    get_managed_objects() -> {path: {interface: {property: value}}}
+    add_properties_changed_handler(path, callback)
+      callback(path, interface, changed_dict) is called for each PropertiesChanged
+      signal from {path} or an object below it
+    close()
+
+Method arguments use the jeepney conventions, with variants as (signature, value)
+tuples. Return values and properties are unwrapped to plain Python values.
+
+JeepneyBus implements the interface on the system bus with jeepney, which is an
+optional dependency:
+
+    $ pip install jeepney
+
+FakeBluezBus implements the interface in process, as a fake bluetoothd that serves a
+_uwatch2sim.SimWatch. It is for testing and benchmarking the backend without BlueZ or
+a watch.
+"""
+import logging
+import queue
+import re
+import threading
+import time
+import uuid
+
+import pygatt.exceptions
+
+import _uwatch2connparams
+import _uwatch2sim
+
+try:
+    import jeepney
+    import jeepney.bus_messages
+    import jeepney.io.threading
+    import jeepney.wrappers
+except ImportError:
+    jeepney = None
+
+log = logging.getLogger(__name__)
+
+BLUEZ_SERVICE = "org.bluez"
+ADAPTER_IFACE = "org.bluez.Adapter1"
+DEVICE_IFACE = "org.bluez.Device1"
+CHARACTERISTIC_IFACE = "org.bluez.GattCharacteristic1"
+PROPERTIES_IFACE = "org.freedesktop.DBus.Properties"
+OBJECT_MANAGER_IFACE = "org.freedesktop.DBus.ObjectManager"
+
+DEFAULT_ADAPTER_NAME = "hci0"
+DEFAULT_CALL_TIMEOUT_SEC = 10.0
+DEFAULT_CONNECT_TIMEOUT_SEC = 30.0
+# Time between checks for services being resolved after connecting.
+RESOLVE_POLL_INTERVAL_SEC = 0.05
+# Time between attempts to reconnect after the watch disconnects, with
+# auto_reconnect.
+RECONNECT_INTERVAL_SEC = 1.0
+
+CHAR_PATH_RX = re.compile(r"/char([0-9a-fA-F]{4})$")
+
+
+class DbusError(Exception):
+    """Error reply to a D-Bus method call."""
+
+    def __init__(self, name, message=""):
+        super().__init__(f"{name}: {message}" if message else name)
+        self.name = name
+        self.message = message
+
+
+class DbusAdapter(object):
+    """Stand-in for pygatt.GATTToolBackend that uses BlueZ over D-Bus."""
+
+    def __init__(self, bus=None, adapter_name=DEFAULT_ADAPTER_NAME):
+        """
+        Args:
+            bus: Object implementing the bus interface described in the module
+              docstring. If not provided, a JeepneyBus on the system bus is created
+              when the adapter is started.
+            adapter_name (str): BlueZ adapter, e.g. "hci0".
+        """
+        self._bus = bus
+        # A bus that was passed in is left open on stop, so it can be reused.
+        self._owns_bus = False
+        self._adapter_name = adapter_name
+        self._adapter_path = f"/org/bluez/{adapter_name}"
+        self._device = None
+
+    @property
+    def bus(self):
+        return self._bus
+
+    def start(self, *arg_tup, **kwarg_dict):
+        if self._bus is None:
+            self._bus = JeepneyBus()
+            self._owns_bus = True
+
+    def stop(self):
+        device, self._device = self._device, None
+        if device is not None:
+            device.stop_reconnecting()
+        if self._owns_bus:
+            bus, self._bus = self._bus, None
+            self._owns_bus = False
+            bus.close()
+
+    def reset(self):
+        pass
+
+    def kill(self):
+        self.stop()
+
+    def scan(self, timeout=10, run_as_root=False):
+        """Discover BLE devices.
+
+        run_as_root is not used. Discovery over D-Bus does not require root.
+
+        Returns:
+            list of dict: dict_keys are name, address
+        """
+        self._call(self._adapter_path, ADAPTER_IFACE, "StartDiscovery")
+        try:
+            time.sleep(timeout)
+        finally:
+            try:
+                self._call(self._adapter_path, ADAPTER_IFACE, "StopDiscovery")
+            except pygatt.exceptions.BLEError as e:
+                log.debug(f"StopDiscovery failed: {repr(e)}")
+        return [
+            {
+                "name": iface_dict[DEVICE_IFACE].get("Name", ""),
+                "address": iface_dict[DEVICE_IFACE].get("Address", ""),
+            }
+            for path, iface_dict in self._bus.get_managed_objects().items()
+            if DEVICE_IFACE in iface_dict and path.startswith(self._adapter_path + "/")
+        ]
+
+    def connect(self, address, timeout=None, auto_reconnect=False, **kwarg_dict):
+        device_path = f"{self._adapter_path}/dev_{address.upper().replace(':', '_')}"
+        device = DbusDevice(self, device_path, address, auto_reconnect)
+        device.connect(timeout or DEFAULT_CONNECT_TIMEOUT_SEC)
+        self._device = device
+        return device
+
+    def disconnect(self, device=None):
+        # recover() passes the adapter itself, so anything that is not a device
+        # disconnects the current device.
+        if not isinstance(device, DbusDevice):
+            device = self._device
+        if device is not None:
+            device.disconnect()
+
+    def reconnect(self, device, timeout=None):
+        device.connect(timeout or DEFAULT_CONNECT_TIMEOUT_SEC)
+        device.resubscribe_all()
+
+    def set_connection_parameters(self, device, profile):
+        # BlueZ has no D-Bus method for updating the parameters of an open
+        # connection, so this goes through hcitool, unless the bus can do it.
+        set_func = getattr(self._bus, "set_connection_parameters", None)
+        if set_func is not None:
+            return set_func(profile)
+        _uwatch2connparams.set_with_hcitool(
+            device._address, profile, self._adapter_name
+        )
+        return profile
+
+    def _call(self, path, iface, method, signature=None, arg_tup=(), timeout=None):
+        """Call a BlueZ method, translating D-Bus errors to pygatt exceptions."""
+        try:
+            return self._bus.call(
+                path,
+                iface,
+                method,
+                signature,
+                arg_tup,
+                timeout or DEFAULT_CALL_TIMEOUT_SEC,
+            )
+        except DbusError as e:
+            if e.name == "org.bluez.Error.NotConnected" or "Not connected" in str(e):
+                raise pygatt.exceptions.NotConnectedError(str(e))
+            raise pygatt.exceptions.BLEError(str(e))
+
+    def _get_property(self, path, iface, name):
+        return self._call(path, PROPERTIES_IFACE, "Get", "ss", (iface, name))[0]
+
+
+class DbusDevice(object):
+    """Stand-in for pygatt.GATTToolBLEDevice that uses BlueZ over D-Bus."""
+
+    def __init__(self, adapter, device_path, address, auto_reconnect):
+        self._adapter = adapter
+        self._path = device_path
+        self._address = address
+        self._auto_reconnect = auto_reconnect
+        self._lock = threading.Lock()
+        # UUID -> (object path, handle)
+        self._char_dict = {}
+        self._path_to_handle_dict = {}
+        # handle -> list of callbacks
+        self._callback_dict = {}
+        self._subscribed_uuid_set = set()
+        self._disconnect_callback_list = []
+        self._is_connected = False
+        self._reconnect_thread = None
+        self._stop_event = threading.Event()
+        adapter.bus.add_properties_changed_handler(
+            device_path, self._on_properties_changed
+        )
+
+    def connect(self, timeout_sec):
+        """Connect and wait for the GATT services to be resolved."""
+        self._stop_event.clear()
+        try:
+            self._adapter._call(
+                self._path, DEVICE_IFACE, "Connect", timeout=timeout_sec
+            )
+        except pygatt.exceptions.BLEError as e:
+            raise pygatt.exceptions.NotConnectedError(
+                f"Unable to connect to {self._address}: {e}"
+            )
+        deadline = time.monotonic() + timeout_sec
+        while not self._adapter._get_property(
+            self._path, DEVICE_IFACE, "ServicesResolved"
+        ):
+            if time.monotonic() > deadline:
+                raise pygatt.exceptions.NotConnectedError(
+                    f"Services of {self._address} were not resolved within "
+                    f"{timeout_sec} sec"
+                )
+            time.sleep(RESOLVE_POLL_INTERVAL_SEC)
+        self._discover()
+        with self._lock:
+            self._is_connected = True
+
+    def disconnect(self):
+        self.stop_reconnecting()
+        self._adapter._call(self._path, DEVICE_IFACE, "Disconnect")
+
+    def stop_reconnecting(self):
+        self._stop_event.set()
+
+    def bond(self, permanent=False):
+        if not self._adapter._get_property(self._path, DEVICE_IFACE, "Paired"):
+            try:
+                self._adapter._call(self._path, DEVICE_IFACE, "Pair")
+            except pygatt.exceptions.BLEError as e:
+                if "AlreadyExists" not in str(e):
+                    raise
+        if permanent:
+            self._adapter._call(
+                self._path,
+                PROPERTIES_IFACE,
+                "Set",
+                "ssv",
+                (DEVICE_IFACE, "Trusted", ("b", True)),
+            )
+
+    def get_handle(self, char_uuid):
+        try:
+            return self._char_dict[uuid.UUID(str(char_uuid))][1]
+        except KeyError:
+            raise pygatt.exceptions.BLEError(f"No characteristic found: {char_uuid}")
+
+    def discover_characteristics(self):
+        return {u: handle for u, (_, handle) in self._char_dict.items()}
+
+    def subscribe(
+        self, char_uuid, callback=None, indication=False, wait_for_response=True
+    ):
+        char_uuid = uuid.UUID(str(char_uuid))
+        char_path, handle = self._get_char(char_uuid)
+        with self._lock:
+            if callback is not None:
+                self._callback_dict.setdefault(handle, []).append(callback)
+            self._subscribed_uuid_set.add(char_uuid)
+        self._adapter._call(char_path, CHARACTERISTIC_IFACE, "StartNotify")
+
+    def resubscribe_all(self):
+        with self._lock:
+            uuid_list = list(self._subscribed_uuid_set)
+        for char_uuid in uuid_list:
+            char_path, _ = self._get_char(char_uuid)
+            self._adapter._call(char_path, CHARACTERISTIC_IFACE, "StartNotify")
+
+    def register_disconnect_callback(self, callback):
+        self._disconnect_callback_list.append(callback)
+
+    def char_read(self, char_uuid, timeout=1):
+        char_path, _ = self._get_char(uuid.UUID(str(char_uuid)))
+        try:
+            (value,) = self._adapter._call(
+                char_path, CHARACTERISTIC_IFACE, "ReadValue", "a{sv}", ({},), timeout
+            )
+        except pygatt.exceptions.BLEError as e:
+            raise pygatt.exceptions.NotificationTimeout(str(e))
+        return bytearray(value)
+
+    def char_write(self, char_uuid, value, wait_for_response=True):
+        char_path, _ = self._get_char(uuid.UUID(str(char_uuid)))
+        # A write request is acknowledged by the watch. A write command is not.
+        write_type = "request" if wait_for_response else "command"
+        self._adapter._call(
+            char_path,
+            CHARACTERISTIC_IFACE,
+            "WriteValue",
+            "aya{sv}",
+            (bytes(value), {"type": ("s", write_type)}),
+        )
+
+    def _get_char(self, char_uuid):
+        try:
+            return self._char_dict[char_uuid]
+        except KeyError:
+            raise pygatt.exceptions.BLEError(f"No characteristic found: {char_uuid}")
+
+    def _discover(self):
+        char_dict = {}
+        for path, iface_dict in self._adapter.bus.get_managed_objects().items():
+            prop_dict = iface_dict.get(CHARACTERISTIC_IFACE)
+            if prop_dict is None or not path.startswith(self._path + "/"):
+                continue
+            m = CHAR_PATH_RX.search(path)
+            if m:
+                handle = int(m.group(1), 16) + 1
+            else:
+                handle = prop_dict.get("Handle")
+            char_dict[uuid.UUID(prop_dict["UUID"])] = (path, handle)
+        self._char_dict = char_dict
+        self._path_to_handle_dict = {v[0]: v[1] for v in char_dict.values()}
+
+    def _on_properties_changed(self, path, iface, changed_dict):
+        if iface == CHARACTERISTIC_IFACE and "Value" in changed_dict:
+            handle = self._path_to_handle_dict.get(path)
+            value = bytearray(changed_dict["Value"])
+            for callback in self._callback_dict.get(handle, []):
+                callback(handle, value)
+        elif (
+            iface == DEVICE_IFACE
+            and path == self._path
+            and changed_dict.get("Connected") is False
+        ):
+            self._on_disconnected()
+
+    def _on_disconnected(self):
+        with self._lock:
+            if not self._is_connected:
+                return
+            self._is_connected = False
+        for callback in self._disconnect_callback_list:
+            callback({"device": self._address})
+        if self._auto_reconnect and not self._stop_event.is_set():
+            self._reconnect_thread = threading.Thread(
+                target=self._run_reconnect, name="uwatch2-dbus-reconnect", daemon=True
+            )
+            self._reconnect_thread.start()
+
+    def _run_reconnect(self):
+        while not self._stop_event.wait(RECONNECT_INTERVAL_SEC):
+            try:
+                self.connect(DEFAULT_CONNECT_TIMEOUT_SEC)
+                self.resubscribe_all()
+            except pygatt.exceptions.BLEError as e:
+                log.debug(f"Reconnect failed: {repr(e)}")
+                continue
+            log.info(f"Reconnected to {self._address}")
+            return
+
+
+class JeepneyBus(object):
+    """Bus interface on the D-Bus system bus, implemented with jeepney."""
+
+    def __init__(self, bus_name="SYSTEM"):
+        if jeepney is None:
+            raise pygatt.exceptions.BLEError(
+                "The D-Bus backend requires jeepney. Install with: pip install jeepney"
+            )
+        self._router = jeepney.io.threading.open_dbus_router(bus=bus_name)
+        self._lock = threading.Lock()
+        # (path, callback)
+        self._handler_list = []
+        self._signal_queue = queue.Queue()
+        # Not matched on sender, since signals carry the unique name of bluetoothd
+        # rather than org.bluez.
+        rule = jeepney.MatchRule(
+            type="signal",
+            interface=PROPERTIES_IFACE,
+            member="PropertiesChanged",
+            path_namespace="/org/bluez",
+        )
+        self._router.send_and_get_reply(jeepney.bus_messages.message_bus.AddMatch(rule))
+        self._filter = self._router.filter(rule, queue=self._signal_queue)
+        self._signal_thread = threading.Thread(
+            target=self._run_signals, name="uwatch2-dbus-signals", daemon=True
+        )
+        self._signal_thread.start()
+        self._is_closed = False
+
+    def call(self, path, iface, method, signature=None, arg_tup=(), timeout=None):
+        msg = jeepney.new_method_call(
+            jeepney.DBusAddress(path, bus_name=BLUEZ_SERVICE, interface=iface),
+            method,
+            signature,
+            arg_tup,
+        )
+        reply = self._router.send_and_get_reply(msg, timeout=timeout)
+        try:
+            body_tup = jeepney.wrappers.unwrap_msg(reply)
+        except jeepney.wrappers.DBusErrorResponse as e:
+            raise DbusError(e.name, " ".join(map(str, e.data)))
+        return tuple(_unwrap_variant(v) for v in body_tup)
+
+    def get_managed_objects(self):
+        (object_dict,) = self.call("/", OBJECT_MANAGER_IFACE, "GetManagedObjects")
+        return {
+            path: {
+                iface: {k: _unwrap_variant(v) for k, v in prop_dict.items()}
+                for iface, prop_dict in iface_dict.items()
+            }
+            for path, iface_dict in object_dict.items()
+        }
+
+    def add_properties_changed_handler(self, path, callback):
+        with self._lock:
+            self._handler_list.append((path, callback))
+
+    def close(self):
+        if self._is_closed:
+            return
+        self._is_closed = True
+        self._signal_queue.put(None)
+        self._signal_thread.join()
+        self._filter.close()
+        self._router.close()
+
+    def _run_signals(self):
+        while True:
+            msg = self._signal_queue.get()
+            if msg is None:
+                return
+            path = msg.header.fields[jeepney.HeaderFields.path]
+            iface, changed_dict, _ = msg.body
+            changed_dict = {k: _unwrap_variant(v) for k, v in changed_dict.items()}
+            with self._lock:
+                handler_list = list(self._handler_list)
+            for handler_path, callback in handler_list:
+                if path == handler_path or path.startswith(handler_path + "/"):
+                    try:
+                        callback(path, iface, changed_dict)
+                    except Exception as e:
+                        log.error(f"PropertiesChanged handler failed: {repr(e)}")
+
+
+def _unwrap_variant(v):
+    """Get the value of a jeepney variant, which is a (signature, value) tuple."""
+    if isinstance(v, tuple) and len(v) == 2 and isinstance(v[0], str):
+        return v[1]
+    return v
+
+
+class FakeBluezBus(object):
+    """Bus interface implemented as a fake bluetoothd that serves a SimWatch.
+
+    The object tree has an adapter, the simulated watch as a device, and the watch
+    characteristics at the handles in _uwatch2sim.HANDLE_DICT. Signals are delivered
+    on a separate thread, as with a real bus.
+    """
+
+    def __init__(
+        self, watch=None, adapter_name=DEFAULT_ADAPTER_NAME, link_latency_sec=0.0
+    ):
+        """
+        Args:
+            watch (_uwatch2sim.SimWatch): The simulated watch. A new SimWatch is created
+              if not provided.
+            adapter_name (str): Name of the fake adapter.
+            link_latency_sec (float): One-way latency for writes and notifications.
+        """
+        self.watch = watch or _uwatch2sim.SimWatch()
+        self._lock = threading.RLock()
+        self._link = _uwatch2sim.SimLink(link_latency_sec)
+        self._link.start()
+        self._handler_list = []
+        self.adapter_path = f"/org/bluez/{adapter_name}"
+        self.device_path = (
+            f"{self.adapter_path}/dev_{_uwatch2sim.SIM_MAC_ADDR.replace(':', '_')}"
+        )
+        self._object_dict = {
+            self.adapter_path: {ADAPTER_IFACE: {"Powered": True, "Discovering": False}},
+            self.device_path: {
+                DEVICE_IFACE: {
+                    "Address": _uwatch2sim.SIM_MAC_ADDR,
+                    "Name": _uwatch2sim.SIM_WATCH_NAME,
+                    "Connected": False,
+                    "ServicesResolved": False,
+                    "Paired": False,
+                    "Trusted": False,
+                }
+            },
+        }
+        # handle -> characteristic object path
+        self._char_path_dict = {}
+        for char_uuid, handle in _uwatch2sim.HANDLE_DICT.items():
+            char_path = f"{self.device_path}/service0030/char{handle - 1:04x}"
+            self._char_path_dict[handle] = char_path
+            self._object_dict[char_path] = {
+                CHARACTERISTIC_IFACE: {
+                    "UUID": str(char_uuid),
+                    "Value": b"",
+                    "Notifying": False,
+                }
+            }
+        self._uuid_by_path_dict = {
+            p: uuid.UUID(d[CHARACTERISTIC_IFACE]["UUID"])
+            for p, d in self._object_dict.items()
+            if CHARACTERISTIC_IFACE in d
+        }
+        # Number of method calls, for benchmarking.
+        self.call_count = 0
+
+    def call(self, path, iface, method, signature=None, arg_tup=(), timeout=None):
+        with self._lock:
+            self.call_count += 1
+            if path not in self._object_dict and iface != OBJECT_MANAGER_IFACE:
+                raise DbusError(
+                    "org.freedesktop.DBus.Error.UnknownObject", f"No object: {path}"
+                )
+            if iface == PROPERTIES_IFACE:
+                return self._call_properties(path, method, arg_tup)
+            if iface == OBJECT_MANAGER_IFACE and method == "GetManagedObjects":
+                return (self.get_managed_objects(),)
+            if iface == ADAPTER_IFACE and method in ("StartDiscovery", "StopDiscovery"):
+                self._set(path, iface, "Discovering", method == "StartDiscovery")
+                return ()
+            if iface == DEVICE_IFACE:
+                return self._call_device(method)
+            if iface == CHARACTERISTIC_IFACE:
+                return self._call_characteristic(path, method, arg_tup)
+        raise DbusError(
+            "org.freedesktop.DBus.Error.UnknownMethod", f"{iface}.{method}"
+        )
+
+    def get_managed_objects(self):
+        with self._lock:
+            return {
+                path: {iface: dict(d) for iface, d in iface_dict.items()}
+                for path, iface_dict in self._object_dict.items()
+            }
+
+    def add_properties_changed_handler(self, path, callback):
+        with self._lock:
+            self._handler_list.append((path, callback))
+
+    def close(self):
+        self._link.stop()
+
+    def set_connection_parameters(self, profile):
+        return self.watch.set_connection_parameters(profile)
+
+    # Called by SimWatch, in place of a SimDevice
+
+    def notify(self, handle, value_bytes):
+        char_path = self._char_path_dict[handle]
+        with self._lock:
+            if not self._object_dict[char_path][CHARACTERISTIC_IFACE]["Notifying"]:
+                return
+        self._link.send(
+            self._emit, char_path, CHARACTERISTIC_IFACE, {"Value": bytes(value_bytes)}
+        )
+
+    def notify_disconnected(self):
+        with self._lock:
+            self._set_disconnected()
+
+    def _call_properties(self, path, method, arg_tup):
+        if method == "Get":
+            iface, name = arg_tup
+            return (self._object_dict[path][iface][name],)
+        if method == "GetAll":
+            (iface,) = arg_tup
+            return (dict(self._object_dict[path][iface]),)
+        if method == "Set":
+            iface, name, value = arg_tup
+            self._set(path, iface, name, _unwrap_variant(value))
+            return ()
+        raise DbusError("org.freedesktop.DBus.Error.UnknownMethod", method)
+
+    def _call_device(self, method):
+        if method == "Connect":
+            self.watch.attach(self)
+            self._set(self.device_path, DEVICE_IFACE, "Connected", True)
+            self._set(self.device_path, DEVICE_IFACE, "ServicesResolved", True)
+        elif method == "Disconnect":
+            self.watch.detach()
+        elif method == "Pair":
+            if self._object_dict[self.device_path][DEVICE_IFACE]["Paired"]:
+                raise DbusError("org.bluez.Error.AlreadyExists", "Already Exists")
+            self._set(self.device_path, DEVICE_IFACE, "Paired", True)
+        else:
+            raise DbusError("org.freedesktop.DBus.Error.UnknownMethod", method)
+        return ()
+
+    def _call_characteristic(self, path, method, arg_tup):
+        if not self._object_dict[self.device_path][DEVICE_IFACE]["Connected"]:
+            raise DbusError("org.bluez.Error.Failed", "Not connected")
+        if method == "WriteValue":
+            value_bytes = bytes(arg_tup[0])
+            char_uuid = self._uuid_by_path_dict[path]
+            if char_uuid == _uwatch2sim.COMMAND_UUID:
+                self._link.send(self.watch.receive_chunk, value_bytes)
+            elif char_uuid == _uwatch2sim.DATA_UUID:
+                self._link.send(self.watch.receive_data_chunk, value_bytes)
+            return ()
+        if method in ("StartNotify", "StopNotify"):
+            self._set(path, CHARACTERISTIC_IFACE, "Notifying", method == "StartNotify")
+            return ()
+        if method == "ReadValue":
+            raise DbusError("org.bluez.Error.NotPermitted", "Read not permitted")
+        raise DbusError("org.freedesktop.DBus.Error.UnknownMethod", method)
+
+    def _set_disconnected(self):
+        self._set(self.device_path, DEVICE_IFACE, "ServicesResolved", False)
+        self._set(self.device_path, DEVICE_IFACE, "Connected", False)
+        for char_path in self._char_path_dict.values():
+            self._object_dict[char_path][CHARACTERISTIC_IFACE]["Notifying"] = False
+
+    def _set(self, path, iface, name, value):
+        prop_dict = self._object_dict[path][iface]
+        if prop_dict.get(name) == value:
+            return
+        prop_dict[name] = value
+        self._link.send(self._emit, path, iface, {name: value})
+
+    def _emit(self, path, iface, changed_dict):
+        with self._lock:
+            handler_list = list(self._handler_list)
+        for handler_path, callback in handler_list:
+            if path == handler_path or path.startswith(handler_path + "/"):
+                callback(path, iface, changed_dict)
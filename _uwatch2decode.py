@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+
+"""Bulk decoding of trace files written by _uwatch2capture.
+
+Trace files are memory-mapped and scanned in place. Chunks written to the command
+characteristic and notifications from the async response characteristic are
+reassembled into complete packets by their "fe ea 10 N" headers. Several packets in
+one chunk and packets spanning several chunks are both handled. If the stream loses
+framing, decoding resumes at the next header.
+
+Decoded packets are returned as columns, one entry per packet:
+
+    file_idx (array 'H'): Index of the trace file in the archive
+    direction (array 'B'): _uwatch2capture.TX or RX
+    timestamp (array 'd'): Time of the chunk in which the packet started
+    cmd_key (array 'B')
+    chunk_count (array 'H'): Number of chunks that contributed to the packet
+    payload_offset (array 'Q'): Offset of the payload in payload_bytes
+    payload_len (array 'H'): Length of the payload, not including cmd_key
+    payload_bytes (bytearray): Payloads of all packets, concatenated
+
+The columns are compact to pickle, so files can be decoded in a process pool and the
+results merged cheaply.
+
+NumPy is not a dependency, so decoding is not vectorized in the NumPy sense. Trace
+records and packets are both variable length, so finding them is inherently
+sequential, and the records are walked with Struct.unpack_from and the packets with
+bytearray.find(). The work per packet is a few C level appends. When columns are
+merged, the payload offsets are recomputed in a single itertools.accumulate() pass
+over the payload lengths, instead of being rebased one by one. The columns can be
+wrapped with numpy.frombuffer() without copying, for vectorized analysis.
+"""
+import array
+import concurrent.futures
+import itertools
+import mmap
+import os
+import uuid
+
+import _uwatch2capture
+
+HEADER_BYTES = bytes([0xFE, 0xEA, 0x10])
+
+COMMAND_UUID = uuid.UUID("0000fee2-0000-1000-8000-00805f9b34fb")
+ASYNC_RESPONSE_UUID = uuid.UUID("0000fee3-0000-1000-8000-00805f9b34fb")
+
+COLUMN_TYPE_DICT = {
+    "file_idx": "H",
+    "direction": "B",
+    "timestamp": "d",
+    "cmd_key": "B",
+    "chunk_count": "H",
+    "payload_offset": "Q",
+    "payload_len": "H",
+}
+
+
+def new_columns():
+    column_dict = {k: array.array(v) for k, v in COLUMN_TYPE_DICT.items()}
+    column_dict["payload_bytes"] = bytearray()
+    # Number of times framing was lost and decoding resumed at the next header.
+    column_dict["resync_count"] = 0
+    # Number of trace bytes scanned.
+    column_dict["byte_count"] = 0
+    return column_dict
+
+
+def decode_file(trace_path, file_idx=0):
+    """Decode all packets in a trace file.
+
+    Returns:
+        dict: Columns. See module docstring.
+    """
+    column_dict = new_columns()
+    if not os.path.getsize(trace_path):
+        return column_dict
+    with open(trace_path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            _decode_buf(mm, file_idx, column_dict)
+    return column_dict
+
+
+def decode_archive(trace_path_list, process_count=None):
+    """Decode a list of trace files, spreading the files over a process pool.
+
+    Args:
+        trace_path_list (list of str): Trace files.
+        process_count (int): Number of worker processes. Defaults to the number of
+          CPUs. 1 decodes in the calling process.
+
+    Returns:
+        dict: Columns for all files, in the order of {trace_path_list}. See module
+        docstring.
+    """
+    if process_count == 1 or len(trace_path_list) == 1:
+        column_dict_list = [decode_file(p, i) for i, p in enumerate(trace_path_list)]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(process_count) as executor:
+            column_dict_list = list(
+                executor.map(
+                    decode_file, trace_path_list, range(len(trace_path_list))
+                )
+            )
+    return merge_columns(column_dict_list)
+
+
+def merge_columns(column_dict_list):
+    merged_dict = new_columns()
+    for column_dict in column_dict_list:
+        for k in COLUMN_TYPE_DICT:
+            if k != "payload_offset":
+                merged_dict[k].extend(column_dict[k])
+        merged_dict["payload_bytes"].extend(column_dict["payload_bytes"])
+        merged_dict["resync_count"] += column_dict["resync_count"]
+        merged_dict["byte_count"] += column_dict["byte_count"]
+    # The payloads are stored back to back in packet order, so each offset is the
+    # sum of the lengths of the payloads before it.
+    payload_offset_array = array.array(
+        COLUMN_TYPE_DICT["payload_offset"],
+        itertools.accumulate(merged_dict["payload_len"], initial=0),
+    )
+    payload_offset_array.pop()
+    merged_dict["payload_offset"] = payload_offset_array
+    return merged_dict
+
+
+def iter_packets(column_dict):
+    """Iterate over decoded packets as dicts, for inspection."""
+    payload_bytes = column_dict["payload_bytes"]
+    for i in range(len(column_dict["cmd_key"])):
+        offset = column_dict["payload_offset"][i]
+        yield {
+            "file_idx": column_dict["file_idx"][i],
+            "direction": column_dict["direction"][i],
+            "timestamp": column_dict["timestamp"][i],
+            "cmd_key": column_dict["cmd_key"][i],
+            "chunk_count": column_dict["chunk_count"][i],
+            "payload_bytes": bytes(
+                payload_bytes[offset : offset + column_dict["payload_len"][i]]
+            ),
+        }
+
+
+def _decode_buf(buf, file_idx, column_dict):
+    metadata_dict, pos = _uwatch2capture.parse_capture_preamble(buf)
+    handle_dict = {
+        uuid.UUID(k): v for k, v in metadata_dict.get("handle_dict", {}).items()
+    }
+    # Reassembly state per framed handle: [direction, pending bytes, timestamp of
+    # first chunk of the pending packet, chunk count]
+    stream_dict = {}
+    for charcs_uuid, direction in (
+        (COMMAND_UUID, _uwatch2capture.TX),
+        (ASYNC_RESPONSE_UUID, _uwatch2capture.RX),
+    ):
+        if charcs_uuid in handle_dict:
+            stream_dict[handle_dict[charcs_uuid]] = [direction, bytearray(), 0.0, 0]
+
+    unpack_from = _uwatch2capture.RECORD_HEADER_STRUCT.unpack_from
+    header_size = _uwatch2capture.RECORD_HEADER_STRUCT.size
+    buf_len = len(buf)
+    view = memoryview(buf)
+    try:
+        while pos + header_size <= buf_len:
+            direction, handle, timestamp, byte_count = unpack_from(buf, pos)
+            pos += header_size
+            stream = stream_dict.get(handle)
+            if stream is not None and stream[0] == direction:
+                _add_chunk(
+                    stream,
+                    view[pos : pos + byte_count],
+                    timestamp,
+                    file_idx,
+                    column_dict,
+                )
+            pos += byte_count
+    finally:
+        view.release()
+    column_dict["byte_count"] += buf_len
+
+
+def _add_chunk(stream, chunk_view, timestamp, file_idx, column_dict):
+    direction, pending_bytes, start_timestamp, chunk_count = stream
+    if not pending_bytes:
+        start_timestamp = timestamp
+        chunk_count = 0
+    pending_bytes.extend(chunk_view)
+    chunk_count += 1
+    while len(pending_bytes) >= 4:
+        if pending_bytes[:3] != HEADER_BYTES:
+            column_dict["resync_count"] += 1
+            next_pos = pending_bytes.find(HEADER_BYTES, 1)
+            if next_pos == -1:
+                # Keep the start of a header that may continue in the next chunk, as
+                # _uwatch2ble does for notifications.
+                keep_len = 0
+                for n in (2, 1):
+                    if pending_bytes.endswith(HEADER_BYTES[:n]):
+                        keep_len = n
+                        break
+                del pending_bytes[: len(pending_bytes) - keep_len]
+                start_timestamp = timestamp
+                chunk_count = 1
+                break
+            del pending_bytes[:next_pos]
+            continue
+        pkg_len = pending_bytes[3]
+        if pkg_len < 5:
+            column_dict["resync_count"] += 1
+            del pending_bytes[:3]
+            continue
+        if len(pending_bytes) < pkg_len:
+            break
+        column_dict["file_idx"].append(file_idx)
+        column_dict["direction"].append(direction)
+        column_dict["timestamp"].append(start_timestamp)
+        column_dict["cmd_key"].append(pending_bytes[4])
+        column_dict["chunk_count"].append(chunk_count)
+        column_dict["payload_offset"].append(len(column_dict["payload_bytes"]))
+        column_dict["payload_len"].append(pkg_len - 5)
+        column_dict["payload_bytes"].extend(pending_bytes[5:pkg_len])
+        del pending_bytes[:pkg_len]
+        # Any remaining bytes start the next packet within the same chunk.
+        start_timestamp = timestamp
+        chunk_count = 1
+    stream[2] = start_timestamp
+    stream[3] = chunk_count
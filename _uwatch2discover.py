@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+"""Pipelined sweep of cmd_keys, for discovering the protocol.
+
+A probe is a packet with a cmd_key and argument bytes from a template. The sweep
+keeps up to window_size probes in flight, instead of waiting for the response or
+timeout of each probe before sending the next one. Since most cmd_keys are never
+answered, a sweep is dominated by timeouts, and N probes in flight wait out N timeouts
+at once.
+
+Responses are received as events (see _uwatch2events), and matched to probes by the
+cmd_key of the response frame. Two probes with the same cmd_key are therefore never
+in flight at the same time. The probes are ordered by template, then by cmd_key, so
+probes with the same cmd_key are far apart, and a late response to one is unlikely to
+be taken as the response to the next. Frames with a cmd_key that has no probe in
+flight are recorded as unsolicited.
+
+Results are appended to a table file, one JSON record per line:
+
+    {"cmd_key": "0x2e", "args": "", "status": "response", "payload": "53494d",
+     "latency_ms": 41.2, "time": 1760000000.0}
+
+Status is one of response, timeout or unsolicited. Probes that are already in the
+table are skipped, so an interrupted sweep resumes where it stopped.
+
+cmd_keys that are known to change the state of the watch are on a denylist, and are
+not probed unless explicitly allowed.
+"""
+import collections
+import json
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+RESPONSE = "response"
+TIMEOUT = "timeout"
+UNSOLICITED = "unsolicited"
+
+DEFAULT_WINDOW_SIZE = 8
+DEFAULT_TIMEOUT_SEC = 2.0
+
+# cmd_key -> reason it is not probed by default. Holds every cmd_key that uwatch2lib
+# sends as a write, including the ones in its commented out, untested commands.
+DEFAULT_DENY_DICT = {
+    **{k: "Changes settings" for k in range(0x10, 0x20)},
+    0x25: "Named as a setter (set_display_device_function_support)",
+    0x31: "Sets the clock",
+    0x32: "Starts sleep sync",
+    0x33: "Starts sleep sync",
+    0x36: "Starts or stops heart rate measurement",
+    0x38: "Changes the watch face layout",
+    0x41: "Displays a message",
+    0x42: "Changes the weather forecast",
+    0x43: "Changes the weather",
+    0x51: "Shuts down the watch",
+    0x52: "Calibrates the accelerometer",
+    0x54: "Changes the step length",
+    0x61: "Vibrates the watch",
+    0x63: "Aborts firmware upgrade",
+    0x66: "Switches the camera view",
+    0x68: "Unknown command without response",
+    0x69: "Stops blood pressure measurement",
+    0x6B: "Stops blood oxygen measurement",
+    0x6D: "Unknown command without response",
+    0x6E: "Starts watch face upload",
+    0x6F: "Sends an ECG command",
+    0x71: "Changes settings",
+    0x72: "Changes settings",
+    0x74: "Starts watch face transfer",
+    0x75: "Changes the physiological period reminder",
+    0x78: "Changes settings",
+}
+
+
+class DiscoveryTable(object):
+    """Probe results, persisted as JSON lines."""
+
+    def __init__(self, table_path):
+        """
+        Args:
+            table_path (str): Path to the table file. Created if it does not exist.
+        """
+        self._table_path = table_path
+        self._lock = threading.Lock()
+        # (cmd_key, args_hex) -> latest record
+        self._record_dict = {}
+        self._load()
+
+    def has(self, cmd_key, args_bytes, status_set=None):
+        """Returns:
+        bool: True if the probe is in the table, with a status in {status_set} if
+        provided.
+        """
+        with self._lock:
+            record_dict = self._record_dict.get((cmd_key, args_bytes.hex()))
+        return record_dict is not None and (
+            status_set is None or record_dict["status"] in status_set
+        )
+
+    def add(self, cmd_key, args_bytes, status, payload_bytes=None, latency_sec=None):
+        record_dict = {
+            "cmd_key": f"0x{cmd_key:02x}",
+            "args": None if args_bytes is None else args_bytes.hex(),
+            "status": status,
+            "payload": None if payload_bytes is None else bytes(payload_bytes).hex(),
+            "latency_ms": None if latency_sec is None else round(latency_sec * 1e3, 1),
+            "time": time.time(),
+        }
+        with self._lock:
+            if args_bytes is not None:
+                self._record_dict[(cmd_key, args_bytes.hex())] = record_dict
+            with open(self._table_path, "a") as f:
+                f.write(json.dumps(record_dict) + "\n")
+
+    def get_record_list(self):
+        """Get the latest record for each probe, ordered by cmd_key and args.
+
+        Returns:
+            list of dict
+        """
+        with self._lock:
+            return [self._record_dict[k] for k in sorted(self._record_dict)]
+
+    def _load(self):
+        try:
+            with open(self._table_path) as f:
+                line_list = f.readlines()
+        except FileNotFoundError:
+            return
+        for line_idx, line_str in enumerate(line_list):
+            try:
+                record_dict = json.loads(line_str)
+            except ValueError:
+                # Typically a line that was cut short when the process was killed
+                log.warning(f"Skipping invalid line {line_idx + 1} in table")
+                continue
+            if record_dict["args"] is None:
+                continue
+            cmd_key = int(record_dict["cmd_key"], 16)
+            self._record_dict[(cmd_key, record_dict["args"])] = record_dict
+
+
+class ProtocolSweep(object):
+    def __init__(
+        self,
+        uwatch2,
+        table,
+        template_list=(b"",),
+        window_size=DEFAULT_WINDOW_SIZE,
+        timeout_sec=DEFAULT_TIMEOUT_SEC,
+        deny_dict=None,
+        retry_timeouts=False,
+        progress_callback=None,
+    ):
+        """
+        Args:
+            uwatch2 (uwatch2lib.Uwatch2): Connected watch.
+            table (DiscoveryTable): Receives the results.
+            template_list (list of bytes): Argument bytes to send with each cmd_key.
+            window_size (int): Max number of probes in flight.
+            timeout_sec (float): Time after which a probe without a response is
+              recorded as a timeout.
+            deny_dict (dict): cmd_key -> reason, for cmd_keys that are not probed.
+              Defaults to DEFAULT_DENY_DICT.
+            retry_timeouts (bool): Probe again if the table has a timeout for the
+              probe. Other probes in the table are always skipped.
+            progress_callback (callable): Called with (cmd_key, args_bytes, status)
+              for each result.
+        """
+        self._uwatch2 = uwatch2
+        self._table = table
+        self._template_list = list(template_list)
+        self._window_size = window_size
+        self._timeout_sec = timeout_sec
+        self._deny_dict = DEFAULT_DENY_DICT if deny_dict is None else deny_dict
+        self._skip_status_set = {RESPONSE} if retry_timeouts else {RESPONSE, TIMEOUT}
+        self._progress_callback = progress_callback
+        self._cond = threading.Condition()
+        # cmd_key -> (args_bytes, send_time)
+        self._in_flight_dict = {}
+        self._stats_dict = collections.Counter()
+
+    def run(self, cmd_key_list):
+        """Probe each cmd_key in {cmd_key_list} with each template.
+
+        Returns:
+            dict: dict_keys are probed, response, timeout, unsolicited, skipped,
+            denied, elapsed_sec
+        """
+        start_time = time.monotonic()
+        self._stats_dict = collections.Counter()
+        probe_deque = collections.deque()
+        for args_bytes in self._template_list:
+            for cmd_key in cmd_key_list:
+                if cmd_key in self._deny_dict:
+                    self._stats_dict["denied"] += 1
+                elif self._table.has(cmd_key, args_bytes, self._skip_status_set):
+                    self._stats_dict["skipped"] += 1
+                else:
+                    probe_deque.append((cmd_key, args_bytes))
+        # Listen on all cmd_keys, to also catch responses that do not echo the
+        # cmd_key of the probe.
+        for cmd_key in range(0x100):
+            self._uwatch2.add_event_handler(cmd_key, self._on_frame)
+        try:
+            self._run(probe_deque)
+        finally:
+            for cmd_key in range(0x100):
+                self._uwatch2.remove_event_handler(cmd_key, self._on_frame)
+            with self._cond:
+                self._in_flight_dict.clear()
+        stats_dict = {
+            k: self._stats_dict[k]
+            for k in ("probed", RESPONSE, TIMEOUT, UNSOLICITED, "skipped", "denied")
+        }
+        stats_dict["elapsed_sec"] = time.monotonic() - start_time
+        return stats_dict
+
+    def _run(self, probe_deque):
+        while True:
+            send_list = []
+            with self._cond:
+                self._expire()
+                while probe_deque and len(self._in_flight_dict) < self._window_size:
+                    # The next probe with a cmd_key that is not in flight
+                    probe_tup = next(
+                        (v for v in probe_deque if v[0] not in self._in_flight_dict),
+                        None,
+                    )
+                    if probe_tup is None:
+                        break
+                    probe_deque.remove(probe_tup)
+                    cmd_key, args_bytes = probe_tup
+                    self._in_flight_dict[cmd_key] = (args_bytes, time.monotonic())
+                    send_list.append(probe_tup)
+                if not send_list:
+                    if not self._in_flight_dict and not probe_deque:
+                        return
+                    deadline = (
+                        min(v[1] for v in self._in_flight_dict.values())
+                        + self._timeout_sec
+                    )
+                    self._cond.wait(max(0.0, deadline - time.monotonic()))
+                    continue
+            for cmd_key, args_bytes in send_list:
+                log.debug(f"Probe: 0x{cmd_key:02x} {args_bytes.hex()}")
+                self._stats_dict["probed"] += 1
+                self._uwatch2.send_raw_packet(bytes([cmd_key]) + args_bytes)
+
+    def _expire(self):
+        now = time.monotonic()
+        for cmd_key, (args_bytes, send_time) in list(self._in_flight_dict.items()):
+            if now - send_time >= self._timeout_sec:
+                del self._in_flight_dict[cmd_key]
+                self._record(cmd_key, args_bytes, TIMEOUT)
+
+    def _on_frame(self, cmd_key, payload_bytes):
+        with self._cond:
+            args_bytes, send_time = self._in_flight_dict.pop(cmd_key, (None, None))
+            if args_bytes is None:
+                self._record(cmd_key, None, UNSOLICITED, payload_bytes)
+            else:
+                self._record(
+                    cmd_key,
+                    args_bytes,
+                    RESPONSE,
+                    payload_bytes,
+                    time.monotonic() - send_time,
+                )
+            self._cond.notify_all()
+
+    def _record(
+        self, cmd_key, args_bytes, status, payload_bytes=None, latency_sec=None
+    ):
+        self._stats_dict[status] += 1
+        self._table.add(cmd_key, args_bytes, status, payload_bytes, latency_sec)
+        if self._progress_callback:
+            self._progress_callback(cmd_key, args_bytes, status)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""Dispatch of events that the watch sends on its own.
+
+Some frames on the async response characteristic are not responses to commands, but
+are sent by the watch when the user does something on it, such as pressing the
+shutter in the remote camera screen. Such frames are reassembled like responses, and
+then dispatched by cmd_key to the handlers registered for it.
+
+EventLoop makes sure that frames are handled as soon as they arrive, also while no
+command is waiting for a response. It blocks on the notification buffer and wakes up
+when a notification is added, so there is no polling delay. While a command is
+running, the command handles the notifications itself, and dispatches any events
+as they complete.
+
+Handlers run on a _uwatch2handlerpool.HandlerPool, one at a time in the order the
+events arrived. The time from the first notification of an event until its handler
+starts is recorded in the handler_latency_seconds histogram. A handler can be
+registered with a max age, for events that are useless if late. The handler is then
+skipped if it cannot be started in time, and counted in handler_expired_total.
+"""
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# cmd_key of the frame sent when the camera view is switched on the watch. Inferred
+# from the command list.
+SWITCH_CAMERA_VIEW = 0x66
+
+# Max time to block on the notification buffer before checking for stop.
+STOP_POLL_INTERVAL_SEC = 0.1
+
+
+class EventDispatcher(object):
+    def __init__(self, metrics, handler_pool):
+        """
+        Args:
+            metrics (_uwatch2metrics.Metrics): Receives the event metrics.
+            handler_pool (_uwatch2handlerpool.HandlerPool): Runs the handlers.
+        """
+        self._metrics = metrics
+        self._handler_pool = handler_pool
+        self._lock = threading.Lock()
+        # cmd_key -> list of (handler, max_age_sec, with_receive_time)
+        self._handler_dict = {}
+
+    def add_handler(self, cmd_key, handler, max_age_sec=None, with_receive_time=False):
+        """Register a handler for frames with {cmd_key}.
+
+        Args:
+            cmd_key (int): cmd_key of the event.
+            handler (callable): Called with (cmd_key, payload_bytes). The payload does
+              not include the cmd_key.
+            max_age_sec (float): Skip the handler if it cannot be started within
+              this time from when the event was received. None runs the handler for
+              all events.
+            with_receive_time (bool): Also pass the time.monotonic() at which the
+              first notification of the event was received, as a third argument. The
+              handler itself runs later, after the queue and pool delay.
+        """
+        with self._lock:
+            self._handler_dict.setdefault(cmd_key, []).append(
+                (handler, max_age_sec, with_receive_time)
+            )
+
+    def remove_handler(self, cmd_key, handler):
+        with self._lock:
+            handler_list = [
+                v for v in self._handler_dict.get(cmd_key, []) if v[0] is not handler
+            ]
+            if handler_list:
+                self._handler_dict[cmd_key] = handler_list
+            else:
+                self._handler_dict.pop(cmd_key, None)
+
+    def dispatch(self, cmd_key, payload_bytes, receive_time=None, key=None):
+        """Submit the handlers for an event to the handler pool.
+
+        Args:
+            cmd_key (int)
+            payload_bytes (bytes): Payload, not including cmd_key.
+            receive_time (float): time.monotonic() when the first notification of the
+              event was received.
+            key: Ordering key in the handler pool. Normally the handle of the
+              characteristic that the event arrived on.
+
+        Returns:
+            bool: True if there are handlers for {cmd_key}.
+        """
+        with self._lock:
+            handler_list = list(self._handler_dict.get(cmd_key, []))
+        if not handler_list:
+            return False
+        self._metrics.inc("events_total", cmd_key=f"0x{cmd_key:02x}")
+        if receive_time is None:
+            receive_time = time.monotonic()
+        payload_bytes = bytes(payload_bytes)
+        for handler, max_age_sec, with_receive_time in handler_list:
+            self._handler_pool.submit(
+                key,
+                handler,
+                (
+                    (cmd_key, payload_bytes, receive_time)
+                    if with_receive_time
+                    else (cmd_key, payload_bytes)
+                ),
+                start_time=receive_time,
+                deadline=None if max_age_sec is None else receive_time + max_age_sec,
+            )
+        return True
+
+
+class EventLoop(object):
+    """Thread that handles notifications as soon as they arrive."""
+
+    def __init__(self, notification_buffer, drain_func):
+        """
+        Args:
+            notification_buffer (_uwatch2notifybuf.NotificationBuffer): Buffer to
+              wait on.
+            drain_func (callable): Called when the buffer has messages. Must handle
+              all messages in the buffer.
+        """
+        self._notification_buffer = notification_buffer
+        self._drain_func = drain_func
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="uwatch2-events", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            if not self._notification_buffer.wait(STOP_POLL_INTERVAL_SEC):
+                continue
+            try:
+                self._drain_func()
+            except Exception as e:
+                log.error(f"Handling notifications failed: {repr(e)}")
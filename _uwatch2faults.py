@@ -0,0 +1,324 @@
+#!/usr/bin/env python
+
+"""Link fault injection between Uwatch2Ble and its backend, for soak testing.
+
+FaultAdapter wraps a pygatt style adapter, such as pygatt.GATTToolBackend or
+_uwatch2sim.SimAdapter, and degrades the link as seen by Uwatch2Ble:
+
+    - Notifications are delayed by a latency with random jitter
+    - Notifications are dropped, duplicated or reordered
+    - Notifications are split in two, or merged with the next notification on the same
+      characteristic
+    - The link is disconnected on a schedule. While disconnected, writes raise
+      NotConnectedError and notifications are lost, until Uwatch2Ble reconnects, or
+      until the reconnect delay has passed if the backend was connected with
+      auto_reconnect
+
+All faults are random with the given rates, which are probabilities per
+notification. With a seed, the same faults are injected on every run.
+"""
+import logging
+import random
+import threading
+
+import pygatt.exceptions
+
+import _uwatch2connparams
+import _uwatch2sim
+
+log = logging.getLogger(__name__)
+
+# Time that a notification is held back for merging or reordering, if no other
+# notification arrives on the same characteristic.
+HOLD_TIMEOUT_SEC = 0.05
+
+MERGE = "merge"
+REORDER = "reorder"
+
+
+class FaultAdapter(object):
+    """Stand-in for a pygatt backend that injects faults into the wrapped backend."""
+
+    def __init__(
+        self,
+        adapter,
+        latency_sec=0.0,
+        jitter_sec=0.0,
+        drop_rate=0.0,
+        duplicate_rate=0.0,
+        reorder_rate=0.0,
+        split_rate=0.0,
+        merge_rate=0.0,
+        disconnect_interval_sec=None,
+        reconnect_delay_sec=0.5,
+        seed=None,
+    ):
+        """
+        Args:
+            adapter: Backend to wrap.
+            latency_sec (float): Delay added to each notification.
+            jitter_sec (float): Max random delay added to the latency.
+            drop_rate (float): Probability that a notification is lost.
+            duplicate_rate (float): Probability that a notification is delivered
+              twice.
+            reorder_rate (float): Probability that a notification is delivered after
+              the next one on the same characteristic.
+            split_rate (float): Probability that a notification is delivered as two.
+            merge_rate (float): Probability that a notification is delivered together
+              with the next one on the same characteristic.
+            disconnect_interval_sec (float): Mean time between forced disconnects.
+              None disables forced disconnects.
+            reconnect_delay_sec (float): With auto_reconnect, time after a forced
+              disconnect until the link is restored.
+            seed (int): Random seed.
+        """
+        self._adapter = adapter
+        self._latency_sec = latency_sec
+        self._jitter_sec = jitter_sec
+        self.drop_rate = drop_rate
+        self.duplicate_rate = duplicate_rate
+        self.reorder_rate = reorder_rate
+        self.split_rate = split_rate
+        self.merge_rate = merge_rate
+        self._disconnect_interval_sec = disconnect_interval_sec
+        self._reconnect_delay_sec = reconnect_delay_sec
+        self._auto_reconnect = False
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._link = _uwatch2sim.SimLink()
+        self._device = None
+        self._address = None
+        self._stop_event = threading.Event()
+        self._disconnect_thread = None
+        self._stats_lock = threading.Lock()
+        self._stats_dict = {
+            "delivered": 0,
+            "dropped": 0,
+            "duplicated": 0,
+            "reordered": 0,
+            "split": 0,
+            "merged": 0,
+            "lost_while_disconnected": 0,
+            "disconnects": 0,
+        }
+
+    def start(self, *arg_tup, **kwarg_dict):
+        self._link.start()
+        self._adapter.start(*arg_tup, **kwarg_dict)
+        if self._disconnect_interval_sec and self._disconnect_thread is None:
+            self._stop_event.clear()
+            self._disconnect_thread = threading.Thread(
+                target=self._run_disconnects, name="uwatch2-faults", daemon=True
+            )
+            self._disconnect_thread.start()
+
+    def stop(self):
+        self._stop_disconnects()
+        self._adapter.stop()
+        self._link.stop()
+
+    def reset(self):
+        self._adapter.reset()
+
+    def kill(self):
+        self._stop_disconnects()
+        self._adapter.kill()
+        self._link.stop()
+
+    def scan(self, *arg_tup, **kwarg_dict):
+        return self._adapter.scan(*arg_tup, **kwarg_dict)
+
+    def connect(self, address, *arg_tup, **kwarg_dict):
+        self._auto_reconnect = kwarg_dict.get("auto_reconnect", False)
+        self._address = address
+        self._device = FaultDevice(
+            self, self._adapter.connect(address, *arg_tup, **kwarg_dict)
+        )
+        return self._device
+
+    def disconnect(self, device=None):
+        self._adapter.disconnect(device.device if device is not None else None)
+
+    def reconnect(self, device, *arg_tup, **kwarg_dict):
+        # Forced disconnects only exist in this layer, so the wrapped backend is
+        # only asked to reconnect after a real disconnect.
+        if device.is_connected:
+            self._adapter.reconnect(device.device, *arg_tup, **kwarg_dict)
+        else:
+            device.set_connected(True)
+
+    def set_connection_parameters(self, device, profile):
+        return _uwatch2connparams.apply_profile(
+            self._adapter, device.device, self._address, profile
+        )
+
+    def get_stats(self):
+        """Get the number of notifications affected by each type of fault.
+
+        Returns:
+            dict
+        """
+        with self._stats_lock:
+            return dict(self._stats_dict)
+
+    def force_disconnect(self):
+        """Disconnect the link now."""
+        device = self._device
+        if device is None or not device.is_connected:
+            return
+        log.info("Forcing disconnect")
+        self._count("disconnects")
+        device.set_connected(False)
+        device.notify_disconnected()
+        if self._auto_reconnect:
+            self._link.send_after(
+                self._reconnect_delay_sec, device.set_connected, True
+            )
+
+    def _stop_disconnects(self):
+        self._stop_event.set()
+        thread, self._disconnect_thread = self._disconnect_thread, None
+        if thread is not None:
+            thread.join()
+
+    def _run_disconnects(self):
+        while not self._stop_event.wait(
+            self._random_expovariate(1 / self._disconnect_interval_sec)
+        ):
+            self.force_disconnect()
+
+    def _random_expovariate(self, lambd):
+        with self._random_lock:
+            return self._random.expovariate(lambd)
+
+    def _roll(self, rate):
+        if not rate:
+            return False
+        with self._random_lock:
+            return self._random.random() < rate
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats_dict[key] += 1
+
+    def _delay_sec(self):
+        with self._random_lock:
+            return self._latency_sec + self._random.uniform(0, self._jitter_sec)
+
+
+class FaultDevice(object):
+    """Stand-in for a pygatt device that injects faults into the wrapped device."""
+
+    def __init__(self, adapter, device):
+        self._adapter = adapter
+        self.device = device
+        self._lock = threading.Lock()
+        self.is_connected = True
+        # handle -> (MERGE or REORDER, bytes, hold token)
+        self._held_dict = {}
+        self._hold_seq = 0
+        self._disconnect_callback_list = []
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    def set_connected(self, is_connected):
+        with self._lock:
+            self.is_connected = is_connected
+            if not is_connected:
+                self._held_dict.clear()
+
+    def subscribe(
+        self, char_uuid, callback=None, indication=False, wait_for_response=True
+    ):
+        def fault_callback(handle, value):
+            self._receive(callback, handle, bytes(value))
+
+        return self.device.subscribe(
+            char_uuid,
+            callback=fault_callback,
+            indication=indication,
+            wait_for_response=wait_for_response,
+        )
+
+    def register_disconnect_callback(self, callback):
+        self._disconnect_callback_list.append(callback)
+        self.device.register_disconnect_callback(callback)
+
+    def notify_disconnected(self):
+        for callback in self._disconnect_callback_list:
+            callback({"device": "fault"})
+
+    def char_write(self, char_uuid, value, wait_for_response=True):
+        if not self.is_connected:
+            raise pygatt.exceptions.NotConnectedError("Link disconnected by fault")
+        return self.device.char_write(char_uuid, value, wait_for_response)
+
+    def _receive(self, callback, handle, value_bytes):
+        a = self._adapter
+        with self._lock:
+            if not self.is_connected:
+                a._count("lost_while_disconnected")
+                return
+            held_tup = self._held_dict.pop(handle, None)
+        if held_tup is not None:
+            held_kind, held_bytes, _ = held_tup
+            if held_kind == MERGE:
+                value_bytes = held_bytes + value_bytes
+            else:
+                self._deliver(callback, handle, value_bytes)
+                value_bytes = held_bytes
+        elif self._hold(callback, handle, value_bytes):
+            return
+        if a._roll(a.drop_rate):
+            a._count("dropped")
+            return
+        if a._roll(a.split_rate) and len(value_bytes) > 1:
+            a._count("split")
+            split_idx = len(value_bytes) // 2
+            self._deliver(callback, handle, value_bytes[:split_idx])
+            value_bytes = value_bytes[split_idx:]
+        self._deliver(callback, handle, value_bytes)
+        if a._roll(a.duplicate_rate):
+            a._count("duplicated")
+            self._deliver(callback, handle, value_bytes)
+
+    def _hold(self, callback, handle, value_bytes):
+        """Hold a notification back for merging with, or delivery after, the next
+        notification on the same characteristic.
+
+        Returns:
+            bool: True if the notification is held.
+        """
+        a = self._adapter
+        if a._roll(a.merge_rate):
+            kind = MERGE
+            a._count("merged")
+        elif a._roll(a.reorder_rate):
+            kind = REORDER
+            a._count("reordered")
+        else:
+            return False
+        with self._lock:
+            self._hold_seq += 1
+            self._held_dict[handle] = (kind, value_bytes, self._hold_seq)
+            token = self._hold_seq
+        a._link.send_after(
+            HOLD_TIMEOUT_SEC, self._release_held, callback, handle, token
+        )
+        return True
+
+    def _release_held(self, callback, handle, token):
+        """Deliver a held notification if no other notification arrived in time."""
+        with self._lock:
+            held_tup = self._held_dict.get(handle)
+            if held_tup is None or held_tup[2] != token:
+                return
+            del self._held_dict[handle]
+        self._deliver(callback, handle, held_tup[1])
+
+    def _deliver(self, callback, handle, value_bytes):
+        self._adapter._count("delivered")
+        self._adapter._link.send_after(
+            self._adapter._delay_sec(), callback, handle, bytearray(value_bytes)
+        )
@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""Execution of notification and event handlers on a pool of workers.
+
+Handlers are submitted with a key, which is the handle of the characteristic that the
+notification arrived on. Handlers with the same key run one at a time, in the order
+they were submitted. Handlers with different keys run in parallel. A slow handler
+then delays only later handlers for the same characteristic, and never the reception
+of notifications or the handling of command responses.
+
+The pool is a thread pool by default. A process pool can be used for handlers that
+are CPU bound. Handlers and their arguments must then be picklable, so they must be
+module level functions, not lambdas or bound methods of unpicklable objects.
+
+Metrics, labelled by handler name:
+
+    handler_seconds: Execution time
+    handler_latency_seconds: Time from when the notification was received, or the
+      handler was submitted, until the handler started
+    handler_errors_total: Handlers that raised
+    handler_expired_total: Handlers that were skipped because they could not be
+      started before their deadline
+"""
+import collections
+import concurrent.futures
+import functools
+import logging
+import queue
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+DEFAULT_WORKER_COUNT = 4
+
+
+class HandlerPool(object):
+    def __init__(self, worker_count=DEFAULT_WORKER_COUNT, use_processes=False):
+        """
+        Args:
+            worker_count (int): Number of worker threads or processes.
+            use_processes (bool): Run handlers in a process pool instead of a thread
+              pool.
+        """
+        self._worker_count = worker_count
+        self._use_processes = use_processes
+        self._metrics = None
+        self._executor = None
+        self._lock = threading.Lock()
+        self._idle_cond = threading.Condition(self._lock)
+        # key -> deque of tasks that have not been started
+        self._pending_dict = {}
+        # Keys that have a task running
+        self._running_key_set = set()
+        # Keys that are ready for their next task. Read by the scheduler thread.
+        self._ready_queue = queue.Queue()
+        self._scheduler_thread = None
+
+    def start(self, metrics):
+        """
+        Args:
+            metrics (_uwatch2metrics.Metrics): Receives the handler metrics.
+        """
+        if self._executor is not None:
+            return
+        self._metrics = metrics
+        if self._use_processes:
+            self._executor = concurrent.futures.ProcessPoolExecutor(self._worker_count)
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self._worker_count, thread_name_prefix="uwatch2-handler"
+            )
+        self._scheduler_thread = threading.Thread(
+            target=self._run_scheduler, name="uwatch2-handler-scheduler", daemon=True
+        )
+        self._scheduler_thread.start()
+
+    def stop(self, timeout_sec=None):
+        """Wait for submitted handlers to complete, then stop the workers.
+
+        Args:
+            timeout_sec (float): Max time to wait for submitted handlers. Handlers
+              that have not been started by then are discarded.
+        """
+        if self._executor is None:
+            return
+        self.wait_idle(timeout_sec)
+        with self._lock:
+            discard_count = sum(len(v) for v in self._pending_dict.values())
+            self._pending_dict.clear()
+        if discard_count:
+            log.warning(f"Discarding {discard_count} handler(s) that were not started")
+        self._ready_queue.put(None)
+        self._scheduler_thread.join()
+        self._scheduler_thread = None
+        self._executor.shutdown(wait=True)
+        self._executor = None
+
+    def submit(self, key, handler, arg_tup, start_time=None, deadline=None):
+        """Run handler(*arg_tup) after all handlers submitted earlier with {key}.
+
+        Args:
+            key: Ordering key, normally a characteristic handle.
+            handler (callable)
+            arg_tup (tuple): Arguments for the handler.
+            start_time (float): time.monotonic() from which latency is measured.
+              Defaults to now.
+            deadline (float): time.monotonic() after which the handler is skipped if
+              it has not been started.
+        """
+        if self._executor is None:
+            log.debug(f"Handler pool is not running. Skipping {_get_name(handler)}")
+            return
+        task_tup = (
+            handler,
+            arg_tup,
+            time.monotonic() if start_time is None else start_time,
+            deadline,
+        )
+        with self._lock:
+            self._pending_dict.setdefault(key, collections.deque()).append(task_tup)
+            if key in self._running_key_set:
+                return
+            self._running_key_set.add(key)
+        self._ready_queue.put(key)
+
+    def wait_idle(self, timeout_sec=None):
+        """Wait until all submitted handlers have completed.
+
+        Returns:
+            bool: False on timeout.
+        """
+        with self._idle_cond:
+            return self._idle_cond.wait_for(
+                lambda: not self._running_key_set, timeout_sec
+            )
+
+    def get_pending_count(self):
+        with self._lock:
+            return sum(len(v) for v in self._pending_dict.values())
+
+    def _run_scheduler(self):
+        while True:
+            key = self._ready_queue.get()
+            if key is None:
+                return
+            self._start_next(key)
+
+    def _start_next(self, key):
+        """Start the next task for {key}, or mark the key as idle."""
+        while True:
+            with self._lock:
+                task_deque = self._pending_dict.get(key)
+                if not task_deque:
+                    self._pending_dict.pop(key, None)
+                    self._running_key_set.discard(key)
+                    self._idle_cond.notify_all()
+                    return
+                handler, arg_tup, start_time, deadline = task_deque.popleft()
+            name_str = _get_name(handler)
+            if deadline is not None and time.monotonic() > deadline:
+                log.warning(
+                    f"Skipping handler {name_str}. It could not be started within "
+                    f"{(deadline - start_time) * 1000:.1f} ms"
+                )
+                self._metrics.inc("handler_expired_total", handler=name_str)
+                continue
+            future = self._executor.submit(_call_handler, handler, arg_tup)
+            future.add_done_callback(
+                functools.partial(self._on_done, key, name_str, start_time)
+            )
+            return
+
+    def _on_done(self, key, name_str, start_time, future):
+        try:
+            run_start_time, elapsed_sec = future.result()
+        except Exception as e:
+            log.error(f"Handler {name_str} failed: {repr(e)}")
+            self._metrics.inc("handler_errors_total", handler=name_str)
+        else:
+            self._metrics.observe(
+                "handler_latency_seconds",
+                max(0.0, run_start_time - start_time),
+                handler=name_str,
+            )
+            self._metrics.observe("handler_seconds", elapsed_sec, handler=name_str)
+        # Starting the next task is left to the scheduler thread, since this may be
+        # called on the submitting thread if the handler has already completed.
+        self._ready_queue.put(key)
+
+
+def _call_handler(handler, arg_tup):
+    """Run a handler in a worker.
+
+    Returns:
+        2-tup: Start time and execution time
+    """
+    start_time = time.monotonic()
+    handler(*arg_tup)
+    return start_time, time.monotonic() - start_time
+
+
+def _get_name(handler):
+    return getattr(handler, "__qualname__", None) or repr(handler)
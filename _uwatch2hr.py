@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+"""Continuous heart rate sessions.
+
+get_heart_rate() polls the 73 byte 0x35 block, which costs a write and four
+notifications per poll, and only shows the watch's own periodic measurements.
+A session instead starts continuous measurement on the watch and collects the samples
+as the watch sends them:
+
+    0x36 <1>: Start continuous measurement. <0> stops it. No response
+    0x36 frames: Sent by the watch for each measurement while it is running. Each
+      nonzero payload byte is a heart rate in BPM
+    0x37: Query the movement heart rate block. 60 bytes, one BPM value per byte,
+      oldest first. Zero where there is no measurement
+
+Streamed samples cost one notification each and no writes. The 0x37 block can
+optionally be polled as well, for watches that do not stream. The block has no
+counter or timestamps, so the values that are new since the previous poll cannot be
+told apart from repeated ones. A steady heart rate gives identical blocks. The polled
+blocks are therefore kept whole, with the time of the poll, and are not merged into
+the samples. Block polling is off by default.
+
+The commands and frame layouts are inferred from the command list and have not been
+confirmed against a watch. The simulated watch implements them as described here.
+
+Samples are collected in compact array columns:
+
+    timestamp (array 'd'): time.time() when the notification with the sample was
+      received, not when it was handled
+    bpm (array 'B'): Heart rate
+
+get_arrays() returns the columns as NumPy arrays. NumPy is an optional dependency:
+
+    $ pip install numpy
+"""
+import array
+import logging
+import threading
+import time
+
+import _uwatch2ble
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+log = logging.getLogger(__name__)
+
+MEASURE_HEART_RATE = 0x36
+MOVEMENT_HEART_RATE = 0x37
+MEASURE_START = 1
+MEASURE_STOP = 0
+MOVEMENT_BLOCK_SIZE = 60
+
+
+class HeartRateSession(object):
+    def __init__(self, uwatch2, block_poll_interval_sec=None, sample_callback=None):
+        """
+        Args:
+            uwatch2 (uwatch2lib.Uwatch2): Connected watch.
+            block_poll_interval_sec (float): If provided, also poll the 0x37 movement
+              heart rate block at this interval. The blocks are returned by
+              get_blocks(), and do not add samples.
+            sample_callback (callable): Called with (timestamp, bpm) for each sample.
+              Runs on the handler pool.
+        """
+        self._uwatch2 = uwatch2
+        self._block_poll_interval_sec = block_poll_interval_sec
+        self._sample_callback = sample_callback
+        self._lock = threading.Lock()
+        self._column_dict = new_columns()
+        self._frame_count = 0
+        self._block_list = []
+        self._start_time = None
+        self._stop_time = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def start(self):
+        if self._start_time is not None and self._stop_time is None:
+            return
+        self._start_time = time.time()
+        self._stop_time = None
+        self._uwatch2.add_event_handler(
+            MEASURE_HEART_RATE, self._on_frame, with_receive_time=True
+        )
+        self._uwatch2.measure_heart_rate(True)
+        if self._block_poll_interval_sec:
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run_block_poll, name="uwatch2-hr", daemon=True
+            )
+            self._thread.start()
+        log.info("Heart rate session started")
+
+    def stop(self):
+        """Stop measurement on the watch. The collected samples are kept."""
+        if self._start_time is None or self._stop_time is not None:
+            return
+        self._stop_event.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+        try:
+            self._uwatch2.measure_heart_rate(False)
+        finally:
+            self._uwatch2.remove_event_handler(MEASURE_HEART_RATE, self._on_frame)
+            self._stop_time = time.time()
+        log.info(
+            f"Heart rate session stopped. Samples: {len(self._column_dict['bpm'])}"
+        )
+
+    def get_columns(self):
+        """Get a copy of the samples collected so far.
+
+        Returns:
+            dict: timestamp and bpm columns. See the module docstring.
+        """
+        with self._lock:
+            return {k: array.array(v.typecode, v) for k, v in self._column_dict.items()}
+
+    def get_arrays(self):
+        """Get the samples collected so far as NumPy arrays.
+
+        Returns:
+            dict: timestamp (float64) and bpm (uint8) arrays.
+        """
+        if numpy is None:
+            raise _uwatch2ble.WatchError(
+                "NumPy is required for get_arrays(). Install with: pip install numpy"
+            )
+        return {k: numpy.array(v) for k, v in self.get_columns().items()}
+
+    def get_blocks(self):
+        """Get the movement heart rate blocks polled so far.
+
+        Returns:
+            list of 2-tup: (timestamp, 60-tup of int), oldest first. Consecutive
+            blocks overlap by an unknown number of values. See the module docstring.
+        """
+        with self._lock:
+            return list(self._block_list)
+
+    def get_stats(self):
+        """Returns:
+        dict: dict_keys are sample_count, frame_count, block_count, elapsed_sec
+        """
+        end_time = self._stop_time or time.time()
+        with self._lock:
+            return {
+                "sample_count": len(self._column_dict["bpm"]),
+                "frame_count": self._frame_count,
+                "block_count": len(self._block_list),
+                "elapsed_sec": end_time - self._start_time if self._start_time else 0.0,
+            }
+
+    def _on_frame(self, cmd_key, payload_bytes, receive_time):
+        # The handler runs after the queue and pool delay. The receive time is on the
+        # monotonic clock, so the delay is subtracted from the wall clock time.
+        timestamp = time.time() - (time.monotonic() - receive_time)
+        with self._lock:
+            self._frame_count += 1
+        for bpm in payload_bytes:
+            if bpm:
+                self._add_sample(timestamp, bpm)
+
+    def _run_block_poll(self):
+        while True:
+            try:
+                block_tup = self._uwatch2.get_movement_heart_rate()
+            except _uwatch2ble.WatchError as e:
+                log.warning(f"Movement heart rate poll failed: {repr(e)}")
+            else:
+                with self._lock:
+                    self._block_list.append((time.time(), tuple(block_tup)))
+            if self._stop_event.wait(self._block_poll_interval_sec):
+                break
+
+    def _add_sample(self, timestamp, bpm):
+        with self._lock:
+            self._column_dict["timestamp"].append(timestamp)
+            self._column_dict["bpm"].append(bpm)
+        if self._sample_callback:
+            self._sample_callback(timestamp, bpm)
+
+
+def new_columns():
+    return {
+        "timestamp": array.array("d"),
+        "bpm": array.array("B"),
+    }
+
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+"""Dedicated thread for all I/O with the watch.
+
+Calls submitted from any thread are run one at a time on the I/O thread, and their
+results or exceptions are handed back to the calling threads. While there are no calls
+to run, the I/O thread keeps draining notifications, so that notifications that are
+not responses to commands do not pile up.
+"""
+import concurrent.futures
+import logging
+import queue
+import threading
+
+log = logging.getLogger(__name__)
+
+DEFAULT_IDLE_DRAIN_INTERVAL_SEC = 0.05
+
+
+class IoThread(object):
+    def __init__(self, drain_func, idle_drain_interval_sec=None):
+        """
+        Args:
+            drain_func (callable): Called periodically on the I/O thread while there
+              are no calls to run.
+            idle_drain_interval_sec (float): Max time between calls to drain_func
+              while idle.
+        """
+        self._drain_func = drain_func
+        self._idle_drain_interval_sec = (
+            idle_drain_interval_sec or DEFAULT_IDLE_DRAIN_INTERVAL_SEC
+        )
+        self._call_queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="uwatch2-io", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        """Stop the I/O thread after running the calls that have already been
+        submitted.
+        """
+        if self._thread is None:
+            return
+        self._call_queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def is_running(self):
+        return self._thread is not None
+
+    def is_current(self):
+        """Return True if called from the I/O thread."""
+        return self._thread is threading.current_thread()
+
+    def call(self, func, *arg_tup, **kwarg_dict):
+        """Run func(*arg_tup, **kwarg_dict) on the I/O thread and return the result.
+
+        Blocks until the call has completed. Exceptions raised by the call are
+        re-raised in the calling thread.
+        """
+        if self._thread is None:
+            raise RuntimeError("I/O thread is not running")
+        future = concurrent.futures.Future()
+        self._call_queue.put((future, func, arg_tup, kwarg_dict))
+        return future.result()
+
+    def _run(self):
+        while True:
+            try:
+                call_tup = self._call_queue.get(timeout=self._idle_drain_interval_sec)
+            except queue.Empty:
+                try:
+                    self._drain_func()
+                except Exception as e:
+                    log.error(f"Draining notifications failed: {repr(e)}")
+                continue
+            if call_tup is None:
+                return
+            future, func, arg_tup, kwarg_dict = call_tup
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(func(*arg_tup, **kwarg_dict))
+            except BaseException as e:
+                future.set_exception(e)
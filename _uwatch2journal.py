@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+"""Durable queue for write commands that are issued while the watch is away.
+
+Only commands that set a setting to a value, and messages, are queued. Sending them
+late, or more than once, leaves the watch in the state that was asked for.
+Commands that act on the watch at the time they are sent, such as sync_time(),
+find_device() and measure_heart_rate(), are never queued, since they would take
+effect long after they were issued.
+
+The journal is an append-only file with one JSON record per line. An "add" record
+holds the payload bytes of a queued command. A "status" record updates the status of
+a previously added command. The state of the queue is rebuilt by replaying the
+records, so commands that were queued when the process exited are sent after the
+next connect.
+
+Entry statuses:
+
+    pending: Waiting to be sent
+    sent: Written to the watch
+    superseded: Replaced by a later write to the same setting before it was sent
+"""
+import binascii
+import json
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+PENDING = "pending"
+SENT = "sent"
+SUPERSEDED = "superseded"
+
+# Write commands that may be queued, with the number of leading payload bytes that
+# identify the setting that they change. Writes with the same identifying bytes
+# supersede each other. None means that the writes never supersede each other.
+# Commands not listed here are never queued.
+COLLAPSE_PREFIX_LEN_DICT = {
+    # set_alarm_dict(): The alarm index follows the cmd_key.
+    0x11: 2,
+    0x12: 1,  # set_user_info()
+    0x16: 1,  # set_steps_goal()
+    0x17: 1,  # set_time_format()
+    0x18: 1,  # set_quick_view()
+    0x19: 1,  # set_watch_face()
+    0x1A: 1,  # set_metric_system()
+    0x1C: 1,  # set_other_message()
+    0x1D: 1,  # set_sedentary_reminder()
+    0x1F: 1,  # set_timing_measure_heart_rate()
+    # send_message(): Each message is displayed.
+    0x41: None,
+    0x42: 1,  # set_future_weather()
+    0x43: 1,  # set_today_weather()
+    0x54: 1,  # set_step_length()
+    0x71: 1,  # set_dnd_period(), set_sedentary_reminder_period()
+    0x72: 1,  # set_quick_view_enabled_period()
+    0x78: 1,  # set_breathing_light()
+}
+
+
+class CommandJournal(object):
+    def __init__(self, journal_path):
+        """
+        Args:
+            journal_path (str): Path to the journal file. Created if it does not
+            exist.
+        """
+        self._journal_path = journal_path
+        self._lock = threading.Lock()
+        self._entry_dict = {}
+        self._next_entry_id = 1
+        self._load()
+
+    def add(self, payload_bytes):
+        """Queue the payload bytes of a write command.
+
+        The command must be one that may be queued. See is_journaled().
+
+        Any pending command that changes the same setting is marked as superseded.
+
+        Returns:
+            int: Entry ID, which can be used for looking up the status of the entry.
+        """
+        collapse_key = get_collapse_key(payload_bytes)
+        with self._lock:
+            if collapse_key is not None:
+                for entry_dict in self._entry_dict.values():
+                    if (
+                        entry_dict["status"] == PENDING
+                        and entry_dict["collapse_key"] == collapse_key
+                    ):
+                        self._set_status(entry_dict["entry_id"], SUPERSEDED)
+            entry_id = self._next_entry_id
+            self._next_entry_id += 1
+            record_dict = {
+                "op": "add",
+                "entry_id": entry_id,
+                "time": time.time(),
+                "payload": binascii.hexlify(payload_bytes).decode("ascii"),
+            }
+            self._append(record_dict)
+            self._apply(record_dict)
+        return entry_id
+
+    def mark_sent(self, entry_id):
+        with self._lock:
+            self._set_status(entry_id, SENT)
+
+    def has_pending(self):
+        with self._lock:
+            return any(d["status"] == PENDING for d in self._entry_dict.values())
+
+    def get_pending_list(self):
+        """Get pending entries in the order in which they were queued.
+
+        Returns:
+            list of (entry_id, payload_bytes) tuples
+        """
+        with self._lock:
+            return [
+                (d["entry_id"], d["payload_bytes"])
+                for d in self._entry_dict.values()
+                if d["status"] == PENDING
+            ]
+
+    def get_entry_list(self):
+        """Get the status of all entries that have been queued since the journal was
+        last compacted.
+
+        Returns:
+            list of dict: dict_keys are entry_id, cmd_key, time, status
+        """
+        with self._lock:
+            return [
+                {k: d[k] for k in ("entry_id", "cmd_key", "time", "status")}
+                for d in self._entry_dict.values()
+            ]
+
+    def compact(self):
+        """Truncate the journal file if there are no pending entries.
+
+        Entry statuses remain available from get_entry_list() until the process exits.
+        """
+        with self._lock:
+            if any(d["status"] == PENDING for d in self._entry_dict.values()):
+                return
+            with open(self._journal_path, "w"):
+                pass
+
+    def _set_status(self, entry_id, status_str):
+        record_dict = {"op": "status", "entry_id": entry_id, "status": status_str}
+        self._append(record_dict)
+        self._apply(record_dict)
+
+    def _load(self):
+        if not os.path.exists(self._journal_path):
+            return
+        with open(self._journal_path) as f:
+            for line in f:
+                try:
+                    record_dict = json.loads(line)
+                except ValueError:
+                    # A partially written last record after a crash.
+                    log.warning(f"Skipping invalid journal record: {line!r}")
+                    continue
+                self._apply(record_dict)
+        self._next_entry_id = max(self._entry_dict, default=0) + 1
+        pending_count = sum(
+            d["status"] == PENDING for d in self._entry_dict.values()
+        )
+        if pending_count:
+            log.info(f"Loaded {pending_count} queued command(s) from journal")
+
+    def _apply(self, record_dict):
+        entry_id = record_dict["entry_id"]
+        if record_dict["op"] == "add":
+            payload_bytes = binascii.unhexlify(record_dict["payload"])
+            self._entry_dict[entry_id] = {
+                "entry_id": entry_id,
+                "cmd_key": payload_bytes[0],
+                "time": record_dict["time"],
+                "status": PENDING,
+                "payload_bytes": payload_bytes,
+                "collapse_key": get_collapse_key(payload_bytes),
+            }
+        elif record_dict["op"] == "status":
+            entry_dict = self._entry_dict.get(entry_id)
+            if entry_dict is None:
+                # The add record was lost in a crash.
+                log.warning(f"Skipping status record for unknown entry: {entry_id}")
+                return
+            entry_dict["status"] = record_dict["status"]
+
+    def _append(self, record_dict):
+        with open(self._journal_path, "a") as f:
+            f.write(json.dumps(record_dict) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def is_journaled(payload_bytes):
+    """Return True if the write command may be queued in the journal."""
+    return payload_bytes[0] in COLLAPSE_PREFIX_LEN_DICT
+
+
+def get_collapse_key(payload_bytes):
+    """Get the key that identifies the setting that a write command changes, or None
+    if the command never supersedes earlier commands.
+    """
+    prefix_len = COLLAPSE_PREFIX_LEN_DICT.get(payload_bytes[0])
+    if prefix_len is None:
+        return None
+    return bytes(payload_bytes[:prefix_len])
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+"""Counters, gauges and histograms for the hot paths in the BLE layer.
+
+All metrics are declared in METRIC_DICT. Values are recorded with inc(), set_gauge()
+and observe(), and read back as a dict with snapshot() or as Prometheus text
+exposition format with to_prometheus().
+
+Gauges that are derived from state kept elsewhere, such as notification queue depths,
+are provided by collector functions that are called when a snapshot is taken.
+"""
+import threading
+import time
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+LATENCY_BUCKET_TUP = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Events must reach their handlers within a few ms to feel instant.
+HANDLER_LATENCY_BUCKET_TUP = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+SIZE_BUCKET_TUP = (1, 2, 4, 8, 16, 20, 32, 64, 128, 255)
+
+# name: (type, help, histogram buckets)
+METRIC_DICT = {
+    "command_latency_seconds": (
+        HISTOGRAM,
+        "Time from sending a command until its response is complete",
+        LATENCY_BUCKET_TUP,
+    ),
+    "command_timeouts_total": (
+        COUNTER,
+        "Commands for which no response was received before the deadline",
+        None,
+    ),
+    "late_responses_dropped_total": (
+        COUNTER,
+        "Responses dropped as late responses to commands that timed out or were "
+        "cancelled",
+        None,
+    ),
+    "command_unsupported_total": (
+        COUNTER,
+        "Queries rejected without being sent, since the watch does not support them",
+        None,
+    ),
+    "command_packets_total": (COUNTER, "Packets written", None),
+    "command_chunks_total": (COUNTER, "ATT writes of up to 20 bytes", None),
+    "command_bytes_total": (COUNTER, "Packet bytes written, including header", None),
+    "data_chunks_total": (COUNTER, "ATT writes to the data characteristic", None),
+    "data_bytes_total": (COUNTER, "Bytes written to the data characteristic", None),
+    "coalesced_packets_total": (
+        COUNTER,
+        "Packets sent in a shared stream of ATT writes by coalesce_writes()",
+        None,
+    ),
+    "coalesced_chunks_saved_total": (
+        COUNTER,
+        "ATT writes saved by coalescing packets into a shared stream",
+        None,
+    ),
+    "notifications_total": (COUNTER, "Notifications received", None),
+    "notifications_dropped_total": (
+        COUNTER,
+        "Notifications dropped because the buffer was full",
+        None,
+    ),
+    "notification_rate_per_second": (
+        GAUGE,
+        "Notifications received per second since the metrics were created",
+        None,
+    ),
+    "notification_queue_depth": (GAUGE, "Notifications waiting to be handled", None),
+    "reassembly_bytes": (
+        HISTOGRAM,
+        "Payload size of reassembled async responses",
+        SIZE_BUCKET_TUP,
+    ),
+    "reassembly_chunks": (
+        HISTOGRAM,
+        "Number of notifications that made up an async response",
+        SIZE_BUCKET_TUP,
+    ),
+    "reassembly_discarded_bytes_total": (
+        COUNTER,
+        "Notification bytes discarded because they were not part of a response",
+        None,
+    ),
+    "events_total": (COUNTER, "Frames sent by the watch on its own, dispatched", None),
+    "handler_seconds": (
+        HISTOGRAM,
+        "Execution time of notification and event handlers",
+        HANDLER_LATENCY_BUCKET_TUP,
+    ),
+    "handler_latency_seconds": (
+        HISTOGRAM,
+        "Time from receiving a notification until its handler started",
+        HANDLER_LATENCY_BUCKET_TUP,
+    ),
+    "handler_errors_total": (COUNTER, "Handlers that raised", None),
+    "handler_expired_total": (
+        COUNTER,
+        "Handlers skipped because they could not be started before their max age",
+        None,
+    ),
+    "connection_profile": (
+        GAUGE,
+        "1 for the connection parameter profile in effect, 0 for the others",
+        None,
+    ),
+    "connection_interval_ms": (GAUGE, "Effective connection interval", None),
+    "connection_latency": (
+        GAUGE,
+        "Effective slave latency, in connection events the watch may skip",
+        None,
+    ),
+    "connection_supervision_timeout_ms": (
+        GAUGE,
+        "Effective supervision timeout",
+        None,
+    ),
+    "connection_profile_switches_total": (
+        COUNTER,
+        "Connection parameter updates, by the profile switched to",
+        None,
+    ),
+    "connection_profile_errors_total": (
+        COUNTER,
+        "Connection parameter updates that failed",
+        None,
+    ),
+    "reconnects_total": (COUNTER, "Reconnects to the watch", None),
+    "disconnects_total": (COUNTER, "Disconnects reported by the backend", None),
+}
+
+
+class Metrics(object):
+    def __init__(self, prefix="uwatch2"):
+        self._prefix = prefix
+        self._lock = threading.Lock()
+        self._start_time = time.monotonic()
+        # name -> {label_tup: value}
+        self._value_dict = {name: {} for name in METRIC_DICT}
+        self._collector_list = []
+
+    @property
+    def uptime_sec(self):
+        return time.monotonic() - self._start_time
+
+    def inc(self, name, value=1, **label_dict):
+        label_tup = _get_label_tup(label_dict)
+        with self._lock:
+            sample_dict = self._value_dict[name]
+            sample_dict[label_tup] = sample_dict.get(label_tup, 0) + value
+
+    def set_gauge(self, name, value, **label_dict):
+        with self._lock:
+            self._value_dict[name][_get_label_tup(label_dict)] = value
+
+    def observe(self, name, value, **label_dict):
+        label_tup = _get_label_tup(label_dict)
+        with self._lock:
+            sample_dict = self._value_dict[name]
+            hist = sample_dict.get(label_tup)
+            if hist is None:
+                hist = _Histogram(METRIC_DICT[name][2])
+                sample_dict[label_tup] = hist
+            hist.observe(value)
+
+    def add_collector(self, collector_func):
+        """Add a function that is called when a snapshot is taken.
+
+        The function receives this Metrics object and typically calls set_gauge().
+        """
+        self._collector_list.append(collector_func)
+
+    def snapshot(self):
+        """Get the current values of all metrics that have been recorded.
+
+        Returns:
+            dict: Keyed by metric name. Each value is a list of dicts with keys
+            "labels" and "value". For histograms, "value" is a dict with keys count,
+            sum and buckets, where buckets maps each upper bound to the cumulative
+            count.
+        """
+        for collector_func in self._collector_list:
+            collector_func(self)
+        with self._lock:
+            snapshot_dict = {}
+            for name, sample_dict in self._value_dict.items():
+                if not sample_dict:
+                    continue
+                snapshot_dict[name] = [
+                    {
+                        "labels": dict(label_tup),
+                        "value": v.get_dict() if isinstance(v, _Histogram) else v,
+                    }
+                    for label_tup, v in sorted(sample_dict.items())
+                ]
+            return snapshot_dict
+
+    def to_prometheus(self):
+        """Get the current values in Prometheus text exposition format."""
+        line_list = []
+        for name, sample_list in self.snapshot().items():
+            metric_type, help_str, bucket_tup = METRIC_DICT[name]
+            full_name = f"{self._prefix}_{name}"
+            line_list.append(f"# HELP {full_name} {help_str}")
+            line_list.append(f"# TYPE {full_name} {metric_type}")
+            for sample_dict in sample_list:
+                label_dict = sample_dict["labels"]
+                value = sample_dict["value"]
+                if metric_type != HISTOGRAM:
+                    line_list.append(
+                        f"{full_name}{_format_labels(label_dict)} {value}"
+                    )
+                    continue
+                for le, count in value["buckets"].items():
+                    line_list.append(
+                        f"{full_name}_bucket"
+                        f"{_format_labels(dict(label_dict, le=le))} {count}"
+                    )
+                line_list.append(
+                    f"{full_name}_sum{_format_labels(label_dict)} {value['sum']}"
+                )
+                line_list.append(
+                    f"{full_name}_count{_format_labels(label_dict)} {value['count']}"
+                )
+        return "\n".join(line_list) + "\n"
+
+
+class _Histogram(object):
+    def __init__(self, bucket_tup):
+        self._bucket_tup = bucket_tup
+        self._count_list = [0] * len(bucket_tup)
+        self._count = 0
+        self._sum = 0
+
+    def observe(self, value):
+        self._count += 1
+        self._sum += value
+        for i, upper_bound in enumerate(self._bucket_tup):
+            if value <= upper_bound:
+                self._count_list[i] += 1
+                break
+
+    def get_dict(self):
+        bucket_dict = {}
+        cumulative_count = 0
+        for upper_bound, count in zip(self._bucket_tup, self._count_list):
+            cumulative_count += count
+            bucket_dict[str(upper_bound)] = cumulative_count
+        bucket_dict["+Inf"] = self._count
+        return {"count": self._count, "sum": self._sum, "buckets": bucket_dict}
+
+
+def _get_label_tup(label_dict):
+    return tuple(sorted((k, str(v)) for k, v in label_dict.items()))
+
+
+def _format_labels(label_dict):
+    if not label_dict:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in label_dict.items()) + "}"
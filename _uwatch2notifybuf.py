@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+"""Bounded buffering of notifications, with a separate buffer per characteristic.
+
+Each characteristic handle gets its own lane with a max depth, a policy for what to do
+when the lane is full, and a priority. get() always returns from the highest priority
+lane that has messages, so command responses are never stuck behind sensor data.
+
+Policies:
+
+    drop_oldest: Discard the oldest message to make room. For sensor streams, where
+      only recent values matter.
+    drop_newest: Discard the incoming message.
+    never_drop: No max depth. For command responses, which must not be lost.
+
+Disconnect events and other control messages go to a never_drop lane of their own.
+They are delivered in arrival order relative to the notifications: a control message
+is returned only after the notifications that arrived before it, in any lane. A
+command response received just before a disconnect is then handled before the
+disconnect resets the reassembly state.
+"""
+import collections
+import queue
+import threading
+import time
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+NEVER_DROP = "never_drop"
+
+POLICY_TUP = DROP_OLDEST, DROP_NEWEST, NEVER_DROP
+
+# Lane key for messages that are not notifications
+CONTROL_KEY = "control"
+
+DEFAULT_POLICY = DROP_OLDEST
+DEFAULT_MAX_DEPTH = 64
+DEFAULT_PRIORITY = 10
+
+
+class NotificationBuffer(object):
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._lane_dict = {}
+        self._sorted_lane_list = []
+        # Arrival sequence number of the last message
+        self._seq = 0
+        self.configure(CONTROL_KEY, NEVER_DROP, priority=0)
+        self._control_lane = self._lane_dict[CONTROL_KEY]
+
+    def configure(self, key, policy, max_depth=None, priority=DEFAULT_PRIORITY):
+        """Set the buffering policy for a characteristic handle.
+
+        Messages already in the lane are kept.
+
+        Args:
+            key (int): Characteristic handle
+            policy (str): One of the policies in POLICY_TUP.
+            max_depth (int): Max number of messages to hold. Ignored for never_drop.
+            priority (int): Lanes with lower values are read first. Ignored for
+              CONTROL_KEY, which is read in arrival order.
+        """
+        if policy not in POLICY_TUP:
+            raise ValueError(f"Invalid policy: {policy}")
+        with self._cond:
+            lane = self._lane_dict.get(key)
+            if lane is None:
+                lane = _Lane()
+                self._lane_dict[key] = lane
+            lane.policy = policy
+            lane.max_depth = None if policy == NEVER_DROP else max_depth
+            lane.priority = priority
+            self._sorted_lane_list = sorted(
+                self._lane_dict.values(), key=lambda v: v.priority
+            )
+
+    def put(self, msg_tup):
+        """Add a message from a callback.
+
+        Args:
+            msg_tup (tuple): ("notification", handle, value, receive_time) or a
+              control message such as ("disconnected",).
+        """
+        key = msg_tup[1] if msg_tup[0] == "notification" else CONTROL_KEY
+        with self._cond:
+            lane = self._lane_dict.get(key)
+            if lane is None:
+                self.configure(key, DEFAULT_POLICY, DEFAULT_MAX_DEPTH)
+                lane = self._lane_dict[key]
+            lane.received_count += 1
+            if lane.max_depth is not None and len(lane.msg_deque) >= lane.max_depth:
+                lane.dropped_count += 1
+                if lane.policy == DROP_NEWEST:
+                    return
+                lane.msg_deque.popleft()
+            self._seq += 1
+            lane.msg_deque.append((self._seq, msg_tup))
+            lane.high_water_depth = max(lane.high_water_depth, len(lane.msg_deque))
+            self._cond.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """Get the next message from the highest priority lane that has messages.
+
+        Notifications that arrived before the oldest control message are returned
+        before it.
+
+        Raises:
+            queue.Empty: If no message is available within the timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                msg_tup = self._pop_next()
+                if msg_tup is not None:
+                    return msg_tup
+                if not block:
+                    raise queue.Empty
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining_sec = deadline - time.monotonic()
+                    if remaining_sec <= 0:
+                        raise queue.Empty
+                    self._cond.wait(remaining_sec)
+
+    def _pop_next(self):
+        control_deque = self._control_lane.msg_deque
+        control_seq = control_deque[0][0] if control_deque else None
+        for lane in self._sorted_lane_list:
+            if lane is self._control_lane or not lane.msg_deque:
+                continue
+            # The head of a lane is its oldest message, so a lane with a head that
+            # arrived after the control message has nothing to deliver before it.
+            if control_seq is None or lane.msg_deque[0][0] < control_seq:
+                return lane.msg_deque.popleft()[1]
+        if control_deque:
+            return control_deque.popleft()[1]
+        return None
+
+    def wait(self, timeout=None):
+        """Wait until any lane has messages, without removing them.
+
+        Returns:
+            bool: True if there are messages, False on timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not any(lane.msg_deque for lane in self._sorted_lane_list):
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining_sec = deadline - time.monotonic()
+                    if remaining_sec <= 0:
+                        return False
+                    self._cond.wait(remaining_sec)
+            return True
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self):
+        with self._cond:
+            return sum(len(lane.msg_deque) for lane in self._lane_dict.values())
+
+    def get_stats(self):
+        """Get depth and drop counters for each lane.
+
+        Returns:
+            dict: Keyed by characteristic handle (or CONTROL_KEY). Each value is a dict
+            with keys policy, priority, depth, max_depth, high_water_depth,
+            received_count, dropped_count.
+        """
+        with self._cond:
+            return {
+                key: {
+                    "policy": lane.policy,
+                    "priority": lane.priority,
+                    "depth": len(lane.msg_deque),
+                    "max_depth": lane.max_depth,
+                    "high_water_depth": lane.high_water_depth,
+                    "received_count": lane.received_count,
+                    "dropped_count": lane.dropped_count,
+                }
+                for key, lane in self._lane_dict.items()
+            }
+
+
+class _Lane(object):
+    def __init__(self):
+        self.policy = DEFAULT_POLICY
+        self.max_depth = DEFAULT_MAX_DEPTH
+        self.priority = DEFAULT_PRIORITY
+        self.msg_deque = collections.deque()
+        self.high_water_depth = 0
+        self.received_count = 0
+        self.dropped_count = 0
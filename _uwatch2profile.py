@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""Timeline of the phases of connecting to the watch.
+
+Each phase is timed with time.monotonic(). Optionally, the whole startup is also run
+under cProfile, to find where the time goes within a slow phase.
+"""
+import contextlib
+import cProfile
+import io
+import pstats
+import time
+
+DEFAULT_CPROFILE_LINE_COUNT = 25
+
+
+class StartupProfiler(object):
+    def __init__(self, use_cprofile=False):
+        """
+        Args:
+            use_cprofile (bool): Also capture a cProfile profile of the startup.
+        """
+        self._profile = cProfile.Profile() if use_cprofile else None
+        self._start_time = None
+        self._stop_time = None
+        self._wall_time = None
+        self._phase_list = []
+
+    def start(self):
+        self._wall_time = time.time()
+        self._start_time = time.monotonic()
+        if self._profile is not None:
+            self._profile.enable()
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+        self._stop_time = time.monotonic()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time the enclosed block as a named phase.
+
+        Phases that raise are recorded with failed=True.
+        """
+        start_time = time.monotonic()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self._phase_list.append(
+                {
+                    "name": name,
+                    "start_sec": start_time - (self._start_time or start_time),
+                    "duration_sec": time.monotonic() - start_time,
+                    "failed": failed,
+                }
+            )
+
+    def get_dict(self, cprofile_line_count=DEFAULT_CPROFILE_LINE_COUNT):
+        """Get the timeline.
+
+        Returns:
+            dict: keys are:
+                time: Wall clock time at start, for tracking startup over time
+                total_sec: Total startup time, or None if startup has not completed
+                phase_list: List of dicts with keys name, start_sec, duration_sec,
+                  failed
+                cprofile_str: cProfile stats sorted by cumulative time, or None if
+                  cProfile was not enabled
+        """
+        total_sec = None
+        if self._start_time is not None and self._stop_time is not None:
+            total_sec = self._stop_time - self._start_time
+        return {
+            "time": self._wall_time,
+            "total_sec": total_sec,
+            "phase_list": list(self._phase_list),
+            "cprofile_str": self._get_cprofile_str(cprofile_line_count),
+        }
+
+    def format_lines(self):
+        """Format the timeline for display.
+
+        Returns:
+            list of str
+        """
+        d = self.get_dict()
+        line_list = []
+        for phase_dict in d["phase_list"]:
+            line_list.append(
+                f"{phase_dict['name']:<28} "
+                f"{phase_dict['start_sec'] * 1000:>9.1f} ms "
+                f"{phase_dict['duration_sec'] * 1000:>9.1f} ms"
+                f"{' (failed)' if phase_dict['failed'] else ''}"
+            )
+        if d["total_sec"] is not None:
+            line_list.append(f"{'total':<28} {'':>12} {d['total_sec'] * 1000:>9.1f} ms")
+        return line_list
+
+    def _get_cprofile_str(self, line_count):
+        if self._profile is None or self._stop_time is None:
+            return None
+        stream = io.StringIO()
+        stats = pstats.Stats(self._profile, stream=stream)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(line_count)
+        return stream.getvalue()
@@ -0,0 +1,500 @@
+#!/usr/bin/env python
+
+"""Simulated Uwatch2 for running the library without a watch.
+
+SimAdapter implements the subset of the pygatt backend interface that Uwatch2Ble
+uses, and connects to a SimWatch instead of a BLE device. The simulated watch
+reassembles packets written to the command characteristic, keeps the settings that
+are written to it, and answers queries with notifications on the async response
+characteristic, split into 20 byte chunks as by the real watch.
+
+Writes and notifications pass through a simulated link with configurable latency and
+jitter. Notifications are delivered on a separate thread, as with pygatt.
+
+Example:
+
+    with uwatch2lib.Uwatch2(adapter=_uwatch2sim.SimAdapter()) as uwatch2:
+        uwatch2.get_steps_goal()
+"""
+import collections
+import heapq
+import itertools
+import logging
+import random
+import struct
+import threading
+import time
+import uuid
+
+import pygatt.exceptions
+
+import _uwatch2connparams
+import _uwatch2snapshot
+
+log = logging.getLogger(__name__)
+
+SIM_MAC_ADDR = "00:00:00:00:00:00"
+SIM_WATCH_NAME = "Uwatch2 (simulated)"
+
+HEADER_BYTES = bytes([0xFE, 0xEA, 0x10])
+# ATT write requests and notifications contain max 20 data bytes
+CHUNK_SIZE = 20
+# Number of heart rates in the 0x37 movement heart rate block
+MOVEMENT_BLOCK_SIZE = 60
+
+COMMAND_UUID = uuid.UUID("0000fee2-0000-1000-8000-00805f9b34fb")
+DATA_UUID = uuid.UUID("0000fee6-0000-1000-8000-00805f9b34fb")
+ASYNC_RESPONSE_UUID = uuid.UUID("0000fee3-0000-1000-8000-00805f9b34fb")
+ACCELEROMETER_UUID = uuid.UUID("0000fcc1-0000-1000-8000-00805f9b34fb")
+
+# Handles as seen on a real watch, where known.
+HANDLE_DICT = {
+    COMMAND_UUID: 0x36,
+    ASYNC_RESPONSE_UUID: 0x39,
+    DATA_UUID: 0x3C,
+    ACCELEROMETER_UUID: 0x4D,
+}
+
+
+# Readable characteristics of the GAP, Device Information and Battery services:
+# uuid -> (handle, value). Handles are made up.
+READ_VALUE_DICT = {
+    _uwatch2snapshot.get_uuid16(0x2A00): (0x03, SIM_WATCH_NAME.encode()),
+    _uwatch2snapshot.get_uuid16(0x2A24): (0x10, b"Uwatch2"),
+    _uwatch2snapshot.get_uuid16(0x2A26): (0x12, b"SIM-1.0.0"),
+    _uwatch2snapshot.get_uuid16(0x2A29): (0x14, b"Simulated"),
+    _uwatch2snapshot.get_uuid16(0x2A19): (0x20, bytes([87])),
+}
+
+# Responses to queries before any settings have been written, keyed by the cmd_key of
+# the query. The cmd_key is not included.
+DEFAULT_RESPONSE_DICT = {
+    0x21: bytes([0] * 8 + [1] + [0] * 7 + [2] + [0] * 7),
+    0x22: bytes([175, 70, 30, 0]),
+    0x26: struct.pack("<I", 8000),
+    0x27: bytes([1]),
+    0x28: bytes([1]),
+    0x29: bytes([1]),
+    0x2A: bytes([0]),
+    0x2C: bytes([0]),
+    0x2D: bytes([0]),
+    0x2E: b"SIM-1.0.0",
+    0x2F: bytes([10]),
+    0x35: bytes(
+        [0, 0, 0, 0, 92, 0, 0, 0, 0, 0, 61] + [0, 0, 0, 0, 0, 72] * 10 + [0, 0]
+    ),
+    0x81: struct.pack("hh", 22 * 60, 7 * 60),
+    0x82: struct.pack("hh", 0, 0),
+    0x88: bytes([0]),
+}
+
+
+class SimAdapter(object):
+    """Stand-in for pygatt.GATTToolBackend."""
+
+    def __init__(self, watch=None, link_latency_sec=0.0, link_jitter_sec=0.0):
+        """
+        Args:
+            watch (SimWatch): The simulated watch. A new SimWatch is created if not
+              provided.
+            link_latency_sec (float): One-way latency for writes and notifications.
+            link_jitter_sec (float): Max random delay added to the latency. The order
+              of writes and notifications is always preserved.
+        """
+        self.watch = watch or SimWatch()
+        self._link = SimLink(link_latency_sec, link_jitter_sec)
+        self._device = None
+
+    def start(self, *arg_tup, **kwarg_dict):
+        self._link.start()
+
+    def stop(self):
+        self._link.stop()
+
+    def reset(self):
+        pass
+
+    def kill(self):
+        self._link.stop()
+
+    def scan(self, timeout=10, run_as_root=False):
+        return [{"name": SIM_WATCH_NAME, "address": SIM_MAC_ADDR}]
+
+    def connect(self, address, timeout=None, auto_reconnect=False, **kwarg_dict):
+        self._device = SimDevice(self.watch, self._link, address)
+        self.watch.attach(self._device)
+        return self._device
+
+    def disconnect(self, device=None):
+        self.watch.detach()
+
+    def reconnect(self, device, timeout=None):
+        self.watch.attach(device)
+
+    def set_connection_parameters(self, device, profile):
+        return self.watch.set_connection_parameters(profile)
+
+
+class SimDevice(object):
+    """Stand-in for pygatt.GATTToolBLEDevice."""
+
+    def __init__(self, watch, link, address):
+        self._watch = watch
+        self._link = link
+        self._address = address
+        self._callback_dict = {}
+        self._disconnect_callback_list = []
+
+    def bond(self, permanent=False):
+        pass
+
+    def get_handle(self, char_uuid):
+        char_uuid = uuid.UUID(str(char_uuid))
+        if char_uuid in READ_VALUE_DICT:
+            return READ_VALUE_DICT[char_uuid][0]
+        try:
+            return HANDLE_DICT[char_uuid]
+        except KeyError:
+            raise pygatt.exceptions.BLEError(f"No characteristic found: {char_uuid}")
+
+    def discover_characteristics(self):
+        return {u: self.get_handle(u) for u in [*READ_VALUE_DICT, *HANDLE_DICT]}
+
+    def subscribe(
+        self, char_uuid, callback=None, indication=False, wait_for_response=True
+    ):
+        handle = self.get_handle(char_uuid)
+        self._callback_dict.setdefault(handle, []).append(callback)
+
+    def resubscribe_all(self):
+        pass
+
+    def register_disconnect_callback(self, callback):
+        self._disconnect_callback_list.append(callback)
+
+    def char_read(self, char_uuid, timeout=1):
+        """Read a characteristic. The read takes a round trip on the link. As with
+        gatttool, a read that is not answered fails only after the timeout."""
+        if not self._watch.is_attached(self):
+            raise pygatt.exceptions.NotConnectedError("Simulated watch is disconnected")
+        value_tup = READ_VALUE_DICT.get(uuid.UUID(str(char_uuid)))
+        if value_tup is None:
+            time.sleep(timeout)
+            raise pygatt.exceptions.NotificationTimeout(f"Not readable: {char_uuid}")
+        time.sleep(2 * self._link.latency_sec)
+        return bytearray(value_tup[1])
+
+    def char_write(self, char_uuid, value, wait_for_response=True):
+        if not self._watch.is_attached(self):
+            raise pygatt.exceptions.NotConnectedError("Simulated watch is disconnected")
+        value_bytes = bytes(value)
+        if uuid.UUID(str(char_uuid)) == COMMAND_UUID:
+            self._link.send(self._watch.receive_chunk, value_bytes)
+        elif uuid.UUID(str(char_uuid)) == DATA_UUID:
+            self._link.send(self._watch.receive_data_chunk, value_bytes)
+
+    def notify(self, handle, value_bytes):
+        """Deliver a notification from the watch to the subscribed callbacks."""
+        self._link.send(self._deliver, handle, bytearray(value_bytes))
+
+    def notify_disconnected(self):
+        for callback in self._disconnect_callback_list:
+            callback({"device": self._address})
+
+    def _deliver(self, handle, value_bytes):
+        for callback in self._callback_dict.get(handle, []):
+            callback(handle, value_bytes)
+
+
+class SimWatch(object):
+    """Simulated watch state and command handling."""
+
+    def __init__(self, response_dict=None, heart_rate_interval_sec=1.0):
+        """
+        Args:
+            response_dict (dict): Responses to queries, keyed by cmd_key. Overrides
+              the defaults in DEFAULT_RESPONSE_DICT.
+            heart_rate_interval_sec (float): Time between heart rate measurements
+              while continuous measurement is running.
+        """
+        self._lock = threading.Lock()
+        self._response_dict = dict(DEFAULT_RESPONSE_DICT)
+        self._response_dict.update(response_dict or {})
+        self._device = None
+        self._rx_buf = bytearray()
+        # Log of (cmd_key, arg_bytes) for all packets received.
+        self.packet_list = []
+        # Watch face upload. Bytes written to the data characteristic are only kept
+        # while a transfer is active.
+        self.upload_size = None
+        self.upload_bytes = bytearray()
+        self._is_upload_active = False
+        # Connection parameters accepted by the watch. None until set by the central.
+        self.connection_params = None
+        # Continuous heart rate measurement. The latest measurements are kept for the
+        # movement heart rate block.
+        self._heart_rate_interval_sec = heart_rate_interval_sec
+        self._heart_rate_deque = collections.deque(
+            [0] * MOVEMENT_BLOCK_SIZE, maxlen=MOVEMENT_BLOCK_SIZE
+        )
+        self._heart_rate_count = 0
+        self._heart_rate_stop_event = threading.Event()
+        self._heart_rate_thread = None
+
+    def attach(self, device):
+        with self._lock:
+            self._device = device
+            self._rx_buf = bytearray()
+
+    def detach(self):
+        with self._lock:
+            device, self._device = self._device, None
+            self._is_upload_active = False
+        self._stop_heart_rate()
+        if device is not None:
+            device.notify_disconnected()
+
+    def set_connection_parameters(self, profile):
+        """Accept a connection parameter update.
+
+        The watch picks the longest interval in the requested range, as many
+        peripherals do, rounded down to the 1.25 ms unit of the link layer.
+
+        Returns:
+            _uwatch2connparams.ConnectionProfile: The effective parameters.
+        """
+        unit_ms = _uwatch2connparams.INTERVAL_UNIT_MS
+        interval_ms = max(
+            profile.min_interval_ms, profile.max_interval_ms // unit_ms * unit_ms
+        )
+        with self._lock:
+            self.connection_params = _uwatch2connparams.ConnectionProfile(
+                interval_ms,
+                interval_ms,
+                profile.latency,
+                profile.supervision_timeout_ms,
+            )
+            return self.connection_params
+
+    def is_attached(self, device):
+        return self._device is device
+
+    def receive_chunk(self, chunk_bytes):
+        """Reassemble packets from chunks written to the command characteristic.
+
+        Several complete packets may arrive in one chunk, and a packet may span
+        several chunks.
+        """
+        with self._lock:
+            self._rx_buf.extend(chunk_bytes)
+            pkg_list = []
+            while len(self._rx_buf) >= 4:
+                if self._rx_buf[:3] != HEADER_BYTES:
+                    log.warning(f"Discarding unframed bytes: {self._rx_buf.hex()}")
+                    self._rx_buf.clear()
+                    break
+                pkg_len = self._rx_buf[3]
+                if len(self._rx_buf) < pkg_len:
+                    break
+                pkg_list.append(bytes(self._rx_buf[:pkg_len]))
+                del self._rx_buf[:pkg_len]
+        for pkg_bytes in pkg_list:
+            self.handle_packet(pkg_bytes[4], pkg_bytes[5:])
+
+    def receive_data_chunk(self, chunk_bytes):
+        with self._lock:
+            if not self._is_upload_active:
+                log.warning(f"Discarding data outside of upload: {chunk_bytes.hex()}")
+                return
+            self.upload_bytes.extend(chunk_bytes)
+            if len(self.upload_bytes) >= self.upload_size:
+                self._is_upload_active = False
+
+    def handle_packet(self, cmd_key, arg_bytes):
+        self.packet_list.append((cmd_key, arg_bytes))
+        if self._handle_upload(cmd_key, arg_bytes):
+            return
+        if self._handle_heart_rate(cmd_key, arg_bytes):
+            return
+        if self._handle_set(cmd_key, arg_bytes):
+            return
+        response_bytes = self._response_dict.get(cmd_key)
+        if response_bytes is not None:
+            self.send_response(cmd_key, response_bytes)
+
+    def send_response(self, cmd_key, payload_bytes):
+        """Send a response as async notifications, split into 20 byte chunks."""
+        pkg_bytes = (
+            HEADER_BYTES + bytes([len(payload_bytes) + 5, cmd_key]) + payload_bytes
+        )
+        self.notify(HANDLE_DICT[ASYNC_RESPONSE_UUID], pkg_bytes)
+
+    def notify(self, handle, value_bytes):
+        device = self._device
+        if device is None:
+            return
+        for i in range(0, len(value_bytes), CHUNK_SIZE):
+            device.notify(handle, value_bytes[i : i + CHUNK_SIZE])
+
+    def _handle_upload(self, cmd_key, arg_bytes):
+        """Handle the watch face upload commands.
+
+        Returns:
+            bool: True if {cmd_key} is an upload command.
+        """
+        with self._lock:
+            if cmd_key == 0x6E:
+                (self.upload_size,) = struct.unpack(">I", arg_bytes)
+                self.upload_bytes = bytearray()
+                return True
+            elif cmd_key == 0x74:
+                # Bytes past the requested offset are discarded, so the transfer can
+                # be resumed from any offset that has been received.
+                (offset,) = struct.unpack(">I", arg_bytes)
+                del self.upload_bytes[offset:]
+                self._is_upload_active = self.upload_size is not None
+                offset = len(self.upload_bytes)
+            elif cmd_key == 0x6C:
+                offset = len(self.upload_bytes)
+            else:
+                return False
+        self.send_response(cmd_key, struct.pack(">I", offset))
+        return True
+
+    def _handle_heart_rate(self, cmd_key, arg_bytes):
+        """Handle the continuous heart rate commands.
+
+        Returns:
+            bool: True if {cmd_key} is a heart rate command.
+        """
+        if cmd_key == 0x36:
+            if arg_bytes and arg_bytes[0]:
+                self._start_heart_rate()
+            else:
+                self._stop_heart_rate()
+        elif cmd_key == 0x37:
+            with self._lock:
+                block_bytes = bytes(self._heart_rate_deque)
+            self.send_response(cmd_key, block_bytes)
+        else:
+            return False
+        return True
+
+    def _start_heart_rate(self):
+        with self._lock:
+            if self._heart_rate_thread is not None:
+                return
+            self._heart_rate_stop_event.clear()
+            self._heart_rate_thread = threading.Thread(
+                target=self._run_heart_rate, name="uwatch2-sim-hr", daemon=True
+            )
+            self._heart_rate_thread.start()
+
+    def _stop_heart_rate(self):
+        with self._lock:
+            thread, self._heart_rate_thread = self._heart_rate_thread, None
+        self._heart_rate_stop_event.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run_heart_rate(self):
+        while not self._heart_rate_stop_event.wait(self._heart_rate_interval_sec):
+            with self._lock:
+                self._heart_rate_count += 1
+                bpm = 60 + (self._heart_rate_count * 7) % 40
+                self._heart_rate_deque.append(bpm)
+            self.send_response(0x36, bytes([bpm]))
+
+    def _handle_set(self, cmd_key, arg_bytes):
+        """Update the stored responses from a set command.
+
+        Returns:
+            bool: True if {cmd_key} is a set command.
+        """
+        r = self._response_dict
+        if cmd_key == 0x11:
+            alarm_bytes = bytearray(r[0x21])
+            alarm_idx = arg_bytes[0]
+            alarm_bytes[alarm_idx * 8 : (alarm_idx + 1) * 8] = arg_bytes[:8]
+            r[0x21] = bytes(alarm_bytes)
+        elif cmd_key == 0x16:
+            r[0x26] = struct.pack("<I", *struct.unpack(">I", arg_bytes))
+        elif cmd_key in (0x71, 0x72):
+            from_hour, from_min, to_hour, to_min = arg_bytes
+            r[cmd_key + 0x10] = struct.pack(
+                "hh", from_hour * 60 + from_min, to_hour * 60 + to_min
+            )
+        elif cmd_key in (0x12, 0x17, 0x18, 0x19, 0x1A, 0x1C, 0x1D, 0x1F, 0x78):
+            r[cmd_key + 0x10] = bytes(arg_bytes)
+        elif cmd_key in (0x31, 0x41, 0x42, 0x43, 0x51, 0x54, 0x61):
+            pass
+        else:
+            return False
+        return True
+
+
+class SimLink(object):
+    """Deliver calls in order after a simulated link delay, on a separate thread."""
+
+    def __init__(self, latency_sec=0.0, jitter_sec=0.0):
+        self.latency_sec = latency_sec
+        self._jitter_sec = jitter_sec
+        self._cond = threading.Condition()
+        self._heap = []
+        self._seq = itertools.count()
+        self._last_due_time = 0.0
+        self._thread = None
+        self._is_stopping = False
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._is_stopping = False
+            self._thread = threading.Thread(
+                target=self._run, name="uwatch2-sim-link", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._is_stopping = True
+            self._cond.notify()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def send(self, func, *arg_tup):
+        """Call func(*arg_tup) on the link thread after the link latency and jitter."""
+        delay_sec = self.latency_sec + random.uniform(0, self._jitter_sec)
+        self.send_after(delay_sec, func, *arg_tup)
+
+    def send_after(self, delay_sec, func, *arg_tup):
+        """Call func(*arg_tup) on the link thread after {delay_sec}."""
+        with self._cond:
+            # Keep the order of calls even when jitter would reorder them.
+            due_time = max(time.monotonic() + delay_sec, self._last_due_time)
+            self._last_due_time = due_time
+            heapq.heappush(self._heap, (due_time, next(self._seq), func, arg_tup))
+            self._cond.notify()
+        if self._thread is None:
+            self.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._is_stopping:
+                        return
+                    if self._heap:
+                        wait_sec = self._heap[0][0] - time.monotonic()
+                        if wait_sec <= 0:
+                            break
+                        self._cond.wait(wait_sec)
+                    else:
+                        self._cond.wait()
+                due_time, seq, func, arg_tup = heapq.heappop(self._heap)
+            try:
+                func(*arg_tup)
+            except Exception:
+                log.exception("Simulated link delivery failed")
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""Collapse concurrent identical calls into a single call.
+
+The first caller for a given key runs the call. Callers that arrive with the same key
+while the call is in flight wait for it to complete and receive the same result or
+exception.
+"""
+import threading
+
+
+class SingleFlightGroup(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._call_dict = {}
+        self._saved_call_count = 0
+
+    @property
+    def saved_call_count(self):
+        """Number of calls that were served by another call already in flight."""
+        return self._saved_call_count
+
+    def do(self, key, func, *arg_tup, **kwarg_dict):
+        """Call func(*arg_tup, **kwarg_dict) unless a call for {key} is already in
+        flight, in which case wait for that call and return its result.
+
+        Args:
+            key: Hashable value that identifies calls that are interchangeable.
+        """
+        with self._lock:
+            call = self._call_dict.get(key)
+            if call is None:
+                call = _Call()
+                self._call_dict[key] = call
+                is_leader = True
+            else:
+                self._saved_call_count += 1
+                is_leader = False
+
+        if not is_leader:
+            call.done_event.wait()
+            if call.exc is not None:
+                raise call.exc
+            return call.result
+
+        try:
+            call.result = func(*arg_tup, **kwarg_dict)
+        except BaseException as e:
+            call.exc = e
+            raise
+        finally:
+            with self._lock:
+                del self._call_dict[key]
+            call.done_event.set()
+        return call.result
+
+
+class _Call(object):
+    def __init__(self):
+        self.done_event = threading.Event()
+        self.result = None
+        self.exc = None
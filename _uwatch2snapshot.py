@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""Snapshot of the values of all readable characteristics.
+
+Reads run in parallel on a pool of threads, each with a short timeout, and the
+snapshot as a whole has a deadline of one read timeout. A snapshot then takes about
+as long as the slowest read, instead of the sum of all reads, and a characteristic
+that does not answer costs one timeout in total rather than one timeout each.
+
+Characteristics that fail to read are recorded as unreadable, and are skipped in
+later snapshots of the same watch. Values that never change for a watch, such as the
+model and serial number, are cached per MAC address and not read again. Values that
+change with a firmware upgrade are read on every snapshot. The cache can be
+persisted in a JSON file:
+
+    {"11:22:33:44:55:66": {"static": {uuid: hex}, "unreadable": [uuid, ...]}}
+
+pygatt.GATTToolBackend drives a single gatttool process, which handles one command at
+a time, and is not safe for concurrent reads. With that backend, the reads are issued
+one at a time (max_parallel=1), but still with the short timeouts and the cache.
+"""
+import concurrent.futures
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import pygatt.exceptions
+
+log = logging.getLogger(__name__)
+
+DEFAULT_READ_TIMEOUT_SEC = 1.0
+DEFAULT_MAX_PARALLEL = 8
+
+
+def get_uuid16(uuid16):
+    """Get the full UUID of a 16 bit Bluetooth SIG assigned number."""
+    return uuid.UUID(f"0000{uuid16:04x}-0000-1000-8000-00805f9b34fb")
+
+
+# Characteristics with values that do not change for a given watch. The cache is keyed
+# by MAC address only, so the Firmware and Software Revision Strings, and the PnP ID,
+# which holds the product version, are left out. They change with a firmware upgrade.
+STATIC_UUID_SET = {
+    get_uuid16(v)
+    for v in (
+        0x2A00,  # Device Name
+        0x2A01,  # Appearance
+        0x2A23,  # System ID
+        0x2A24,  # Model Number String
+        0x2A25,  # Serial Number String
+        0x2A27,  # Hardware Revision String
+        0x2A29,  # Manufacturer Name String
+    )
+}
+
+
+class SnapshotCache(object):
+    """Static values and unreadable characteristics, per MAC address."""
+
+    def __init__(self, cache_path=None):
+        """
+        Args:
+            cache_path (str): Path to a JSON file in which the cache is persisted.
+              Created if it does not exist. If not provided, the cache is kept in
+              memory only.
+        """
+        self._cache_path = cache_path
+        self._lock = threading.Lock()
+        self._mac_dict = self._load()
+
+    def get_static_dict(self, mac_addr):
+        """Returns:
+        dict: uuid.UUID -> bytes. Values in the file for characteristics that are no
+        longer in STATIC_UUID_SET are ignored.
+        """
+        with self._lock:
+            hex_dict = self._get_entry(mac_addr)["static"]
+            value_dict = {uuid.UUID(k): bytes.fromhex(v) for k, v in hex_dict.items()}
+        return {k: v for k, v in value_dict.items() if k in STATIC_UUID_SET}
+
+    def get_unreadable_set(self, mac_addr):
+        """Returns:
+        set of uuid.UUID
+        """
+        with self._lock:
+            return {uuid.UUID(v) for v in self._get_entry(mac_addr)["unreadable"]}
+
+    def update(self, mac_addr, static_dict, unreadable_set):
+        """Add static values, and replace the set of unreadable characteristics."""
+        with self._lock:
+            entry_dict = self._get_entry(mac_addr)
+            entry_dict["static"].update(
+                {str(k): bytes(v).hex() for k, v in static_dict.items()}
+            )
+            entry_dict["unreadable"] = sorted(str(v) for v in unreadable_set)
+            self._save()
+
+    def clear(self, mac_addr):
+        with self._lock:
+            self._mac_dict.pop(mac_addr.upper(), None)
+            self._save()
+
+    def _get_entry(self, mac_addr):
+        return self._mac_dict.setdefault(
+            mac_addr.upper(), {"static": {}, "unreadable": []}
+        )
+
+    def _load(self):
+        if self._cache_path is None:
+            return {}
+        try:
+            with open(self._cache_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            log.warning(f"Ignoring invalid snapshot cache {self._cache_path}: {e}")
+            return {}
+
+    def _save(self):
+        if self._cache_path is None:
+            return
+        dir_path = os.path.dirname(self._cache_path)
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+        tmp_path = self._cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._mac_dict, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._cache_path)
+
+
+def read_snapshot(
+    device,
+    mac_addr,
+    cache,
+    timeout_sec=DEFAULT_READ_TIMEOUT_SEC,
+    max_parallel=DEFAULT_MAX_PARALLEL,
+    recheck_unreadable=False,
+):
+    """Read all readable characteristics.
+
+    Args:
+        device: Connected pygatt style device.
+        mac_addr (str): Key for the cache.
+        cache (SnapshotCache)
+        timeout_sec (float): Timeout for each read, and deadline for the snapshot when
+          reads run in parallel.
+        max_parallel (int): Max number of reads in flight.
+        recheck_unreadable (bool): Also read characteristics that failed before.
+
+    Returns:
+        dict: dict_keys are value_dict, read_count, cached_count, skipped_count,
+        failed_list, elapsed_sec. value_dict maps UUID strings to value bytes, and
+        includes the cached static values. failed_list holds the UUID strings of the
+        reads that failed in this snapshot.
+    """
+    start_time = time.monotonic()
+    static_dict = cache.get_static_dict(mac_addr)
+    unreadable_set = set() if recheck_unreadable else cache.get_unreadable_set(mac_addr)
+    read_list = []
+    skipped_count = 0
+    for charcs_uuid in device.discover_characteristics().keys():
+        charcs_uuid = uuid.UUID(str(charcs_uuid))
+        if charcs_uuid in static_dict:
+            continue
+        if charcs_uuid in unreadable_set:
+            skipped_count += 1
+            continue
+        read_list.append(charcs_uuid)
+
+    if max_parallel <= 1:
+        read_dict = _read_serial(device, read_list, timeout_sec)
+    else:
+        read_dict = _read_parallel(device, read_list, timeout_sec, max_parallel)
+
+    value_dict = {str(k): v for k, v in static_dict.items()}
+    failed_list = []
+    new_static_dict = {}
+    for charcs_uuid in read_list:
+        value_bytes = read_dict.get(charcs_uuid)
+        if value_bytes is None:
+            failed_list.append(str(charcs_uuid))
+            continue
+        value_dict[str(charcs_uuid)] = value_bytes
+        if charcs_uuid in STATIC_UUID_SET:
+            new_static_dict[charcs_uuid] = value_bytes
+
+    # If nothing could be read, the link is more likely to be down than all the
+    # characteristics to be unreadable, so the unreadable set is left alone.
+    if read_dict or not read_list:
+        if not recheck_unreadable:
+            unreadable_set = cache.get_unreadable_set(mac_addr)
+        cache.update(
+            mac_addr,
+            new_static_dict,
+            (unreadable_set - set(read_dict)) | {uuid.UUID(v) for v in failed_list},
+        )
+
+    return {
+        "value_dict": value_dict,
+        "read_count": len(read_list),
+        "cached_count": len(static_dict),
+        "skipped_count": skipped_count,
+        "failed_list": failed_list,
+        "elapsed_sec": time.monotonic() - start_time,
+    }
+
+
+def _read_serial(device, read_list, timeout_sec):
+    read_dict = {}
+    for charcs_uuid in read_list:
+        value_bytes = _read(device, charcs_uuid, timeout_sec)
+        if value_bytes is not None:
+            read_dict[charcs_uuid] = value_bytes
+    return read_dict
+
+
+def _read_parallel(device, read_list, timeout_sec, max_parallel):
+    if not read_list:
+        return {}
+    executor = concurrent.futures.ThreadPoolExecutor(
+        min(max_parallel, len(read_list)), thread_name_prefix="uwatch2-snapshot"
+    )
+    try:
+        future_dict = {
+            executor.submit(_read, device, charcs_uuid, timeout_sec): charcs_uuid
+            for charcs_uuid in read_list
+        }
+        # Reads queued behind others when there are more reads than threads get the
+        # time of one more read.
+        round_count = -(-len(read_list) // max_parallel)
+        done_set, not_done_set = concurrent.futures.wait(
+            future_dict, timeout=timeout_sec * round_count
+        )
+    finally:
+        # Reads that are still running are abandoned. The backend times them out.
+        executor.shutdown(wait=False)
+    for future in not_done_set:
+        log.debug(f"Read of {future_dict[future]} missed the snapshot deadline")
+    return {
+        future_dict[f]: f.result() for f in done_set if f.result() is not None
+    }
+
+
+def _read(device, charcs_uuid, timeout_sec):
+    """Returns:
+    bytes: Value, or None if the read failed.
+    """
+    try:
+        return bytes(device.char_read(charcs_uuid, timeout=timeout_sec))
+    except pygatt.exceptions.BLEError as e:
+        log.debug(f"Read of {charcs_uuid} failed: {repr(e)}")
+        return None
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+"""Keep the watch clock in sync with the host clock.
+
+The watch takes the time as whole seconds since the epoch, applied when the packet
+arrives. TimeSyncService measures the round-trip time of a cheap query, and sends
+the time so that the packet arrives at the watch on a whole second boundary, with
+that second as the timestamp.
+
+The watch clock cannot be read back, so drift since the last sync is estimated from
+the elapsed time and a drift rate for the watch's clock crystal. Scheduled syncs are
+skipped while the estimate is below a threshold. A sync is always done when the UTC
+offset of the local timezone changes, such as on a DST transition.
+
+A failed sync, for instance while the watch is out of range, is retried after a short
+delay that doubles with each failure, up to the regular interval. After a successful
+sync, the regular interval applies again.
+"""
+import datetime
+import functools
+import logging
+import math
+import threading
+import time
+
+import tzlocal
+
+log = logging.getLogger(__name__)
+
+# Time between scheduled checks of the estimated drift.
+DEFAULT_INTERVAL_SEC = 6 * 60 * 60
+# Time before the first retry after a failed sync. Doubles with each failure in a row,
+# up to the interval.
+DEFAULT_RETRY_SEC = 30
+# Scheduled syncs are skipped while the estimated drift is below this.
+DEFAULT_DRIFT_THRESHOLD_SEC = 0.5
+# Typical accuracy of a watch crystal, in parts per million.
+DEFAULT_DRIFT_PPM = 20.0
+# Number of round-trips timed for each sync. The fastest is used, since slower ones
+# include queueing.
+DEFAULT_RTT_SAMPLE_COUNT = 3
+# Extra time allowed for getting the packet out before the target second.
+SEND_MARGIN_SEC = 0.05
+# Precision when searching for the time of a UTC offset change.
+TRANSITION_PRECISION_SEC = 1.0
+
+
+@functools.lru_cache(maxsize=None)
+def get_local_zone():
+    """Get the local timezone.
+
+    The lookup reads system configuration, so it is only done once. The returned
+    zone covers DST, so the UTC offset is still correct after a transition.
+    """
+    return tzlocal.get_localzone()
+
+
+class TimeSyncService(object):
+    def __init__(
+        self,
+        uwatch2,
+        interval_sec=DEFAULT_INTERVAL_SEC,
+        drift_threshold_sec=DEFAULT_DRIFT_THRESHOLD_SEC,
+        drift_ppm=DEFAULT_DRIFT_PPM,
+        rtt_sample_count=DEFAULT_RTT_SAMPLE_COUNT,
+        tz=None,
+        retry_sec=DEFAULT_RETRY_SEC,
+    ):
+        """
+        Args:
+            uwatch2 (uwatch2lib.Uwatch2): Connected watch.
+            interval_sec (float): Time between scheduled checks.
+            drift_threshold_sec (float): Scheduled syncs are skipped while the
+              estimated drift is below this.
+            drift_ppm (float): Assumed drift rate of the watch clock.
+            rtt_sample_count (int): Round-trips to time for each sync.
+            tz (datetime.tzinfo): Timezone to set. Defaults to the local timezone.
+            retry_sec (float): Time before the first retry after a failed sync.
+        """
+        self._uwatch2 = uwatch2
+        self._interval_sec = interval_sec
+        self._drift_threshold_sec = drift_threshold_sec
+        self._drift_ppm = drift_ppm
+        self._rtt_sample_count = rtt_sample_count
+        self._tz = tz or get_local_zone()
+        self._retry_sec = retry_sec
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._last_sync_time = None
+        self._last_sync_error_sec = 0.0
+        self._last_utc_offset = None
+        self._last_rtt_sec = None
+        self._sync_count = 0
+        self._skip_count = 0
+        self._fail_count = 0
+
+    def start(self):
+        """Start syncing in a background thread. The first sync is done immediately."""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="uwatch2-timesync", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def sync(self, force=False):
+        """Sync the watch clock if needed.
+
+        Args:
+            force (bool): Sync even if the estimated drift is below the threshold.
+
+        Returns:
+            bool: True if the clock was synced, False if the sync was skipped.
+        """
+        with self._lock:
+            reason_str = self._get_sync_reason()
+            if reason_str is None and not force:
+                self._skip_count += 1
+                log.debug(
+                    f"Skipping time sync. "
+                    f"Estimated drift: {self.estimate_drift_sec():.3f} sec"
+                )
+                return False
+            self._sync(reason_str or "forced")
+            return True
+
+    def estimate_drift_sec(self):
+        """Estimate how far the watch clock is from the host clock.
+
+        Returns:
+            float: Seconds, or None if the watch has not been synced.
+        """
+        if self._last_sync_time is None:
+            return None
+        # The last sync time is the time at which the packet was due to arrive, which
+        # is slightly after it was sent.
+        elapsed_sec = max(0.0, time.time() - self._last_sync_time)
+        return self._last_sync_error_sec + elapsed_sec * self._drift_ppm / 1e6
+
+    def get_status(self):
+        """
+        Returns:
+            dict: keys are last_sync_time, last_rtt_sec, estimated_drift_sec,
+            sync_count, skip_count, fail_count
+        """
+        return {
+            "last_sync_time": self._last_sync_time,
+            "last_rtt_sec": self._last_rtt_sec,
+            "estimated_drift_sec": self.estimate_drift_sec(),
+            "sync_count": self._sync_count,
+            "skip_count": self._skip_count,
+            "fail_count": self._fail_count,
+        }
+
+    def _get_sync_reason(self):
+        """
+        Returns:
+            str: Reason for syncing, or None if no sync is needed.
+        """
+        if self._last_sync_time is None:
+            return "first sync"
+        if self._get_utc_offset(time.time()) != self._last_utc_offset:
+            return "UTC offset changed"
+        if self.estimate_drift_sec() >= self._drift_threshold_sec:
+            return "estimated drift above threshold"
+        return None
+
+    def _sync(self, reason_str):
+        min_rtt_sec, max_rtt_sec = self._measure_rtt()
+        one_way_sec = min_rtt_sec / 2
+        # Send so that the packet arrives on a whole second, which is the resolution
+        # of the timestamp.
+        target_sec = math.ceil(time.time() + one_way_sec + SEND_MARGIN_SEC)
+        time.sleep(max(0.0, target_sec - one_way_sec - time.time()))
+        target_dt = datetime.datetime.fromtimestamp(target_sec, tz=self._tz)
+        self._uwatch2.sync_time(target_dt)
+        self._last_sync_time = target_sec
+        # Variation in the round-trip time is the remaining uncertainty about when
+        # the packet arrived.
+        self._last_sync_error_sec = (max_rtt_sec - min_rtt_sec) / 2
+        self._last_utc_offset = target_dt.utcoffset()
+        self._last_rtt_sec = min_rtt_sec
+        self._sync_count += 1
+        log.info(
+            f"Synced time ({reason_str}): {target_dt.isoformat()}, "
+            f"round-trip {min_rtt_sec * 1000:.1f} ms"
+        )
+
+    def _measure_rtt(self):
+        """Time round-trips of a query that has no side effects.
+
+        Returns:
+            2-tup: Fastest and slowest round-trip, in seconds
+        """
+        rtt_list = []
+        for _ in range(self._rtt_sample_count):
+            start_time = time.monotonic()
+            self._uwatch2.get_time_format()
+            rtt_list.append(time.monotonic() - start_time)
+        return min(rtt_list), max(rtt_list)
+
+    def _run(self):
+        # Failed syncs in a row
+        retry_count = 0
+        while not self._stop_event.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                self._fail_count += 1
+                delay_sec = min(self._retry_sec * 2**retry_count, self._interval_sec)
+                retry_count += 1
+                log.error(f"Time sync failed: {e}. Retrying in {delay_sec:.1f} sec")
+            else:
+                retry_count = 0
+                delay_sec = self._interval_sec
+            next_time = time.time() + delay_sec
+            transition_time = self._find_offset_change(time.time(), next_time)
+            if transition_time is not None:
+                next_time = transition_time + TRANSITION_PRECISION_SEC
+            self._stop_event.wait(max(0.0, next_time - time.time()))
+
+    def _find_offset_change(self, start_time, end_time):
+        """Find the first time in the range at which the UTC offset changes.
+
+        Returns:
+            float: POSIX time of the change, or None if the offset does not change.
+        """
+        start_offset = self._get_utc_offset(start_time)
+        if self._get_utc_offset(end_time) == start_offset:
+            return None
+        while end_time - start_time > TRANSITION_PRECISION_SEC:
+            mid_time = (start_time + end_time) / 2
+            if self._get_utc_offset(mid_time) == start_offset:
+                start_time = mid_time
+            else:
+                end_time = mid_time
+        return end_time
+
+    def _get_utc_offset(self, posix_time):
+        return datetime.datetime.fromtimestamp(posix_time, tz=self._tz).utcoffset()
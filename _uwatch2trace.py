@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""Tracing hooks for the BLE protocol.
+
+A tracer is any callable that takes (event_str, timestamp, field_dict). Tracers are
+attached with Uwatch2Ble.add_tracer(). When no tracer is attached, the only cost at
+each trace point is checking that the tracer list is empty. Formatting, such as
+converting bytes to hex, is done by the tracer itself, so it is only paid for when
+tracing is enabled.
+
+timestamp is from time.monotonic().
+"""
+import binascii
+import logging
+
+log = logging.getLogger(__name__)
+
+# Packet about to be written. Fields: header_bytes, payload_bytes
+TX_PACKET = "tx_packet"
+# Chunk of up to 20 bytes written to a characteristic. Fields: uuid, chunk_bytes,
+# result
+TX_CHUNK = "tx_chunk"
+# Notification received. Called on the backend's receive thread. Fields: handle,
+# value_bytes
+RX_NOTIFICATION = "rx_notification"
+# Valid header at the start of an async response. Fields: payload_byte_count
+RX_HEADER = "rx_header"
+# Notification appended to an async response. Fields: byte_count, acc_byte_count,
+# expected_byte_count
+REASSEMBLY_PROGRESS = "reassembly_progress"
+# All bytes of an async response received. Fields: cmd_key, payload_bytes
+REASSEMBLY_COMPLETE = "reassembly_complete"
+# Disconnect reported by the backend. No fields.
+DISCONNECTED = "disconnected"
+# Alarm bytes sent to or received from the watch. Fields: direction_str, alarm_list
+ALARM_BYTES = "alarm_bytes"
+
+
+class LoggingTracer(object):
+    """Tracer that writes protocol details to a logger at DEBUG level."""
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self._log = logger or log
+        self._level = level
+
+    def __call__(self, event_str, timestamp, field_dict):
+        if not self._log.isEnabledFor(self._level):
+            return
+        for line in self._format(event_str, field_dict):
+            self._log.log(self._level, line)
+
+    def _format(self, event_str, d):
+        if event_str == TX_PACKET:
+            pkg_bytes = d["header_bytes"] + d["payload_bytes"]
+            return [
+                f"Sending packet: {get_hex_str(pkg_bytes)}",
+                f"  Header:  {get_hex_str(d['header_bytes'])}",
+                f"  Payload: {get_hex_str(d['payload_bytes'])}",
+            ]
+        if event_str == TX_CHUNK:
+            line_list = [f"-> {get_hex_str(d['chunk_bytes'])}"]
+            if d["result"] is not None:
+                line_list.append(f"-> result: {d['result']}")
+            return line_list
+        if event_str == RX_NOTIFICATION:
+            return [f"<- handle=0x{d['handle']:02x} {get_hex_str(d['value_bytes'])}"]
+        if event_str == RX_HEADER:
+            return [
+                f"Received valid header for {d['payload_byte_count']} payload bytes"
+            ]
+        if event_str == REASSEMBLY_PROGRESS:
+            return [
+                f"Received {d['byte_count']} bytes. "
+                f"Now have {d['acc_byte_count']} bytes. "
+                f"Expecting {d['expected_byte_count']} bytes"
+            ]
+        if event_str == REASSEMBLY_COMPLETE:
+            return [
+                f"Received all {len(d['payload_bytes'])} expected bytes for "
+                f"cmd_key 0x{d['cmd_key']:02x}: {get_hex_str(d['payload_bytes'])}"
+            ]
+        if event_str == ALARM_BYTES:
+            alarm_list = d["alarm_list"]
+
+            def f(alarm_idx):
+                i = alarm_idx * 8
+                return " ".join(f"{v: 3d}" for v in alarm_list[i : i + 8])
+
+            return [f"{d['direction_str']}: {f(0)}  {f(1)}  {f(2)}"]
+        return [f"{event_str}: {d}"]
+
+
+def get_hex_str(b):
+    # noinspection PyArgumentList
+    return binascii.hexlify(b, " ").decode("ascii")
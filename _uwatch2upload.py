@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""Resumable upload of watch face images.
+
+The file is streamed from disk in 20 byte chunks written to the data characteristic.
+Data writes are not acknowledged per chunk, so the uploader keeps a window of chunks
+in flight, and after each window asks the watch how many bytes it has received
+(0x6C). The next window starts from the confirmed offset, so bytes lost on the link
+are sent again.
+
+The link is switched to the bulk connection profile for the duration of the upload,
+for the shortest connection interval. See _uwatch2connparams.
+
+If the link drops, the upload waits, reconnects, asks for the confirmed offset and
+resumes the transfer from there (0x74), instead of starting over.
+
+Experimental. The protocol is a guess, and has not been confirmed against a watch.
+The command list documents the 0x74 argument as "uint32 size", while it is used as
+an offset here. The uploader has only been tested against _uwatch2sim, which
+implements the same guess.
+"""
+import logging
+import os
+import time
+
+import pygatt.exceptions
+
+import _uwatch2ble
+import _uwatch2connparams
+
+log = logging.getLogger(__name__)
+
+# Number of chunks sent before waiting for the watch to confirm the offset.
+DEFAULT_WINDOW_CHUNK_COUNT = 16
+# ATT write requests contain max 20 data bytes
+DEFAULT_CHUNK_SIZE = 20
+# Number of consecutive failures before the upload is abandoned.
+DEFAULT_MAX_RETRY_COUNT = 5
+DEFAULT_RETRY_DELAY_SEC = 1.0
+
+
+class WatchFaceUploader(object):
+    def __init__(
+        self,
+        uwatch2,
+        window_chunk_count=DEFAULT_WINDOW_CHUNK_COUNT,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        max_retry_count=DEFAULT_MAX_RETRY_COUNT,
+        retry_delay_sec=DEFAULT_RETRY_DELAY_SEC,
+        progress_callback=None,
+    ):
+        """
+        Args:
+            uwatch2 (uwatch2lib.Uwatch2): Connected watch.
+            window_chunk_count (int): Chunks sent between offset confirmations.
+            chunk_size (int): Bytes per write.
+            max_retry_count (int): Consecutive failures before giving up.
+            retry_delay_sec (float): Time to wait after a failure before resuming.
+            progress_callback (callable): Called with (confirmed_offset, size) after
+              each window.
+        """
+        self._uwatch2 = uwatch2
+        self._window_size = window_chunk_count * chunk_size
+        self._chunk_size = chunk_size
+        self._max_retry_count = max_retry_count
+        self._retry_delay_sec = retry_delay_sec
+        self._progress_callback = progress_callback
+
+    def upload(self, face_path):
+        """Upload a watch face image file.
+
+        The link is switched to the bulk connection profile during the upload.
+
+        Returns:
+            dict: dict_keys are byte_count, elapsed_sec, bytes_per_sec, resume_count
+        """
+        with self._uwatch2.connection_profile(_uwatch2connparams.BULK):
+            return self._upload(face_path)
+
+    def _upload(self, face_path):
+        size = os.path.getsize(face_path)
+        start_time = time.monotonic()
+        resume_count = 0
+        retry_count = 0
+        self._uwatch2.start_watch_face_upload(size)
+        offset = self._uwatch2.start_watch_face_file_transfer(0)
+        with open(face_path, "rb") as f:
+            while offset < size:
+                try:
+                    offset = self._send_window(f, offset, size)
+                    retry_count = 0
+                except (
+                    pygatt.exceptions.BLEError,
+                    _uwatch2ble.WatchTimeoutError,
+                ) as e:
+                    retry_count += 1
+                    if retry_count > self._max_retry_count:
+                        raise _uwatch2ble.WatchError(
+                            f"Watch face upload failed at offset {offset} of {size}: "
+                            f"{repr(e)}"
+                        )
+                    log.info(f"Watch face upload interrupted: {repr(e)}. Resuming...")
+                    time.sleep(self._retry_delay_sec)
+                    offset = self._resume()
+                    resume_count += 1
+                if self._progress_callback:
+                    self._progress_callback(offset, size)
+        elapsed_sec = time.monotonic() - start_time
+        log.info(f"Uploaded watch face: {size} bytes in {elapsed_sec:.2f} sec")
+        return {
+            "byte_count": size,
+            "elapsed_sec": elapsed_sec,
+            "bytes_per_sec": size / elapsed_sec if elapsed_sec else 0.0,
+            "resume_count": resume_count,
+        }
+
+    def _send_window(self, f, offset, size):
+        """Send one window of chunks starting at {offset}.
+
+        Returns:
+            int: Offset confirmed by the watch after the window.
+        """
+        end_offset = min(offset + self._window_size, size)
+        f.seek(offset)
+        while offset < end_offset:
+            chunk_bytes = f.read(min(self._chunk_size, end_offset - offset))
+            self._uwatch2._send_data(chunk_bytes)
+            offset += len(chunk_bytes)
+        confirmed_offset = self._uwatch2.ui_file_transfer()
+        if confirmed_offset < offset:
+            # Chunks were lost. The transfer restarts at the last received byte.
+            log.debug(f"Watch confirmed {confirmed_offset} of {offset} bytes sent")
+            confirmed_offset = self._uwatch2.start_watch_face_file_transfer(
+                confirmed_offset
+            )
+        return confirmed_offset
+
+    def _resume(self):
+        """Restart the transfer at the offset the watch has received.
+
+        Returns:
+            int: Offset at which the watch accepts the next byte.
+        """
+        confirmed_offset = self._uwatch2.ui_file_transfer()
+        return self._uwatch2.start_watch_face_file_transfer(confirmed_offset)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+"""Encoding of weather packets, and a service that pushes a local forecast feed to
+one or more watches.
+
+Packet layout, inferred from the command list and not yet confirmed against a watch:
+
+    0x42 future weather: 7 days of (condition uint8, low int8, high int8)
+    0x43 today weather: condition uint8, temperature int8, followed by the city name
+      in UTF-8
+
+Temperatures are in degrees Celsius.
+
+The feed is a JSON object, read from a file or from a socket that sends the object
+and closes the connection:
+
+    {
+        "today": {"condition": 1, "temp": 12, "city": "Oslo"},
+        "future": [[1, 8, 14], [2, 7, 12], ...]
+    }
+
+The encoded packets are cached, and are only encoded again when the feed bytes
+change. Each watch is only sent the packets that differ from what it last received,
+so an update in which the forecast has not changed does not use the radio.
+
+A packet counts as received only when its write has completed. If the watch is not
+available and the write is queued in the journal instead, it is sent again on the next
+push. The record of what a watch has received is cleared when it disconnects, since
+the watch may have rebooted, so the next push sends the full forecast.
+"""
+import functools
+import hashlib
+import json
+import logging
+import socket
+import struct
+import threading
+
+import pygatt.exceptions
+
+import _uwatch2ble
+
+log = logging.getLogger(__name__)
+
+FUTURE_DAY_COUNT = 7
+# City names are truncated to fit in a single packet.
+MAX_CITY_BYTES = 255 - 4 - 3
+
+DEFAULT_INTERVAL_SEC = 60 * 60
+SOCKET_TIMEOUT_SEC = 10.0
+
+
+def encode_future_weather(forecast_list):
+    """Encode a 0x42 future weather packet.
+
+    Args:
+        forecast_list (list of 3-tup): (condition_int, low_c, high_c) for each of the
+          next 7 days.
+
+    Returns:
+        bytes: Payload, including cmd_key.
+    """
+    if len(forecast_list) != FUTURE_DAY_COUNT:
+        raise _uwatch2ble.WatchError(
+            f"Future weather must have {FUTURE_DAY_COUNT} days. "
+            f"Got {len(forecast_list)}"
+        )
+    try:
+        return bytes([0x42]) + b"".join(
+            struct.pack("Bbb", *map(int, day_tup)) for day_tup in forecast_list
+        )
+    except (struct.error, TypeError, ValueError) as e:
+        raise _uwatch2ble.WatchError(f"Invalid future weather: {forecast_list}: {e}")
+
+
+def encode_today_weather(condition_int, temp_c, city_str=""):
+    """Encode a 0x43 today weather packet.
+
+    Returns:
+        bytes: Payload, including cmd_key.
+    """
+    try:
+        arg_bytes = struct.pack("Bb", int(condition_int), int(temp_c))
+    except (struct.error, TypeError, ValueError) as e:
+        raise _uwatch2ble.WatchError(
+            f"Invalid today weather: {condition_int} {temp_c}: {e}"
+        )
+    city_bytes = city_str.encode("utf-8")
+    if len(city_bytes) > MAX_CITY_BYTES:
+        city_bytes = city_bytes[:MAX_CITY_BYTES].decode("utf-8", "ignore").encode()
+    return bytes([0x43]) + arg_bytes + city_bytes
+
+
+def encode_feed(feed_dict):
+    """Encode the packets for a parsed feed.
+
+    Returns:
+        list of bytes: Payloads, including cmd_key.
+    """
+    payload_list = []
+    today_dict = feed_dict.get("today")
+    if today_dict is not None:
+        payload_list.append(
+            encode_today_weather(
+                today_dict["condition"], today_dict["temp"], today_dict.get("city", "")
+            )
+        )
+    future_list = feed_dict.get("future")
+    if future_list is not None:
+        payload_list.append(encode_future_weather(future_list))
+    return payload_list
+
+
+class WeatherPushService(object):
+    def __init__(self, feed_source, interval_sec=DEFAULT_INTERVAL_SEC):
+        """
+        Args:
+            feed_source (str or 2-tup): Path of the feed file, or (host, port) of a
+              socket that sends the feed.
+            interval_sec (float): Time between updates when running in the
+              background.
+        """
+        self._feed_source = feed_source
+        self._interval_sec = interval_sec
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # Digest of the feed bytes from which the cached packets were encoded.
+        self._feed_digest = None
+        # cmd_key -> encoded payload
+        self._payload_dict = {}
+        # Uwatch2 -> {cmd_key: payload last sent to that watch}
+        self._sent_dict = {}
+        # Uwatch2 -> disconnect handler that clears its entry in _sent_dict
+        self._disconnect_handler_dict = {}
+        self._stats_dict = {
+            "feed_reads": 0,
+            "feed_changes": 0,
+            "packets_sent": 0,
+            "packets_journaled": 0,
+            "packets_skipped": 0,
+            "push_errors": 0,
+        }
+
+    def add_watch(self, uwatch2):
+        """Add a connected watch. It receives the current forecast on the next push."""
+        with self._lock:
+            if uwatch2 in self._sent_dict:
+                return
+            self._sent_dict[uwatch2] = {}
+            handler = functools.partial(self._on_disconnect, uwatch2)
+            self._disconnect_handler_dict[uwatch2] = handler
+        uwatch2.add_disconnect_handler(handler)
+
+    def remove_watch(self, uwatch2):
+        with self._lock:
+            self._sent_dict.pop(uwatch2, None)
+            handler = self._disconnect_handler_dict.pop(uwatch2, None)
+        if handler is not None:
+            uwatch2.remove_disconnect_handler(handler)
+
+    def start(self):
+        """Update in a background thread. The first update is done immediately."""
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="uwatch2-weather", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        thread, self._thread = self._thread, None
+        if thread is not None:
+            thread.join()
+
+    def update(self):
+        """Read the feed and push any changes to all watches.
+
+        Returns:
+            int: Number of packets sent.
+        """
+        self.refresh()
+        return self.push()
+
+    def refresh(self):
+        """Read the feed, and encode the packets if the feed has changed.
+
+        Returns:
+            bool: True if the feed changed.
+        """
+        feed_bytes = self._read_feed()
+        feed_digest = hashlib.sha1(feed_bytes).digest()
+        with self._lock:
+            self._stats_dict["feed_reads"] += 1
+            if feed_digest == self._feed_digest:
+                return False
+        try:
+            feed_dict = json.loads(feed_bytes.decode("utf-8"))
+        except ValueError as e:
+            raise _uwatch2ble.WatchError(f"Invalid weather feed: {e}")
+        payload_dict = {p[0]: p for p in encode_feed(feed_dict)}
+        with self._lock:
+            self._feed_digest = feed_digest
+            self._payload_dict = payload_dict
+            self._stats_dict["feed_changes"] += 1
+        log.info("Weather feed changed")
+        return True
+
+    def push(self, uwatch2=None):
+        """Send the cached packets to each watch that has not received them.
+
+        Args:
+            uwatch2 (uwatch2lib.Uwatch2): Push only to this watch. By default, push to
+              all added watches.
+
+        Returns:
+            int: Number of packets sent. Does not include packets that were queued in
+            the journal because the watch was not available.
+        """
+        with self._lock:
+            payload_dict = self._payload_dict
+            if uwatch2 is None:
+                watch_list = list(self._sent_dict)
+            else:
+                watch_list = [uwatch2]
+        sent_count = 0
+        for w in watch_list:
+            sent_count += self._push_watch(w, payload_dict)
+        return sent_count
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats_dict)
+
+    def _push_watch(self, uwatch2, payload_dict):
+        with self._lock:
+            last_sent_dict = dict(self._sent_dict.get(uwatch2, {}))
+        changed_list = [
+            p for k, p in payload_dict.items() if last_sent_dict.get(k) != p
+        ]
+        with self._lock:
+            self._stats_dict["packets_skipped"] += len(payload_dict) - len(
+                changed_list
+            )
+        if not changed_list:
+            return 0
+        try:
+            journaled_list = uwatch2.set_weather_payloads(changed_list)
+        except (pygatt.exceptions.BLEError, _uwatch2ble.WatchError) as e:
+            # Nothing is recorded as sent, so the packets are sent on the next push.
+            log.error(f"Weather push failed: {e}")
+            with self._lock:
+                self._stats_dict["push_errors"] += 1
+            return 0
+        # Journaled packets have not reached the watch yet, so they are not recorded
+        # as sent.
+        sent_list = [p for p in changed_list if p not in journaled_list]
+        with self._lock:
+            if uwatch2 in self._sent_dict:
+                self._sent_dict[uwatch2].update({p[0]: p for p in sent_list})
+            self._stats_dict["packets_sent"] += len(sent_list)
+            self._stats_dict["packets_journaled"] += len(journaled_list)
+        return len(sent_list)
+
+    def _on_disconnect(self, uwatch2):
+        with self._lock:
+            if uwatch2 in self._sent_dict:
+                self._sent_dict[uwatch2] = {}
+        log.debug("Watch disconnected. Cleared the record of sent weather packets")
+
+    def _read_feed(self):
+        if isinstance(self._feed_source, str):
+            with open(self._feed_source, "rb") as f:
+                return f.read()
+        buf = bytearray()
+        with socket.create_connection(self._feed_source, SOCKET_TIMEOUT_SEC) as s:
+            while True:
+                chunk_bytes = s.recv(4096)
+                if not chunk_bytes:
+                    break
+                buf.extend(chunk_bytes)
+        return bytes(buf)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.update()
+            except Exception as e:
+                log.error(f"Weather update failed: {e}")
+            self._stop_event.wait(self._interval_sec)
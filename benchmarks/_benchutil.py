@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+"""Timing and result files shared by the benchmarks.
+
+Result file format (JSON):
+
+    time: Wall clock time of the run
+    python: Python version
+    platform: Platform string
+    result_dict: Benchmark name to dict with keys ns_per_call (median of the
+      repeats) and min_ns_per_call
+"""
+import json
+import platform
+import statistics
+import sys
+import time
+import timeit
+
+DEFAULT_REPEAT_COUNT = 7
+# Target duration of each repeat. The number of calls per repeat is calibrated to
+# reach it.
+DEFAULT_REPEAT_SEC = 0.05
+# A benchmark is reported as a regression if it is this much slower than baseline.
+DEFAULT_THRESHOLD = 0.10
+
+
+def time_func(func, repeat_count=DEFAULT_REPEAT_COUNT, repeat_sec=DEFAULT_REPEAT_SEC):
+    """Time calls to a function that takes no arguments.
+
+    Returns:
+        dict: keys are ns_per_call and min_ns_per_call
+    """
+    timer = timeit.Timer(func)
+    call_count, elapsed_sec = timer.autorange()
+    call_count = max(1, int(call_count * repeat_sec / max(elapsed_sec, 1e-9)))
+    ns_list = [sec / call_count * 1e9 for sec in timer.repeat(repeat_count, call_count)]
+    return {
+        "ns_per_call": statistics.median(ns_list),
+        "min_ns_per_call": min(ns_list),
+    }
+
+
+def new_results(result_dict):
+    return {
+        "time": time.time(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "result_dict": result_dict,
+    }
+
+
+def save_results(result_path, results):
+    with open(result_path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load_results(result_path):
+    with open(result_path) as f:
+        return json.load(f)
+
+
+def compare_results(result_dict, baseline_dict, threshold=DEFAULT_THRESHOLD):
+    """Compare results against a baseline.
+
+    Args:
+        result_dict (dict): Benchmark name to dict with key ns_per_call.
+        baseline_dict (dict): Same, for the baseline.
+        threshold (float): Relative slowdown above which a benchmark is reported as a
+          regression.
+
+    Returns:
+        2-tup: (list of str: Lines for display, list of str: Names of regressed
+        benchmarks)
+    """
+    line_list = [f"{'benchmark':<36} {'baseline ns':>12} {'ns':>12} {'change':>8}"]
+    regression_list = []
+    for name, d in result_dict.items():
+        baseline = baseline_dict.get(name)
+        if baseline is None:
+            line_list.append(
+                f"{name:<36} {'-':>12} {d['ns_per_call']:>12.0f} {'new':>8}"
+            )
+            continue
+        change = d["ns_per_call"] / baseline["ns_per_call"] - 1
+        is_regression = change > threshold
+        if is_regression:
+            regression_list.append(name)
+        line_list.append(
+            f"{name:<36} {baseline['ns_per_call']:>12.0f} {d['ns_per_call']:>12.0f} "
+            f"{change:>+7.1%}{' REGRESSION' if is_regression else ''}"
+        )
+    return line_list, regression_list
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+"""Per-packet overhead of the BLE backends.
+
+Runs the same series of queries and writes through Uwatch2 on each backend, and
+reports the latency per command and the CPU time of this process per packet, where a
+packet is an ATT write or a notification.
+
+Backends:
+
+    sim: _uwatch2sim.SimAdapter. Baseline with no backend cost.
+    dbus-fake: _uwatch2dbus.DbusAdapter on a FakeBluezBus, which serves the simulated
+      watch. Shows the cost of the D-Bus backend layer, without the bus itself.
+    gatttool: pygatt.GATTToolBackend. Requires a watch, see --mac.
+    dbus: _uwatch2dbus.DbusAdapter on the system bus. Requires a watch and jeepney.
+
+With a watch, compare gatttool and dbus. The CPU time spent parsing gatttool output
+with pexpect is included, while the CPU time of the gatttool and bluetoothd processes
+is not.
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import pygatt
+
+import _benchutil
+import _uwatch2dbus
+import _uwatch2sim
+import uwatch2lib
+
+BACKEND_LIST = ["sim", "dbus-fake", "gatttool", "dbus"]
+SIM_BACKEND_LIST = ["sim", "dbus-fake"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backends",
+        default=",".join(SIM_BACKEND_LIST),
+        help=f"Comma separated list of backends to run. One or more of: "
+        f"{', '.join(BACKEND_LIST)}",
+    )
+    parser.add_argument(
+        "--mac", metavar="11:22:33:44:55:66", help="Watch for gatttool and dbus"
+    )
+    parser.add_argument(
+        "--rounds", type=int, default=500, help="Number of query and write pairs"
+    )
+    parser.add_argument("--save", metavar="path", help="Save results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)-8s %(message)s")
+
+    result_dict = {}
+    print(
+        f"{'backend':<12} {'p50 ms':>8} {'p95 ms':>8} {'cmd/s':>8} "
+        f"{'packets':>8} {'cpu us/packet':>14}"
+    )
+    for backend_str in args.backends.split(","):
+        if backend_str not in BACKEND_LIST:
+            parser.error(f"Unknown backend: {backend_str}")
+        if backend_str not in SIM_BACKEND_LIST and not args.mac:
+            parser.error(f"Backend {backend_str} requires --mac")
+        stats_dict = run_backend(backend_str, args.mac, args.rounds)
+        print(
+            f"{backend_str:<12} {stats_dict['p50_sec'] * 1e3:>8.3f} "
+            f"{stats_dict['p95_sec'] * 1e3:>8.3f} {stats_dict['cmd_per_sec']:>8.0f} "
+            f"{stats_dict['packet_count']:>8} "
+            f"{stats_dict['cpu_sec_per_packet'] * 1e6:>14.1f}"
+        )
+        result_dict[backend_str] = {
+            "ns_per_call": stats_dict["cpu_sec_per_packet"] * 1e9,
+            "p50_ns": stats_dict["p50_sec"] * 1e9,
+            "p95_ns": stats_dict["p95_sec"] * 1e9,
+        }
+
+    if args.save:
+        _benchutil.save_results(args.save, _benchutil.new_results(result_dict))
+
+
+def create_adapter(backend_str):
+    """
+    Returns:
+        2-tup: adapter, bus to close after the run or None
+    """
+    if backend_str == "sim":
+        return _uwatch2sim.SimAdapter(), None
+    if backend_str == "dbus-fake":
+        bus = _uwatch2dbus.FakeBluezBus()
+        return _uwatch2dbus.DbusAdapter(bus=bus), bus
+    if backend_str == "gatttool":
+        return pygatt.GATTToolBackend(), None
+    return _uwatch2dbus.DbusAdapter(), None
+
+
+def run_backend(backend_str, mac_addr, round_count):
+    adapter, bus = create_adapter(backend_str)
+    latency_list = []
+    try:
+        with uwatch2lib.Uwatch2(
+            mac_addr=mac_addr or _uwatch2sim.SIM_MAC_ADDR, adapter=adapter
+        ) as uwatch2:
+            # Warm up, and get the counters at the start of the run.
+            uwatch2.get_steps_goal()
+            start_packet_count = get_packet_count(uwatch2)
+            start_cpu_sec = time.process_time()
+            start_time = time.monotonic()
+            for _ in range(round_count):
+                cmd_start_time = time.monotonic()
+                # Response spans several notifications
+                uwatch2.get_alarms()
+                latency_list.append(time.monotonic() - cmd_start_time)
+                cmd_start_time = time.monotonic()
+                uwatch2.set_time_format(1)
+                latency_list.append(time.monotonic() - cmd_start_time)
+            elapsed_sec = time.monotonic() - start_time
+            cpu_sec = time.process_time() - start_cpu_sec
+            packet_count = get_packet_count(uwatch2) - start_packet_count
+    finally:
+        if bus is not None:
+            bus.close()
+    q = statistics.quantiles(latency_list, n=100, method="inclusive")
+    return {
+        "p50_sec": q[49],
+        "p95_sec": q[94],
+        "cmd_per_sec": len(latency_list) / elapsed_sec,
+        "packet_count": packet_count,
+        "cpu_sec_per_packet": cpu_sec / max(packet_count, 1),
+    }
+
+
+def get_packet_count(uwatch2):
+    """Get the number of ATT writes and notifications so far."""
+    metrics_dict = uwatch2.get_metrics()
+    return sum(
+        sample_dict["value"]
+        for name in ("command_chunks_total", "notifications_total")
+        for sample_dict in metrics_dict.get(name, [])
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""Throughput benchmark for bulk decoding of trace files.
+
+Writes an archive of synthetic trace files with commands and multi-chunk responses,
+decodes it in a single process and then with a process pool, and reports the decode
+rate in MB/s of trace data for each.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import _uwatch2capture
+import _uwatch2decode
+import _uwatch2sim
+import _uwatch2trace
+
+CHUNK_SIZE = 20
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--files", type=int, default=8, help="Number of trace files in the archive"
+    )
+    parser.add_argument(
+        "--commands", type=int, default=50000, help="Command/response pairs per file"
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="Worker processes for the parallel run",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir_path:
+        trace_path_list = []
+        expected_packet_count = 0
+        for i in range(args.files):
+            trace_path = os.path.join(tmp_dir_path, f"trace-{i:03d}.cap")
+            expected_packet_count += write_synthetic_trace(
+                trace_path, args.commands, random.Random(args.seed + i)
+            )
+            trace_path_list.append(trace_path)
+        mb_count = sum(os.path.getsize(p) for p in trace_path_list) / 1e6
+        print(f"Archive: {args.files} files, {mb_count:.1f} MB")
+        print(f"{'processes':>10} {'packets':>10} {'sec':>8} {'MB/s':>8}")
+        for process_count in sorted({1, args.processes}):
+            start_time = time.monotonic()
+            column_dict = _uwatch2decode.decode_archive(trace_path_list, process_count)
+            elapsed_sec = time.monotonic() - start_time
+            packet_count = len(column_dict["cmd_key"])
+            assert packet_count == expected_packet_count, (
+                packet_count,
+                expected_packet_count,
+            )
+            assert not column_dict["resync_count"]
+            print(
+                f"{process_count:>10} {packet_count:>10} {elapsed_sec:>8.2f} "
+                f"{mb_count / elapsed_sec:>8.1f}"
+            )
+
+
+def write_synthetic_trace(trace_path, command_count, rnd):
+    """Write a trace of queries and responses with random payload sizes.
+
+    Returns:
+        int: Number of packets in the trace.
+    """
+    tracer = _uwatch2capture.CaptureTracer(trace_path, _uwatch2sim.HANDLE_DICT)
+    response_handle = _uwatch2sim.HANDLE_DICT[_uwatch2sim.ASYNC_RESPONSE_UUID]
+    timestamp = time.monotonic()
+    try:
+        for _ in range(command_count):
+            cmd_key = rnd.randrange(0x10, 0x80)
+            tx_bytes = make_packet(cmd_key, bytes(rnd.randrange(0, 16)))
+            for chunk_bytes in iter_chunks(tx_bytes):
+                timestamp += 0.0001
+                tracer(
+                    _uwatch2trace.TX_CHUNK,
+                    timestamp,
+                    {
+                        "uuid": _uwatch2sim.COMMAND_UUID,
+                        "chunk_bytes": chunk_bytes,
+                        "result": None,
+                    },
+                )
+            rx_bytes = make_packet(cmd_key, rnd.randbytes(rnd.randrange(0, 80)))
+            for chunk_bytes in iter_chunks(rx_bytes):
+                timestamp += 0.0001
+                tracer(
+                    _uwatch2trace.RX_NOTIFICATION,
+                    timestamp,
+                    {"handle": response_handle, "value_bytes": chunk_bytes},
+                )
+    finally:
+        tracer.close()
+    return command_count * 2
+
+
+def make_packet(cmd_key, payload_bytes):
+    return (
+        _uwatch2decode.HEADER_BYTES
+        + bytes([len(payload_bytes) + 5, cmd_key])
+        + payload_bytes
+    )
+
+
+def iter_chunks(pkg_bytes):
+    for i in range(0, len(pkg_bytes), CHUNK_SIZE):
+        yield pkg_bytes[i : i + CHUNK_SIZE]
+
+
+if __name__ == "__main__":
+    main()
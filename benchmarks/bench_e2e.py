@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+"""End-to-end latency and throughput benchmark against a simulated watch.
+
+Runs the command set of uwatch2-client.py through its CommandInterface, so each
+command goes through client dispatch, the library, the notification buffer and
+response reassembly. The simulated link adds the configured latency and jitter to
+each write and notification.
+
+Reports latency percentiles per command, overall commands per second, and the cold
+start time of uwatch2-client.py, from process start to exit, for a single command.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+CLIENT_PATH = os.path.join(ROOT_PATH, "uwatch2-client.py")
+
+sys.path.insert(0, ROOT_PATH)
+
+import _benchutil
+import _uwatch2sim
+import uwatch2lib
+
+# Commands as they are entered in the client.
+COMMAND_LIST = [
+    "get-user-info",
+    "set-user-info 175 70 30 0",
+    "get-steps-goal",
+    "set-steps-goal 8000",
+    "get-quick-view",
+    "get-quick-view-enabled-period",
+    "get-heart-rate",
+    "get-timing-measure-heart-rate",
+    "get-alarms",
+    "get-time-format",
+    "set-time-format 1",
+    "get-metric-system",
+    "get-other-message",
+    "get-watch-face",
+    "set-watch-face 0",
+    "get-breathing-light",
+    "get-dnd-period",
+    "set-dnd-period 22 0 7 0",
+    "get-sedentary-reminder",
+    "get-sedentary-reminder-period",
+    "send-message Hello",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--rounds", type=int, default=20, help="Times to run the full command set"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=2.0, help="Simulated one-way link latency"
+    )
+    parser.add_argument(
+        "--jitter-ms", type=float, default=1.0, help="Simulated link jitter"
+    )
+    parser.add_argument(
+        "--cold-starts",
+        type=int,
+        default=5,
+        help="Times to start uwatch2-client.py for the cold start measurement",
+    )
+    parser.add_argument("--save", metavar="path", help="Save results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)-8s %(message)s")
+
+    client = load_client_module()
+    adapter = _uwatch2sim.SimAdapter(
+        link_latency_sec=args.latency_ms / 1000, link_jitter_sec=args.jitter_ms / 1000
+    )
+    latency_dict = {cmd_str: [] for cmd_str in COMMAND_LIST}
+    with uwatch2lib.Uwatch2(
+        mac_addr=_uwatch2sim.SIM_MAC_ADDR, adapter=adapter
+    ) as uwatch2:
+        command_interface = client.CommandInterface(uwatch2)
+        start_time = time.monotonic()
+        for _ in range(args.rounds):
+            for cmd_str in COMMAND_LIST:
+                cmd_start_time = time.monotonic()
+                command_interface.run_commands([cmd_str])
+                latency_dict[cmd_str].append(time.monotonic() - cmd_start_time)
+        elapsed_sec = time.monotonic() - start_time
+
+    result_dict = {}
+    print(f"{'command':<36} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for cmd_str, latency_list in latency_dict.items():
+        p50, p95, p99 = get_percentiles(latency_list)
+        result_dict[cmd_str] = {
+            "ns_per_call": p50 * 1e9,
+            "p95_ns": p95 * 1e9,
+            "p99_ns": p99 * 1e9,
+        }
+        print(f"{cmd_str:<36} {p50 * 1e3:>8.2f} {p95 * 1e3:>8.2f} {p99 * 1e3:>8.2f}")
+    cmd_per_sec = args.rounds * len(COMMAND_LIST) / elapsed_sec
+    print(f"\nThroughput: {cmd_per_sec:.1f} commands/s")
+
+    if args.cold_starts:
+        cold_start_list = measure_cold_start(args.cold_starts)
+        print(
+            f"Cold start: median {statistics.median(cold_start_list) * 1e3:.0f} ms, "
+            f"min {min(cold_start_list) * 1e3:.0f} ms"
+        )
+        result_dict["cold_start"] = {
+            "ns_per_call": statistics.median(cold_start_list) * 1e9
+        }
+
+    if args.save:
+        results = _benchutil.new_results(result_dict)
+        results["cmd_per_sec"] = cmd_per_sec
+        results["latency_ms"] = args.latency_ms
+        results["jitter_ms"] = args.jitter_ms
+        _benchutil.save_results(args.save, results)
+
+
+def load_client_module():
+    # The client script name is not a valid module name.
+    spec = importlib.util.spec_from_file_location("uwatch2_client", CLIENT_PATH)
+    client = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(client)
+    return client
+
+
+def get_percentiles(sample_list):
+    """
+    Returns:
+        3-tup: p50, p95, p99
+    """
+    if len(sample_list) < 2:
+        return (sample_list[0],) * 3
+    q = statistics.quantiles(sample_list, n=100, method="inclusive")
+    return q[49], q[94], q[98]
+
+
+def measure_cold_start(count):
+    """Time complete runs of uwatch2-client.py against the simulated watch.
+
+    Returns:
+        list of float: Seconds for each run.
+    """
+    arg_list = [
+        sys.executable,
+        CLIENT_PATH,
+        "--backend",
+        "sim",
+        "--mac",
+        _uwatch2sim.SIM_MAC_ADDR,
+        "get-steps-goal",
+    ]
+    sec_list = []
+    for _ in range(count):
+        start_time = time.monotonic()
+        subprocess.run(
+            arg_list, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        sec_list.append(time.monotonic() - start_time)
+    return sec_list
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+"""Cost per heart rate sample, of a heart rate session and of polling.
+
+Collects heart rates from the simulated watch for a fixed time, at one measurement
+per interval, and reports the packets and CPU time of this process per sample, where
+a packet is an ATT write or a notification. The CPU time includes the threads of the
+simulated watch, so packets per sample is the figure that carries over to a watch.
+
+Methods:
+
+    poll: get_heart_rate() once per interval. Each poll is a write and a 73 byte
+      response.
+    session: start_heart_rate_session(), with the samples streamed by the watch.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import _benchutil
+import _uwatch2sim
+import uwatch2lib
+
+METHOD_LIST = ["poll", "session"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--methods",
+        default=",".join(METHOD_LIST),
+        help=f"Comma separated list of methods to run. One or more of: "
+        f"{', '.join(METHOD_LIST)}",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=0.05,
+        metavar="sec",
+        help="Time between heart rate measurements",
+    )
+    parser.add_argument(
+        "--duration", type=float, default=5.0, metavar="sec", help="Time per method"
+    )
+    parser.add_argument("--save", metavar="path", help="Save results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)-8s %(message)s")
+
+    result_dict = {}
+    print(
+        f"{'method':<14} {'samples':>8} {'packets':>8} {'packets/sample':>15} "
+        f"{'cpu us/sample':>14}"
+    )
+    for method_str in args.methods.split(","):
+        if method_str not in METHOD_LIST:
+            parser.error(f"Unknown method: {method_str}")
+        stats_dict = run_method(method_str, args.interval, args.duration)
+        sample_count = max(stats_dict["sample_count"], 1)
+        print(
+            f"{method_str:<14} {stats_dict['sample_count']:>8} "
+            f"{stats_dict['packet_count']:>8} "
+            f"{stats_dict['packet_count'] / sample_count:>15.2f} "
+            f"{stats_dict['cpu_sec'] / sample_count * 1e6:>14.1f}"
+        )
+        result_dict[method_str] = {
+            "ns_per_call": stats_dict["cpu_sec"] / sample_count * 1e9,
+            "packets_per_sample": stats_dict["packet_count"] / sample_count,
+        }
+
+    if args.save:
+        _benchutil.save_results(args.save, _benchutil.new_results(result_dict))
+
+
+def run_method(method_str, interval_sec, duration_sec):
+    watch = _uwatch2sim.SimWatch(heart_rate_interval_sec=interval_sec)
+    with uwatch2lib.Uwatch2(
+        mac_addr=_uwatch2sim.SIM_MAC_ADDR, adapter=_uwatch2sim.SimAdapter(watch)
+    ) as uwatch2:
+        # Warm up, and get the counters at the start of the run.
+        uwatch2.get_steps_goal()
+        start_packet_count = get_packet_count(uwatch2)
+        start_cpu_sec = time.process_time()
+        if method_str == "poll":
+            sample_count = run_poll(uwatch2, interval_sec, duration_sec)
+        else:
+            session = uwatch2.start_heart_rate_session()
+            threading.Event().wait(duration_sec)
+            session.stop()
+            sample_count = session.get_stats()["sample_count"]
+        cpu_sec = time.process_time() - start_cpu_sec
+        packet_count = get_packet_count(uwatch2) - start_packet_count
+    return {
+        "sample_count": sample_count,
+        "packet_count": packet_count,
+        "cpu_sec": cpu_sec,
+    }
+
+
+def run_poll(uwatch2, interval_sec, duration_sec):
+    sample_count = 0
+    end_time = time.monotonic() + duration_sec
+    next_time = time.monotonic()
+    while next_time < end_time:
+        uwatch2.get_heart_rate()
+        sample_count += 1
+        next_time += interval_sec
+        time.sleep(max(0.0, next_time - time.monotonic()))
+    return sample_count
+
+
+def get_packet_count(uwatch2):
+    """Get the number of ATT writes and notifications so far."""
+    metrics_dict = uwatch2.get_metrics()
+    return sum(
+        sample_dict["value"]
+        for name in ("command_chunks_total", "notifications_total")
+        for sample_dict in metrics_dict.get(name, [])
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""Micro-benchmarks for the framing, reassembly and codec hot paths.
+
+Each benchmark times a single call into the library, without a watch. Results can be
+saved as JSON and compared against a previously saved baseline:
+
+    bench_micro.py --save baseline.json
+    (make changes)
+    bench_micro.py --baseline baseline.json
+
+The exit status is 1 if any benchmark is slower than the baseline by more than
+--threshold.
+"""
+import argparse
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import _benchutil
+import _uwatch2sim
+import uwatch2lib
+
+# 73 byte heart rate block as returned by get_heart_rate()
+HEART_RATE_TUP = (
+    (0, 0, 0, 0, 120, 0, 0, 0, 0, 0, 58)
+    + (0, 0, 0, 0, 0, 72) * 10
+    + (0, 0)
+)
+ALARM_BYTES = bytes(
+    [0, 1, 0, 7, 30, 0, 0, 0x1F, 1, 0, 0, 8, 0, 0, 0, 0x60, 2, 1, 0, 21, 15, 0, 0, 0x7F]
+)
+# Message that must be split into several packets, with a multibyte character at the
+# split point.
+MESSAGE_BYTES = ("x" * 248 + "æøå" * 100).encode("utf-8")
+
+
+class NullDevice(object):
+    """Device that accepts writes without doing anything."""
+
+    def char_write(self, char_uuid, value, wait_for_response=True):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--save", metavar="path", help="Save results as JSON")
+    parser.add_argument(
+        "--baseline", metavar="path", help="Compare against saved results"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=_benchutil.DEFAULT_THRESHOLD,
+        help="Relative slowdown reported as a regression",
+    )
+    parser.add_argument(
+        "--filter", default="", help="Only run benchmarks with names containing this"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)-8s %(message)s")
+
+    uwatch2 = uwatch2lib.Uwatch2(adapter=_uwatch2sim.SimAdapter())
+    uwatch2._device = NullDevice()
+    uwatch2._is_connected = True
+
+    result_dict = {}
+    for name, func in get_benchmark_list(uwatch2):
+        if args.filter not in name:
+            continue
+        result_dict[name] = _benchutil.time_func(func)
+        print(f"{name:<36} {result_dict[name]['ns_per_call']:>12.0f} ns")
+
+    results = _benchutil.new_results(result_dict)
+    if args.save:
+        _benchutil.save_results(args.save, results)
+    if args.baseline:
+        baseline = _benchutil.load_results(args.baseline)
+        line_list, regression_list = _benchutil.compare_results(
+            result_dict, baseline["result_dict"], args.threshold
+        )
+        print()
+        print("\n".join(line_list))
+        if regression_list:
+            sys.exit(1)
+
+
+def get_benchmark_list(uwatch2):
+    """
+    Returns:
+        list of 2-tup: (name, function that takes no arguments)
+    """
+    small_payload_bytes = bytes([0x21])
+    large_payload_bytes = bytes([0x41, 200]) + bytes(200)
+    response_pkg_bytes = (
+        uwatch2._gen_header(bytes(74)) + bytes([0x35]) + bytes(HEART_RATE_TUP)
+    )
+    response_chunk_list = [
+        response_pkg_bytes[i : i + 20] for i in range(0, len(response_pkg_bytes), 20)
+    ]
+
+    short_chunk_list = [uwatch2._gen_header(bytes(5)) + bytes([0x35, 1, 2, 3, 4])]
+
+    def handle_async_response(chunk_list):
+        for chunk_bytes in chunk_list:
+            uwatch2._handle_async_response(0x35, bytearray(chunk_bytes))
+
+    uwatch2._get_raw_cmd = lambda *arg_tup, **kwarg_dict: ALARM_BYTES
+
+    return [
+        ("gen_header", lambda: uwatch2._gen_header(large_payload_bytes)),
+        ("send_packet_1_chunk", lambda: uwatch2._send_packet(small_payload_bytes)),
+        ("send_packet_11_chunks", lambda: uwatch2._send_packet(large_payload_bytes)),
+        ("split_utf8", lambda: uwatch2._split_utf8(MESSAGE_BYTES, 255 - 4 - 2)),
+        (
+            "handle_async_response_1_chunk",
+            lambda: handle_async_response(short_chunk_list),
+        ),
+        (
+            "handle_async_response_4_chunks",
+            lambda: handle_async_response(response_chunk_list),
+        ),
+        (
+            "unpack_payload_bytes",
+            lambda: uwatch2.unpack_payload_bytes(bytes(HEART_RATE_TUP), "73B"),
+        ),
+        ("parse_heart_rate", lambda: uwatch2._parse_heart_rate(HEART_RATE_TUP)),
+        ("get_alarm_tup", uwatch2.get_alarm_tup),
+        (
+            "make_alarm_repeat_days_int",
+            lambda: uwatch2._make_alarm_repeat_days_int(("mon", "Wed", "FRI", "sun")),
+        ),
+    ]
+
+
+if __name__ == "__main__":
+    main()
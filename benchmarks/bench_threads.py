@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""Stress benchmark for issuing commands from many threads.
+
+Runs queries against a simulated watch from an increasing number of caller threads,
+and reports latency per call and total throughput for each thread count.
+
+With distinct queries, commands are serialized on the link, so latency per call grows
+linearly with the number of threads while throughput stays flat. With identical
+queries, concurrent calls share a single command, so latency stays flat while
+throughput grows with the number of threads.
+"""
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import _uwatch2sim
+import uwatch2lib
+
+# Queries that are issued round-robin by each thread when not using --same-query.
+QUERY_LIST = [
+    "get_steps_goal",
+    "get_time_format",
+    "get_user_info",
+    "get_quick_view",
+    "get_metric_system",
+    "get_dnd_period",
+    "get_breathing_light",
+    "get_watch_face",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--threads",
+        default="1,2,4,8,16,32",
+        help="Comma separated list of caller thread counts",
+    )
+    parser.add_argument(
+        "--calls", type=int, default=50, help="Calls per thread for each thread count"
+    )
+    parser.add_argument(
+        "--latency-ms", type=float, default=2.0, help="Simulated one-way link latency"
+    )
+    parser.add_argument(
+        "--jitter-ms", type=float, default=0.0, help="Simulated link jitter"
+    )
+    parser.add_argument(
+        "--same-query",
+        action="store_true",
+        help="All threads issue the same query (exercises single-flight sharing)",
+    )
+    parser.add_argument(
+        "--no-io-thread",
+        action="store_true",
+        help="Serialize with the command lock only, without the dedicated I/O thread",
+    )
+    parser.add_argument(
+        "--caps",
+        metavar="path",
+        help="Probe or load the capabilities of the watch on connect, with the cache "
+        "in this file. Checks that startup queries work with the I/O thread",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)-8s %(message)s")
+
+    adapter = _uwatch2sim.SimAdapter(
+        link_latency_sec=args.latency_ms / 1000, link_jitter_sec=args.jitter_ms / 1000
+    )
+    with uwatch2lib.Uwatch2(
+        adapter=adapter, io_thread=not args.no_io_thread, caps_path=args.caps
+    ) as uwatch2:
+        print(
+            f"{'threads':>8} {'calls':>7} {'p50 ms':>8} {'p95 ms':>8} "
+            f"{'max ms':>8} {'calls/s':>9} {'shared':>7}"
+        )
+        for thread_count in map(int, args.threads.split(",")):
+            run_threads(uwatch2, thread_count, args.calls, args.same_query)
+
+
+def run_threads(uwatch2, thread_count, call_count, same_query):
+    latency_list = []
+    error_list = []
+    list_lock = threading.Lock()
+    start_barrier = threading.Barrier(thread_count)
+    saved_before_count = uwatch2.get_single_flight_saved_count()
+
+    def run(thread_idx):
+        thread_latency_list = []
+        start_barrier.wait()
+        for call_idx in range(call_count):
+            if same_query:
+                query_str = QUERY_LIST[0]
+            else:
+                query_str = QUERY_LIST[(thread_idx + call_idx) % len(QUERY_LIST)]
+            start_time = time.perf_counter()
+            try:
+                getattr(uwatch2, query_str)()
+            except uwatch2lib.WatchError as e:
+                with list_lock:
+                    error_list.append(e)
+                continue
+            thread_latency_list.append(time.perf_counter() - start_time)
+        with list_lock:
+            latency_list.extend(thread_latency_list)
+
+    thread_list = [
+        threading.Thread(target=run, args=(i,)) for i in range(thread_count)
+    ]
+    start_time = time.perf_counter()
+    for thread in thread_list:
+        thread.start()
+    for thread in thread_list:
+        thread.join()
+    elapsed_sec = time.perf_counter() - start_time
+
+    latency_list.sort()
+    p95_idx = min(len(latency_list) - 1, int(len(latency_list) * 0.95))
+    print(
+        f"{thread_count:>8} {len(latency_list):>7} "
+        f"{statistics.median(latency_list) * 1000:>8.2f} "
+        f"{latency_list[p95_idx] * 1000:>8.2f} "
+        f"{latency_list[-1] * 1000:>8.2f} "
+        f"{len(latency_list) / elapsed_sec:>9.1f} "
+        f"{uwatch2.get_single_flight_saved_count() - saved_before_count:>7}"
+    )
+    for e in error_list:
+        print(f"  error: {e}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
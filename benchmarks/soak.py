@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+
+"""Soak test over a degraded link to a simulated watch.
+
+Drives a long series of queries through _uwatch2faults.FaultAdapter, which drops,
+duplicates, reorders, splits and merges notifications and disconnects the link on a
+schedule. Each response is checked against the value returned over a clean link, so
+corrupted reassembly shows up as wrong results rather than passing silently.
+
+Reports progress at intervals, and at the end: throughput, outcome counts, stalls
+(commands slower than --stall-ms), the faults that were injected, and memory growth
+as measured by tracemalloc, not counting the simulated watch.
+"""
+import argparse
+import collections
+import gc
+import logging
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import _uwatch2faults
+import _uwatch2sim
+import uwatch2lib
+
+# Stack depth recorded for each allocation. Must be deep enough to attribute the
+# allocations of the simulated watch, which are made on the link thread.
+TRACEMALLOC_FRAME_COUNT = 8
+
+# Queries with distinct cmd_keys and fixed responses from the simulated watch.
+QUERY_LIST = [
+    "get_user_info",
+    "get_steps_goal",
+    "get_quick_view",
+    "get_heart_rate",
+    "get_alarm_tup",
+    "get_time_format",
+    "get_metric_system",
+    "get_dnd_period",
+    "get_watch_face",
+    "get_sedentary_reminder_period",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--commands", type=int, default=5000, help="Number of commands to run"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        metavar="sec",
+        help="Stop after this many seconds, even if not all commands have run",
+    )
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--jitter-ms", type=float, default=2.0)
+    parser.add_argument("--drop", type=float, default=0.01, help="Drop rate")
+    parser.add_argument("--duplicate", type=float, default=0.01, help="Duplicate rate")
+    parser.add_argument("--reorder", type=float, default=0.01, help="Reorder rate")
+    parser.add_argument("--split", type=float, default=0.02, help="Split rate")
+    parser.add_argument("--merge", type=float, default=0.02, help="Merge rate")
+    parser.add_argument(
+        "--disconnect-interval",
+        type=float,
+        default=10.0,
+        metavar="sec",
+        help="Mean time between forced disconnects. 0 disables",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=0.5, help="Command timeout in seconds"
+    )
+    parser.add_argument(
+        "--stall-ms",
+        type=float,
+        default=250.0,
+        help="Commands slower than this are reported as stalls",
+    )
+    parser.add_argument(
+        "--error-backoff-ms",
+        type=float,
+        default=50.0,
+        help="Wait after a command fails with an error, such as while disconnected",
+    )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        default=5.0,
+        metavar="sec",
+        help="Time between progress reports",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for faults")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format="%(levelname)-8s %(message)s")
+
+    expected_dict = get_expected_responses()
+
+    adapter = _uwatch2faults.FaultAdapter(
+        _uwatch2sim.SimAdapter(),
+        latency_sec=args.latency_ms / 1000,
+        jitter_sec=args.jitter_ms / 1000,
+        drop_rate=args.drop,
+        duplicate_rate=args.duplicate,
+        reorder_rate=args.reorder,
+        split_rate=args.split,
+        merge_rate=args.merge,
+        disconnect_interval_sec=args.disconnect_interval or None,
+        seed=args.seed,
+    )
+    outcome_counter = collections.Counter()
+    stall_list = []
+    tracemalloc.start(TRACEMALLOC_FRAME_COUNT)
+    with uwatch2lib.Uwatch2(
+        mac_addr=_uwatch2sim.SIM_MAC_ADDR,
+        adapter=adapter,
+        command_timeout_sec=args.timeout,
+    ) as uwatch2:
+        start_mem_bytes = get_library_memory()
+        start_time = time.monotonic()
+        next_report_time = start_time + args.report_interval
+        for i in range(args.commands):
+            now = time.monotonic()
+            if args.duration and now - start_time >= args.duration:
+                break
+            if now >= next_report_time:
+                report_progress(i, now - start_time, outcome_counter, start_mem_bytes)
+                next_report_time += args.report_interval
+            query_str = QUERY_LIST[i % len(QUERY_LIST)]
+            cmd_start_time = time.monotonic()
+            outcome_str = run_query(uwatch2, query_str, expected_dict)
+            outcome_counter[outcome_str] += 1
+            latency_sec = time.monotonic() - cmd_start_time
+            if latency_sec * 1000 > args.stall_ms:
+                stall_list.append(latency_sec)
+            if outcome_str.startswith("error:"):
+                time.sleep(args.error_backoff_ms / 1000)
+        elapsed_sec = time.monotonic() - start_time
+        end_mem_bytes = get_library_memory()
+        metrics_dict = uwatch2.get_metrics()
+    peak_mem_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    command_count = sum(outcome_counter.values())
+    print()
+    print(f"Commands:    {command_count} in {elapsed_sec:.1f} s")
+    print(f"Throughput:  {command_count / elapsed_sec:.1f} commands/s")
+    for outcome_str, count in sorted(outcome_counter.items()):
+        print(f"  {outcome_str:<24} {count:>8} {count / command_count:>8.2%}")
+    print(
+        f"Stalls:      {len(stall_list)}"
+        + (f", longest {max(stall_list) * 1000:.0f} ms" if stall_list else "")
+    )
+    print("Injected faults:")
+    for fault_str, count in adapter.get_stats().items():
+        print(f"  {fault_str:<24} {count:>8}")
+    print(f"Reconnects:  {sum_metric(metrics_dict, 'reconnects_total')}")
+    print(
+        f"Discarded:   "
+        f"{sum_metric(metrics_dict, 'reassembly_discarded_bytes_total')} bytes"
+    )
+    print(
+        f"Memory:      {(end_mem_bytes - start_mem_bytes) / 1024:+.1f} KiB, "
+        f"peak {peak_mem_bytes / 1024:.1f} KiB"
+    )
+
+
+def get_expected_responses():
+    """Get the response to each query over a clean link."""
+    with uwatch2lib.Uwatch2(
+        mac_addr=_uwatch2sim.SIM_MAC_ADDR, adapter=_uwatch2sim.SimAdapter()
+    ) as uwatch2:
+        return {
+            query_str: getattr(uwatch2, query_str)() for query_str in QUERY_LIST
+        }
+
+
+def run_query(uwatch2, query_str, expected_dict):
+    """
+    Returns:
+        str: Outcome
+    """
+    try:
+        result = getattr(uwatch2, query_str)()
+    except uwatch2lib.WatchTimeoutError:
+        return "timeout"
+    except Exception as e:
+        return f"error:{e.__class__.__name__}"
+    if result != expected_dict[query_str]:
+        return "wrong_result"
+    return "ok"
+
+
+def report_progress(command_count, elapsed_sec, outcome_counter, start_mem_bytes):
+    mem_bytes = get_library_memory()
+    print(
+        f"{elapsed_sec:>7.1f} s {command_count:>8} commands "
+        f"{command_count / elapsed_sec:>8.1f}/s "
+        f"ok={outcome_counter['ok']} "
+        f"timeout={outcome_counter['timeout']} "
+        f"wrong={outcome_counter['wrong_result']} "
+        f"mem={(mem_bytes - start_mem_bytes) / 1024:+.1f} KiB"
+    )
+
+
+def get_library_memory():
+    """Get the number of bytes currently allocated, not including allocations by the
+    simulated watch, which keeps a log of all packets it receives.
+
+    Garbage is collected first, so that only memory that is still reachable counts.
+    """
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, _uwatch2sim.__file__, all_frames=True),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ]
+    )
+    return sum(stat.size for stat in snapshot.statistics("filename"))
+
+
+def sum_metric(metrics_dict, name):
+    return sum(sample_dict["value"] for sample_dict in metrics_dict.get(name, []))
+
+
+if __name__ == "__main__":
+    main()
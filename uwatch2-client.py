@@ -4,10 +4,15 @@
 """
 import argparse
 import inspect
+import json
 import logging
 import re
 import sys
 
+import _uwatch2connparams
+import _uwatch2dbus
+import _uwatch2sim
+import _uwatch2trace
 import uwatch2lib
 
 SUN, MON, TUE, WED, THU, FRI, SAT = range(7)
@@ -21,8 +26,19 @@ log.setLevel(0)
 SKIP_COMMAND_LIST = [
     "get_alarm_tup",
     "set_alarm_tup",
+    # Experimental, see uwatch2lib
+    "start_watch_face_file_transfer",
+    "start_watch_face_upload",
+    "ui_file_transfer",
+    "upload_watch_face",
+    "start_heart_rate_session",
+    # Take lists of forecasts or encoded packets
+    "set_future_weather",
+    "set_weather_payloads",
 ]
 
+BACKEND_LIST = ["gatttool", "dbus", "sim"]
+
 
 def main():
     parser = argparse.ArgumentParser()
@@ -32,6 +48,59 @@ def main():
         "--mac", metavar="11:22:33:44:55:66", help="Connect by MAC address"
     )
     ex_group.add_argument("--name", dest="watch_name", help="Connect by watch name")
+    parser.add_argument(
+        "--backend",
+        choices=BACKEND_LIST,
+        default="gatttool",
+        help="BLE backend. dbus talks to BlueZ directly and requires jeepney. sim "
+        "connects to a simulated watch, for testing",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="sec",
+        help="Max time to wait for the watch to respond to a command",
+    )
+    parser.add_argument(
+        "--connection-profile",
+        choices=list(_uwatch2connparams.PROFILE_DICT),
+        help="LE connection parameter profile. Default: Leave the parameters as "
+        "negotiated by the backend",
+    )
+    parser.add_argument(
+        "--caps",
+        metavar="path",
+        help="Probe which queries the watch supports, and cache the results in this "
+        "file. Unsupported queries then fail immediately",
+    )
+    parser.add_argument(
+        "--journal",
+        metavar="path",
+        help="Queue write commands in this file while the watch is disconnected",
+    )
+    parser.add_argument(
+        "--capture",
+        metavar="path",
+        help="Write all traffic to and from the watch to a trace file for replay",
+    )
+    parser.add_argument(
+        "--coalesce",
+        action="store_true",
+        help="Send consecutive write commands back to back in shared ATT writes",
+    )
+    parser.add_argument(
+        "--metrics",
+        action="store_true",
+        help="Print performance metrics in Prometheus text format before exiting",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        nargs="?",
+        const="",
+        metavar="jsonl-path",
+        help="Show time spent in each phase of connecting to the watch, with cProfile "
+        "stats. If a path is provided, also append the results to it as a JSON line",
+    )
     parser.add_argument(
         "command_list",
         metavar="command",
@@ -50,13 +119,31 @@ def main():
 
     try:
         with uwatch2lib.Uwatch2(
-            mac_addr=args.mac, scan_for_name=args.watch_name
+            mac_addr=args.mac,
+            scan_for_name=args.watch_name,
+            command_timeout_sec=args.timeout,
+            journal_path=args.journal,
+            adapter=create_adapter(args.backend),
+            profile_startup=args.profile_startup is not None,
+            connection_profile=args.connection_profile,
+            caps_path=args.caps,
         ) as uwatch2:
+            if args.profile_startup is not None:
+                report_startup_profile(uwatch2, args.profile_startup)
+            if args.debug:
+                uwatch2.add_tracer(_uwatch2trace.LoggingTracer())
+            if args.capture:
+                uwatch2.start_capture(args.capture)
             command_interface = CommandInterface(uwatch2, args.debug)
-            if args.command_list:
+            if args.command_list and args.coalesce:
+                with uwatch2.coalesce_writes():
+                    command_interface.run_commands(args.command_list)
+            elif args.command_list:
                 command_interface.run_commands(args.command_list)
             else:
                 command_interface.run_interactive()
+            if args.metrics:
+                print(uwatch2.get_metrics_prometheus(), end="")
     except Exception as e:
         if args.debug:
             log.exception("")
@@ -68,6 +155,31 @@ def main():
     return ret
 
 
+def create_adapter(backend_str):
+    """Create the pygatt style backend adapter selected with --backend.
+
+    Returns:
+        Adapter, or None for the default gatttool backend.
+    """
+    if backend_str == "sim":
+        return _uwatch2sim.SimAdapter()
+    if backend_str == "dbus":
+        return _uwatch2dbus.DbusAdapter()
+    return None
+
+
+def report_startup_profile(uwatch2, jsonl_path):
+    log.info("Startup phases:")
+    for line in uwatch2.format_startup_profile():
+        log.info(f"  {line}")
+    profile_dict = uwatch2.get_startup_profile()
+    for line in profile_dict["cprofile_str"].splitlines():
+        log.info(line)
+    if jsonl_path:
+        with open(jsonl_path, "a") as f:
+            f.write(json.dumps(profile_dict) + "\n")
+
+
 class CommandInterface(object):
     def __init__(self, uwatch2, debug=False):
         self._debug = debug
@@ -114,13 +226,7 @@ class CommandInterface(object):
 
     def list_commands(self):
         """List all commands"""
-        for member_name, member_obj in inspect.getmembers(uwatch2lib.Uwatch2):
-            if not re.match(r"[a-z]", member_name):
-                continue
-            if not inspect.isfunction(member_obj):
-                continue
-            if member_name in SKIP_COMMAND_LIST:
-                continue
+        for member_name, member_obj in get_command_list():
             arg_list = inspect.getfullargspec(member_obj).args
             command_str = " ".join(
                 v.replace("_", "-") for v in (member_name, *arg_list[1:])
@@ -129,14 +235,14 @@ class CommandInterface(object):
 
     def display_help(self, command_name):
         """Display help for a command."""
-        for member_name, member_obj in inspect.getmembers(uwatch2lib.Uwatch2):
+        for member_name, member_obj in get_command_list():
             if member_name == command_name.replace("-", "_"):
                 log.info(inspect.getdoc(member_obj))
 
     def call_command(self, command_name, *arg_tup):
         command_name = command_name.replace("-", "_")
         arg_tup = tuple(int(v) if v.isdecimal() else v for v in arg_tup)
-        for member_name, member_obj in inspect.getmembers(uwatch2lib.Uwatch2):
+        for member_name, member_obj in get_command_list():
             if member_name == command_name:
                 try:
                     res = member_obj(self._uwatch2, *arg_tup)
@@ -170,5 +276,21 @@ class CommandInterface(object):
             log.info(res)
 
 
+def get_command_list():
+    """Get the watch commands, as (name, function) tuples sorted by name.
+
+    Only the methods defined in uwatch2lib.Uwatch2 itself are watch commands. The
+    methods it inherits from the BLE layer, such as tracing, metrics and capture, are
+    library API, and are not available as commands.
+    """
+    return [
+        (member_name, member_obj)
+        for member_name, member_obj in sorted(vars(uwatch2lib.Uwatch2).items())
+        if re.match(r"[a-z]", member_name)
+        and inspect.isfunction(member_obj)
+        and member_name not in SKIP_COMMAND_LIST
+    ]
+
+
 if __name__ == "__main__":
     sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+"""Sweep a range of cmd_keys on a uwatch2 watch and record which ones respond.
+
+Results are appended to a table file. Probes that are already in the table are
+skipped, so an interrupted sweep can be resumed by running the same command again.
+
+Example:
+
+    $ ./uwatch2-discover.py --range 0x00-0xff --args "" --args ff
+
+cmd_keys that are known to change the state of the watch, such as shutdown (0x51),
+are not probed unless allowed with --allow. Probing unknown cmd_keys may still change
+settings on the watch.
+"""
+import argparse
+import logging
+import sys
+
+import _uwatch2discover
+import _uwatch2dbus
+import _uwatch2sim
+import uwatch2lib
+
+log = logging.getLogger(__name__)
+
+BACKEND_LIST = ["gatttool", "dbus", "sim"]
+DEFAULT_TABLE_PATH = "uwatch2-discover.jsonl"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--debug", action="store_true", help="Debug level logging")
+    parser.add_argument("--mac", help="Connect by MAC address")
+    parser.add_argument(
+        "--backend", choices=BACKEND_LIST, default="gatttool", help="BLE backend"
+    )
+    parser.add_argument(
+        "--table",
+        metavar="path",
+        default=DEFAULT_TABLE_PATH,
+        help="Table of results. Probes already in the table are skipped",
+    )
+    parser.add_argument(
+        "--range",
+        dest="range_str",
+        metavar="first-last",
+        default="0x00-0xff",
+        help="Range of cmd_keys to sweep, inclusive",
+    )
+    parser.add_argument(
+        "--args",
+        dest="template_list",
+        metavar="hex",
+        action="append",
+        help="Argument bytes to send with each cmd_key, as hex. May be repeated. "
+        "Default: No arguments",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=_uwatch2discover.DEFAULT_WINDOW_SIZE,
+        help="Max number of probes in flight",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="sec",
+        default=_uwatch2discover.DEFAULT_TIMEOUT_SEC,
+        help="Time to wait for the response to a probe",
+    )
+    parser.add_argument(
+        "--allow",
+        metavar="cmd_key",
+        action="append",
+        default=[],
+        help="Probe a cmd_key on the denylist. May be repeated",
+    )
+    parser.add_argument(
+        "--deny",
+        metavar="cmd_key",
+        action="append",
+        default=[],
+        help="Do not probe a cmd_key. May be repeated",
+    )
+    parser.add_argument(
+        "--retry-timeouts",
+        action="store_true",
+        help="Probe again where the table has a timeout",
+    )
+    parser.add_argument(
+        "--show",
+        action="store_true",
+        help="Print the responses in the table and exit, without connecting",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.INFO,
+        format="%(levelname)-8s %(message)s",
+    )
+
+    table = _uwatch2discover.DiscoveryTable(args.table)
+    if args.show:
+        print_table(table)
+        return 0
+
+    try:
+        first_str, last_str = args.range_str.split("-")
+        cmd_key_list = list(range(int(first_str, 0), int(last_str, 0) + 1))
+        template_list = [bytes.fromhex(s) for s in args.template_list or [""]]
+        allow_set = {int(s, 0) for s in args.allow}
+        deny_set = {int(s, 0) for s in args.deny}
+    except ValueError as e:
+        parser.error(str(e))
+    if not all(0 <= k <= 0xFF for k in cmd_key_list) or not cmd_key_list:
+        parser.error(f"Invalid range: {args.range_str}")
+
+    deny_dict = {
+        k: v
+        for k, v in _uwatch2discover.DEFAULT_DENY_DICT.items()
+        if k not in allow_set
+    }
+    deny_dict.update({k: "Denied with --deny" for k in deny_set})
+
+    with uwatch2lib.Uwatch2(
+        mac_addr=args.mac, adapter=create_adapter(args.backend)
+    ) as uwatch2:
+        sweep = _uwatch2discover.ProtocolSweep(
+            uwatch2,
+            table,
+            template_list,
+            window_size=args.window,
+            timeout_sec=args.timeout,
+            deny_dict=deny_dict,
+            retry_timeouts=args.retry_timeouts,
+            progress_callback=report_progress,
+        )
+        stats_dict = sweep.run(cmd_key_list)
+
+    log.info(
+        f"Probed {stats_dict['probed']} in {stats_dict['elapsed_sec']:.1f} sec: "
+        f"{stats_dict['response']} responses, {stats_dict['timeout']} timeouts, "
+        f"{stats_dict['unsolicited']} unsolicited. Skipped {stats_dict['skipped']} "
+        f"already in table, {stats_dict['denied']} denied"
+    )
+    return 0
+
+
+def create_adapter(backend_str):
+    if backend_str == "sim":
+        return _uwatch2sim.SimAdapter()
+    if backend_str == "dbus":
+        return _uwatch2dbus.DbusAdapter()
+    return None
+
+
+def report_progress(cmd_key, args_bytes, status):
+    if status == _uwatch2discover.TIMEOUT:
+        log.debug(f"0x{cmd_key:02x} {args_bytes.hex():<8} {status}")
+    else:
+        args_str = "-" if args_bytes is None else args_bytes.hex()
+        log.info(f"0x{cmd_key:02x} {args_str:<8} {status}")
+
+
+def print_table(table):
+    print(f"{'cmd_key':<8} {'args':<10} {'latency':>8}  payload")
+    for record_dict in table.get_record_list():
+        if record_dict["status"] != _uwatch2discover.RESPONSE:
+            continue
+        print(
+            f"{record_dict['cmd_key']:<8} {record_dict['args'] or '-':<10} "
+            f"{record_dict['latency_ms']:>6.1f}ms  {record_dict['payload']}"
+        )
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,15 +7,23 @@ import logging
 import pprint
 
 import pytz
-import tzlocal
 
 import _uwatch2ble
+import _uwatch2caps
+import _uwatch2hr
+import _uwatch2timesync
+import _uwatch2trace
+import _uwatch2upload
+import _uwatch2weather
 
 log = logging.getLogger(__name__)
 
 
 WatchError = _uwatch2ble.WatchError
 WatchBleScanError = _uwatch2ble.WatchBleScanError
+WatchTimeoutError = _uwatch2ble.WatchTimeoutError
+WatchCancelledError = _uwatch2ble.WatchCancelledError
+WatchUnsupportedError = _uwatch2ble.WatchUnsupportedError
 
 DAYS_TUP = "Sun", "Mon", "Tue", "Wed", "Thu", "Fri", "Sat"
 # SUN, MON, TUE, WED, THU, FRI, SAT = range(7)
@@ -30,6 +38,16 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
         squelch_pygatt=True,
         scan_as_root=False,
         scan_for_name="Uwatch2",
+        command_timeout_sec=None,
+        journal_path=None,
+        adapter=None,
+        io_thread=False,
+        notification_policy_dict=None,
+        profile_startup=False,
+        handler_pool=None,
+        connection_profile=None,
+        caps_path=None,
+        snapshot_cache_path=None,
     ):
         super().__init__(
             mac_addr,
@@ -38,6 +56,16 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
             squelch_pygatt,
             scan_as_root,
             scan_for_name,
+            command_timeout_sec,
+            journal_path,
+            adapter,
+            io_thread,
+            notification_policy_dict,
+            profile_startup,
+            handler_pool,
+            connection_profile,
+            caps_path,
+            snapshot_cache_path,
         )
 
     def send_message(self, msg_str):
@@ -57,8 +85,7 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
             msg1_bytes, msg2_bytes = self._split_utf8(msg_bytes, 255 - 4 - 2)
             msg1_str = msg1_bytes.decode("utf-8")
             log.info(f"Sending message: {msg1_str}")
-            print(len(msg1_bytes), msg1_bytes)
-            self._send_packet(bytes([0x41, len(msg1_bytes)]) + msg1_bytes)
+            self._send_write_packet(bytes([0x41, len(msg1_bytes)]) + msg1_bytes)
             if msg2_bytes is None:
                 break
             msg_bytes = msg2_bytes
@@ -215,14 +242,17 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
     #     tested_and_working: False
     # """
     #     return self._send_raw_cmd(0x1E, "B", "version", None)
-    #
-    # def get_device_version(self, args=None):
-    #     """Get device version
-    #     Args None
-    #     Returns ?
-    #     tested_and_working: False
-    # """
-    #     return self._send_raw_cmd(0x2E, None, None, "B")
+
+    def get_device_version(self):
+        """Get device version
+
+        Returns:
+            str: Firmware version string reported by the watch. The format has not
+            been confirmed against a watch.
+        """
+        return _uwatch2caps.decode_version(
+            self._get_raw_cmd(_uwatch2caps.DEVICE_VERSION, None, None)
+        )
 
     def shutdown(self):
         """Shutdown
@@ -317,22 +347,65 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
             tuple(v for v in t if v),
         )
 
-    # def get_heart_rate(self, args="B"):
-    #     """Get heart rate
-    #     Args byte
-    #     Returns Returns nothing with or without sending a byte arg
-    #     tested_and_working: False
-    # """
-    #     return self._send_raw_cmd(0x36, "B", "byte", None)
-    #
-    # def get_movement_heart_rate(self, args=None):
-    #     """Get movement heart rate
-    #     Args ?
-    #     Returns ?
-    #     tested_and_working: False
-    # """
-    #     return self._send_raw_cmd(0x37, None, "?", "60 bytes")
-    #
+    # The layouts of 0x36 and 0x37 are inferred. See _uwatch2hr.py.
+
+    def measure_heart_rate(self, enable_bool):
+        """Start or stop continuous heart rate measurement
+
+        While measurement is running, the watch sends each heart rate as a 0x36 frame.
+        See start_heart_rate_session(). Sent right away, also inside
+        coalesce_writes() blocks, and never queued in the journal.
+
+        Args:
+            enable_bool (bool): True to start, False to stop
+        """
+        return self._send_immediate_cmd(
+            _uwatch2hr.MEASURE_HEART_RATE,
+            "B",
+            _uwatch2hr.MEASURE_START if enable_bool else _uwatch2hr.MEASURE_STOP,
+        )
+
+    def get_movement_heart_rate(self):
+        """Get movement heart rate
+
+        Returns:
+            60-tup of int: Latest heart rates in BPM, oldest first. 0 where there is
+            no measurement.
+        """
+        return self._get_raw_cmd(
+            _uwatch2hr.MOVEMENT_HEART_RATE, None, f"{_uwatch2hr.MOVEMENT_BLOCK_SIZE}B"
+        )
+
+    def start_heart_rate_session(
+        self, block_poll_interval_sec=None, sample_callback=None
+    ):
+        """Start a continuous heart rate session
+
+        Heart rates are collected as the watch sends them, into arrays with
+        timestamps, until the session is stopped. This costs one notification per
+        sample, and no polling.
+
+        Example:
+            session = uwatch2.start_heart_rate_session()
+            ...
+            session.stop()
+            bpm_array = session.get_arrays()["bpm"]
+
+        Args:
+            block_poll_interval_sec (float): If provided, also poll the movement heart
+              rate block at this interval. The blocks are kept whole, see
+              HeartRateSession.get_blocks().
+            sample_callback (callable): Called with (timestamp, bpm) for each sample.
+
+        Returns:
+            _uwatch2hr.HeartRateSession: The running session.
+        """
+        session = _uwatch2hr.HeartRateSession(
+            self, block_poll_interval_sec, sample_callback
+        )
+        session.start()
+        return session
+
     # def ecg_heart_rate_command(self, args=None):
     #     """ECG heart rate command
     #     Args cmd
@@ -514,11 +587,10 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
             )
 
     def _dump_alarm_bytes(self, msg, alarm_list):
-        def f(alarm_idx):
-            i = alarm_idx * 8
-            return " ".join(f"{v: 3d}" for v in alarm_list[i : i + 8])
-
-        log.error(f"{msg}: {f(0)}  {f(1)}  {f(2)}")
+        if self._tracer_list:
+            self._trace(
+                _uwatch2trace.ALARM_BYTES, direction_str=msg, alarm_list=alarm_list
+            )
 
     def _format_alarm(self, alarm_dict):
         """Format alarm for display
@@ -621,7 +693,7 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
             specified). If not provided, the current date and time at UTC is used.
         """
         if now_dt is None:
-            now_dt = datetime.datetime.now(tz=tzlocal.get_localzone())
+            now_dt = datetime.datetime.now(tz=_uwatch2timesync.get_local_zone())
 
         tz_hours, tz_remainder = divmod(now_dt.utcoffset().total_seconds(), (60 * 60))
         if tz_remainder:
@@ -691,22 +763,53 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
 
     # Weather
 
-    # def set_future_weather(self, args=None):
-    #     """Set future weather
-    #     Args 21 bytes from C2439F
-    #     Returns ?
-    #     tested_and_working: False
-    # """
-    #     return self._send_raw_cmd(0x42, None, "21 bytes from C2439F", None)
-    #
-    # def set_today_weather(self, args=None):
-    #     """Set today weather
-    #     Args variable length from C2439F
-    #     Returns ?
-    #     tested_and_working: False
-    # """
-    #     return self._send_raw_cmd(0x43, None, "variable length from C2439F", None)
-    #
+    # The packet layouts are inferred from the command list. See _uwatch2weather.
+
+    def set_future_weather(self, forecast_list):
+        """Set future weather
+
+        Args:
+            forecast_list (list of 3-tup): (condition_int, low_c, high_c) for each of
+              the next 7 days. Temperatures are in degrees Celsius.
+        """
+        return self._send_write_packet(
+            _uwatch2weather.encode_future_weather(forecast_list)
+        )
+
+    def set_today_weather(self, condition_int, temp_c, city_str=""):
+        """Set today weather
+
+        Args:
+            condition_int (int): Weather condition.
+            temp_c (int): Current temperature in degrees Celsius.
+            city_str (str): City name. May contain Unicode characters.
+        """
+        return self._send_write_packet(
+            _uwatch2weather.encode_today_weather(condition_int, temp_c, city_str)
+        )
+
+    def set_weather_payloads(self, payload_list):
+        """Send encoded weather packets back to back
+
+        For _uwatch2weather.WeatherPushService, which caches the encoded packets.
+
+        Args:
+            payload_list (list of bytes): 0x42 and 0x43 payloads, including cmd_key,
+              from _uwatch2weather.
+
+        Returns:
+            list of bytes: The payloads that were queued in the journal instead of
+            sent, because the watch was not available.
+        """
+        for payload_bytes in payload_list:
+            if payload_bytes[:1] not in (b"\x42", b"\x43"):
+                raise _uwatch2ble.WatchError(
+                    f"Not a weather payload: {payload_bytes.hex()}"
+                )
+        # Write commands issued before this one must reach the watch first.
+        self._flush_coalesced_writes()
+        return self._send_write_packet_list(list(payload_list))
+
     # def set_calibrate_gsensor(self, args=None):
     #     """Set calibrate gsensor
     #     Args
@@ -739,14 +842,6 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
     # """
     #     return self._send_raw_cmd(0x68, None, None, None)
     #
-    # def ui_file_transfer(self, args=None):
-    #     """UI file transfer
-    #     Args None
-    #     Returns ?
-    #     tested_and_working: False
-    # """
-    #     return self._send_raw_cmd(0x6C, None, None, None)
-    #
     # def unknown(self, args=None):
     #     """Unknown
     #     Args None
@@ -788,22 +883,6 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
     # """
     #     return self._send_raw_cmd(0x39, None, None, None)
     #
-    # def start_watch_face_upload(self, args=None):
-    #     """Start watch face upload
-    #     Args uint32
-    #     Returns ?
-    #     tested_and_working: False
-    # """
-    #     return self._send_raw_cmd(0x6E, None, "uint32", None)
-    #
-    # def start_watch_face_file_transfer(self, args=None):
-    #     """Start watch face file transfer
-    #     Args uint32 size
-    #     Returns ?
-    #     tested_and_working: False
-    # """
-    #     return self._send_raw_cmd(0x74, None, "uint32 size", None)
-    #
     # def get_supported_watch_face(self, args=None):
     #     """Get supported watch face
     #     Args None
@@ -813,6 +892,72 @@ class Uwatch2(_uwatch2ble.Uwatch2Ble):
     #     return self._send_raw_cmd(0x84, None, None, "B")
     #
 
+    # Watch face upload
+    #
+    # Experimental. The transfer protocol is a guess, and has not been confirmed
+    # against a watch: 0x6E announces the size of the file, 0x74 starts or resumes the
+    # transfer at an offset, the file bytes are written to the data characteristic,
+    # and 0x6C returns the number of bytes the watch has received. The command list
+    # documents the 0x74 argument as "uint32 size", not as an offset. Only the
+    # simulated watch, which implements the same guess, has been tested. These
+    # commands are not offered by the client.
+
+    def upload_watch_face(self, face_path):
+        """Upload a custom watch face image
+
+        Experimental. See the notes above. The upload resumes automatically after a
+        disconnect.
+
+        tested_and_working: False
+
+        Args:
+            face_path (str): Path to watch face image file.
+
+        Returns:
+            dict: dict_keys are byte_count, elapsed_sec, bytes_per_sec, resume_count
+        """
+        return _uwatch2upload.WatchFaceUploader(self).upload(face_path)
+
+    def start_watch_face_upload(self, size_int):
+        """Start watch face upload
+
+        Experimental. Sent right away, also inside coalesce_writes() blocks, and never
+        queued in the journal.
+
+        Args:
+            size_int (int): Size of the watch face file in bytes.
+
+        tested_and_working: False
+        """
+        return self._send_immediate_cmd(0x6E, ">I", size_int)
+
+    def start_watch_face_file_transfer(self, offset_int):
+        """Start or resume watch face file transfer
+
+        Experimental. The argument may be the size rather than the offset.
+
+        tested_and_working: False
+
+        Args:
+            offset_int (int): Offset in the file of the next byte to be written.
+
+        Returns:
+            int: Offset at which the watch will accept the next byte.
+        """
+        return self._get_raw_cmd(0x74, ">I", ">I", offset_int)
+
+    def ui_file_transfer(self):
+        """Get watch face file transfer progress
+
+        Experimental.
+
+        tested_and_working: False
+
+        Returns:
+            int: Number of bytes received by the watch.
+        """
+        return self._get_raw_cmd(0x6C, None, ">I")
+
     # Breathing light
 
     # This is what I've found about origin of the term, "breathing light." I've now seen